@@ -0,0 +1,352 @@
+import argparse
+from datetime import date, datetime
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import urllib.parse
+
+import cmorph_ctl
+import cmorph_local_server
+import cmorph_synthetic
+
+# ------------------------------------------------------------------------------
+# the ingest timed by each scenario, as (module, product of the synthetic
+# archive read by the ingest), the ingest runs against the local server in a
+# process of its own, so each scenario's peak memory use is measured separately
+SCENARIOS = {
+    'daily': ('ingest_cmorph_daily', 'cics_raw'),
+    'full': ('ingest_cmorph', 'cics_raw'),
+    'icdr': ('ingest_cmorph_daily_icdr', 'icdr'),
+}
+
+
+# ------------------------------------------------------------------------------
+def _peak_rss_bytes():
+
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+# ------------------------------------------------------------------------------
+def _run_scenario(scenario: str,
+                  base_url: str,
+                  work_dir: str,
+                  start_date: date,
+                  end_date: date,
+                  options: dict,
+                  results):
+    """
+    Runs a scenario's ingest, pointed at the local server, and puts the number
+    of time steps it wrote, its elapsed time and peak memory use onto a results
+    queue. Run in a fresh process.
+    """
+
+    module_name, _ = SCENARIOS[scenario]
+    module = __import__(module_name)
+
+    # point the ingest at the local server, keeping the remote path below the server's root
+    module._URL_BASE = urllib.parse.urljoin(base_url, urllib.parse.urlparse(module._URL_BASE).path.lstrip('/'))
+
+    # keep the data descriptors fetched from the local server out of the user's cache
+    cmorph_ctl.DEFAULT_CACHE_DIR = os.path.join(work_dir, 'descriptors')
+
+    output_file = os.path.join(work_dir, 'benchmark_{0}.nc'.format(scenario))
+    years = list(range(start_date.year, end_date.year + 1))
+
+    start = time.perf_counter()
+    if scenario == 'daily':
+        module.ingest_cmorph_to_netcdf(work_dir,
+                                       output_file,
+                                       obs_type='raw',
+                                       download_files=True,
+                                       remove_files=True,
+                                       download_workers=options['download_workers'],
+                                       in_memory=options['in_memory'],
+                                       decompress_workers=options['decompress_workers'],
+                                       pipeline_workers=options['pipeline_workers'],
+                                       years=years)
+    elif scenario == 'full':
+        module.ingest_cmorph_to_netcdf_full(work_dir,
+                                            output_file,
+                                            raw=True,
+                                            download_workers=options['download_workers'],
+                                            in_memory=options['in_memory'],
+                                            decompress_workers=options['decompress_workers'],
+                                            years=years)
+    else:
+        module.ingest_cmorph_to_netcdf(work_dir,
+                                       output_file,
+                                       start_date.strftime('%Y-%m-%d'),
+                                       end_date.strftime('%Y-%m-%d'),
+                                       obs_type='icdr',
+                                       download_files=True,
+                                       remove_files=True,
+                                       manual_dates=True,
+                                       download_workers=options['download_workers'],
+                                       in_memory=options['in_memory'],
+                                       decompress_workers=options['decompress_workers'],
+                                       pipeline_workers=options['pipeline_workers'])
+    elapsed = time.perf_counter() - start
+
+    # the time steps the ingest actually wrote, rather than those asked for
+    import netCDF4
+    with netCDF4.Dataset(output_file) as dataset:
+        time_steps = len(dataset.variables['time'])
+
+    results.put({'time_steps': time_steps,
+                 'elapsed': elapsed,
+                 'peak_rss_bytes': _peak_rss_bytes(),
+                 'output_bytes': os.path.getsize(output_file)})
+
+
+# ------------------------------------------------------------------------------
+def run_benchmarks(archive_dir: str,
+                   work_dir: str,
+                   start_date: date,
+                   end_date: date,
+                   scenarios=tuple(SCENARIOS),
+                   protocol='http',
+                   latency=0.0,
+                   download_workers=1,
+                   in_memory=False,
+                   pipeline_workers=1,
+                   certfile=None,
+                   fault_rate=0.0,
+                   decompress_workers=1,
+                   grid_shape=cmorph_synthetic.GRID_SHAPE):
+    """
+    Times the ingest scripts end to end against a synthetic archive served
+    locally, so throughput can be tracked without going to the NOAA servers.
+
+    The archive is built as needed, with the files already present reused, and
+    each scenario runs in a process of its own.
+
+    :param str archive_dir: directory of the synthetic archive
+    :param str work_dir: directory for the ingests' downloaded files and outputs
+    :param datetime.date start_date: first date to ingest, the daily and full
+        scenarios ingest whole years, from January 1st of this date's year
+    :param datetime.date end_date: final date to ingest, the daily and full
+        scenarios ingest through December 31st of this date's year
+    :param scenarios: names of the scenarios to run, from SCENARIOS
+    :param str protocol: "http", "https" or "ftp", the protocol of the local server
+    :param float latency: seconds the HTTP(S) server waits before answering each request
+    :param int download_workers: number of daily files downloaded concurrently
+    :param bool in_memory: whether the downloaded files are decompressed and decoded in memory
+    :param int pipeline_workers: number of months downloaded and read ahead of the writes
+    :param str certfile: PEM file with the certificate and private key of the HTTPS server,
+        which the ingests trust through the SSL_CERT_FILE environment variable
+    :param float fault_rate: fraction of the local server's file requests which fail,
+        either with an error or cut short, to exercise the ingests' download retries
+    :param int decompress_workers: number of processes decompressing the downloaded files
+    :param tuple grid_shape: (lat, lon) shape of the synthetic archive's grid, the
+        full global grid by default, a smaller one for a quick check that all the
+        scenarios run (the archive directory should then be a fresh one)
+    :return: dictionary of each scenario's results: days ingested, elapsed
+        seconds, days per second, downloaded MB per second and peak RSS (MB)
+    :rtype: dict
+    """
+
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError('Invalid scenario: {0}'.format(scenario))
+
+    # the daily and full ingests cover whole years
+    whole_years = any(scenario != 'icdr' for scenario in scenarios)
+    archive_start = date(start_date.year, 1, 1) if whole_years else start_date
+    archive_end = date(end_date.year, 12, 31) if whole_years else end_date
+    products = sorted({SCENARIOS[scenario][1] for scenario in scenarios})
+    archive_files = cmorph_synthetic.build_archive(archive_dir, archive_start, archive_end, products,
+                                                   grid_shape=grid_shape)
+
+    if protocol == 'https':
+        if certfile is None:
+            raise ValueError('A certificate file is required for HTTPS')
+        os.environ['SSL_CERT_FILE'] = certfile
+    if protocol in ('http', 'https'):
+        server, base_url = cmorph_local_server.serve_http(archive_dir, latency=latency, certfile=certfile,
+                                                          fault_rate=fault_rate)
+    else:
+        server, base_url = cmorph_local_server.serve_ftp(archive_dir, fault_rate=fault_rate)
+
+    options = {'download_workers': download_workers,
+               'in_memory': in_memory,
+               'pipeline_workers': pipeline_workers,
+               'decompress_workers': decompress_workers}
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for scenario in scenarios:
+
+            # the days and bytes read by the scenario's ingest
+            product = SCENARIOS[scenario][1]
+            if scenario == 'icdr':
+                first, last = start_date, end_date
+            else:
+                first, last = archive_start, archive_end
+            paths = archive_files[product][(first - archive_start).days:(last - archive_start).days + 1]
+
+            # the full ingest writes monthly steps, the others a step per day
+            if scenario == 'full':
+                expected_steps = (last.year - first.year) * 12 + last.month - first.month + 1
+            else:
+                expected_steps = len(paths)
+            input_bytes = sum(os.path.getsize(os.path.join(archive_dir, path)) for path in paths)
+
+            scenario_dir = os.path.join(work_dir, scenario)
+            os.makedirs(scenario_dir, exist_ok=True)
+
+            queue = context.Queue()
+            process = context.Process(target=_run_scenario,
+                                      args=(scenario, base_url, scenario_dir, start_date, end_date, options, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError('Benchmark scenario {0} failed with exit code {1}'.format(scenario,
+                                                                                             process.exitcode))
+            result = queue.get()
+
+            peak_rss = result['peak_rss_bytes']
+            if result['time_steps'] != expected_steps:
+                raise RuntimeError('Benchmark scenario {0} wrote {1} time steps, '
+                                   'expected {2}'.format(scenario, result['time_steps'], expected_steps))
+            results[scenario] = {'days': len(paths),
+                                 'elapsed': result['elapsed'],
+                                 'days_per_second': len(paths) / result['elapsed'],
+                                 'input_mb': input_bytes / 1024 ** 2,
+                                 'mb_per_second': input_bytes / 1024 ** 2 / result['elapsed'],
+                                 'output_mb': result['output_bytes'] / 1024 ** 2,
+                                 'peak_rss_mb': None if peak_rss is None else peak_rss / 1024 ** 2}
+    finally:
+        if protocol in ('http', 'https'):
+            server.shutdown()
+        else:
+            server.close_all()
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    # Times the ingest scripts end to end against a locally served synthetic
+    # archive, reporting the throughput and peak memory of each, for example:
+    #
+    # $ python -u benchmark_ingest.py --archive_dir /data/cmorph_mirror --work_dir /data/bench \
+    #                                 --start_date 2017-01-01 --end_date 2017-12-31 --download_workers 8
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d  %H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archive_dir",
+                        help="Directory of the synthetic archive, built as needed and reused from run to run",
+                        required=True)
+    parser.add_argument("--work_dir",
+                        help="Directory for the ingests' downloaded files and outputs",
+                        required=True)
+    parser.add_argument("--start_date",
+                        help="First date to ingest (YYYY-MM-DD format), the daily and full ingests start on "
+                             "January 1st of its year",
+                        type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        required=True)
+    parser.add_argument("--end_date",
+                        help="Final date to ingest (YYYY-MM-DD format), the daily and full ingests end on "
+                             "December 31st of its year",
+                        type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        required=True)
+    parser.add_argument("--scenario",
+                        help="Scenario to run, may be repeated, all scenarios by default",
+                        choices=list(SCENARIOS),
+                        action='append',
+                        dest='scenarios')
+    parser.add_argument("--protocol",
+                        help="Protocol of the local server, https requires --certfile",
+                        choices=['http', 'https', 'ftp'],
+                        default='http')
+    parser.add_argument("--certfile",
+                        help="PEM file with the certificate and private key of the local HTTPS server",
+                        required=False)
+    parser.add_argument("--latency",
+                        help="Seconds the HTTP(S) server waits before answering each request",
+                        type=float,
+                        default=0.0)
+    parser.add_argument("--fault_rate",
+                        help="Fraction of the local server's file requests which fail, with an error or cut short",
+                        type=float,
+                        default=0.0)
+    parser.add_argument("--download_workers",
+                        help="Number of daily files to download concurrently",
+                        type=int,
+                        default=1)
+    parser.add_argument("--in_memory",
+                        help="Decompress and decode downloaded files in memory",
+                        action='store_true',
+                        default=False)
+    parser.add_argument("--pipeline_workers",
+                        help="Number of months downloaded and read ahead of the writes (daily and ICDR ingests)",
+                        type=int,
+                        default=1)
+    parser.add_argument("--decompress_workers",
+                        help="Number of processes decompressing the downloaded files",
+                        type=int,
+                        default=1)
+    parser.add_argument("--json_file",
+                        help="File to which the results are written as JSON, for tracking over time",
+                        required=False)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.archive_dir,
+                             args.work_dir,
+                             args.start_date,
+                             args.end_date,
+                             args.scenarios or list(SCENARIOS),
+                             args.protocol,
+                             args.latency,
+                             args.download_workers,
+                             args.in_memory,
+                             args.pipeline_workers,
+                             args.certfile,
+                             args.fault_rate,
+                             args.decompress_workers)
+
+    print('\nIngest throughput, %s through %s over %s' % (args.start_date, args.end_date, args.protocol))
+    print('\t%-10s %8s %10s %10s %10s %14s' % ('Scenario', 'Days', 'Seconds', 'Days/s', 'MB/s', 'Peak RSS (MB)'))
+    for scenario, result in results.items():
+        peak_rss = 'n/a' if result['peak_rss_mb'] is None else '%.1f' % result['peak_rss_mb']
+        print('\t%-10s %8d %10.2f %10.2f %10.2f %14s' % (scenario,
+                                                         result['days'],
+                                                         result['elapsed'],
+                                                         result['days_per_second'],
+                                                         result['mb_per_second'],
+                                                         peak_rss))
+    print()
+
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as f_out:
+            json.dump({'start_date': str(args.start_date),
+                       'end_date': str(args.end_date),
+                       'protocol': args.protocol,
+                       'latency': args.latency,
+                       'fault_rate': args.fault_rate,
+                       'download_workers': args.download_workers,
+                       'in_memory': args.in_memory,
+                       'pipeline_workers': args.pipeline_workers,
+                       'decompress_workers': args.decompress_workers,
+                       'results': results},
+                      f_out,
+                      indent=4)
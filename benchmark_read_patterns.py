@@ -0,0 +1,38 @@
+import argparse
+
+import cmorph_netcdf
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    # Reports the map-read and series-read latencies of a NetCDF produced by the
+    # ingest scripts, for comparing chunking/compression layouts, for example:
+    #
+    # $ python -u benchmark_read_patterns.py --netcdf_file /data/cmorph/cmorph_conus_series.nc --samples 50
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--netcdf_file",
+                        help="NetCDF file with a (time, lat, lon) variable to read",
+                        required=True)
+    parser.add_argument("--variable",
+                        help="Name of the (time, lat, lon) variable",
+                        default='prcp')
+    parser.add_argument("--samples",
+                        help="Number of random maps and time series to read",
+                        type=int,
+                        default=20)
+    args = parser.parse_args()
+
+    results = cmorph_netcdf.benchmark_read_patterns(args.netcdf_file,
+                                                    variable_name=args.variable,
+                                                    samples=args.samples)
+
+    print('\nRead pattern latencies for %s' % args.netcdf_file)
+    print('\tShape:                 %s' % (results['shape'],))
+    print('\tChunking:              %s' % results['chunking'])
+    print('\tFilters:               %s' % results['filters'])
+    print('\tMap read (median):     %.6f s' % results['map_read_median'])
+    print('\tMap read (max):        %.6f s' % results['map_read_max'])
+    print('\tSeries read (median):  %.6f s' % results['series_read_median'])
+    print('\tSeries read (max):     %.6f s\n' % results['series_read_max'])
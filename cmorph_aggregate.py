@@ -0,0 +1,569 @@
+import argparse
+import logging
+
+import netCDF4
+import numpy as np
+
+import cmorph_metrics
+import cmorph_netcdf
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# temporal resolutions which daily values can be aggregated to:
+#   "pentad": 73 five day periods per year, with February 29th falling into the 12th pentad
+#   "dekad": three periods per month, the 1st-10th, 11th-20th and 21st through the end of the month
+#   "season": DJF, MAM, JJA and SON, with December belonging to the following year's winter
+CADENCES = ('pentad', 'dekad', 'month', 'season', 'year')
+
+# longest period of any cadence, in days (a leap year)
+_MAX_PERIOD_DAYS = 366
+
+
+# ------------------------------------------------------------------------------
+def parse_cadence(value: str):
+    """
+    Parses a cadence command line argument.
+
+    :param str value: "cadence:path", e.g. "dekad:/data/cmorph/cmorph_dekad.nc"
+    :return: (cadence, path) tuple
+    """
+
+    cadence, _, path = value.partition(':')
+    if cadence not in CADENCES or path == '':
+        raise ValueError('Invalid cadence: {0}, expected "cadence:path" with the cadence one of {1}'.format(value,
+                                                                                                          CADENCES))
+
+    return cadence, path
+
+
+# ------------------------------------------------------------------------------
+def period_starts(dates,
+                  cadence: str):
+    """
+    Computes the start of the period of a cadence which each of several days falls into.
+
+    :param dates: dates of the days
+    :param str cadence: one of CADENCES
+    :return: array of the periods' first days, one per date
+    :rtype: ndarray of datetime64[D]
+    """
+
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]')
+
+    if cadence == 'pentad':
+        # day of the year not counting February 29th, which goes with the 12th pentad (February 25th through March 1st)
+        year_starts = years.astype('datetime64[D]')
+        day_of_year = (dates - year_starts).astype(np.int64)
+        leap = ((years + 1).astype('datetime64[D]') - year_starts).astype(np.int64) == 366
+        after_leap_day = leap & (day_of_year >= 59)
+        pentads = (day_of_year - after_leap_day) // 5
+        return year_starts + (pentads * 5 + (leap & (pentads >= 12))).astype('timedelta64[D]')
+    elif cadence == 'dekad':
+        days = (dates - months.astype('datetime64[D]')).astype(np.int64)
+        return months.astype('datetime64[D]') + (np.minimum(days // 10, 2) * 10).astype('timedelta64[D]')
+    elif cadence == 'month':
+        return months.astype('datetime64[D]')
+    elif cadence == 'season':
+        # months counted from January 1970, December starts a season
+        month_counts = months.astype(np.int64)
+        return (month_counts - (month_counts + 1) % 3).astype('datetime64[M]').astype('datetime64[D]')
+    elif cadence == 'year':
+        return years.astype('datetime64[D]')
+
+    raise ValueError('Invalid cadence: {0}, expected one of {1}'.format(cadence, CADENCES))
+
+
+# ------------------------------------------------------------------------------
+def periods_between(first_date,
+                    last_date,
+                    cadence: str):
+    """
+    :param first_date: first day of a date range
+    :param last_date: final day of the date range
+    :param str cadence: one of CADENCES
+    :return: the first days of the periods overlapping the date range, in order
+    :rtype: ndarray of datetime64[D]
+    """
+
+    days = np.arange(np.datetime64(first_date, 'D'), np.datetime64(last_date, 'D') + 1)
+    return np.unique(period_starts(days, cadence))
+
+
+# ------------------------------------------------------------------------------
+def period_length(period_start,
+                  cadence: str):
+    """
+    :param period_start: first day of a period
+    :param str cadence: one of CADENCES
+    :return: number of days in the period
+    :rtype: int
+    """
+
+    period_start = np.datetime64(period_start, 'D')
+    days = period_start + np.arange(1, _MAX_PERIOD_DAYS + 1)
+    return int((days[np.argmax(period_starts(days, cadence) != period_start)] - period_start).astype(np.int64))
+
+
+# ------------------------------------------------------------------------------
+def daily_total(subdaily,
+                min_valid_steps=1):
+    """
+    Reduces a day's sub-daily accumulations (e.g. the 8 values in mm/3hr of
+    3-hourly data) to the day's total, ignoring missing values.
+
+    :param subdaily: array of the day's sub-daily values, shape (steps, lat, lon), with NaNs as missing values
+    :param int min_valid_steps: number of the day's steps which must be valid
+        for a grid cell's total, otherwise the total is NaN
+    :return: array of the daily totals, shape (lat, lon)
+    :rtype: ndarray
+    """
+
+    with cmorph_metrics.timed('aggregate') as sample:
+        valid_steps = np.count_nonzero(~np.isnan(subdaily), axis=0)
+        total = np.nansum(subdaily, axis=0, dtype='f4')
+        total[valid_steps < max(1, min_valid_steps)] = np.NaN
+        sample.bytes = subdaily.nbytes
+
+    return total
+
+
+# ------------------------------------------------------------------------------
+class Aggregator:
+    """
+    Streaming aggregation of daily values to several cadences at once, so that
+    pentads, dekads, months, seasons and years all come out of a single pass
+    over the daily data.
+
+    A running (float32) sum and a count of the valid (non-NaN) days are kept for
+    the current period of each cadence. Whenever a day falls beyond a cadence's
+    current period, the period is complete and it's handed to the output
+    function, as the period's total (NaN where too few days are valid) and its
+    valid day counts. Days must be added in ascending date order, gaps are fine.
+    """
+
+    def __init__(self,
+                 cadences,
+                 emit,
+                 min_valid_fraction=0.0):
+        """
+        :param cadences: cadences to aggregate to, from CADENCES
+        :param emit: function called with the cadence, the period's first day
+            (datetime64[D]), the total and the number of valid days of each
+            completed period, in period order for each cadence
+        :param float min_valid_fraction: fraction of a period's days which must
+            be valid for a grid cell's total, otherwise the total is NaN, where
+            0 requires a single valid day
+        """
+
+        for cadence in cadences:
+            if cadence not in CADENCES:
+                raise ValueError('Invalid cadence: {0}, expected one of {1}'.format(cadence, CADENCES))
+        if not 0.0 <= min_valid_fraction <= 1.0:
+            raise ValueError('Invalid minimum valid fraction: {0}'.format(min_valid_fraction))
+
+        self.emit = emit
+        self.min_valid_fraction = min_valid_fraction
+
+        # cadence -> [period start, running sum, valid day counts], None until the first day arrives
+        self._periods = {cadence: None for cadence in cadences}
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+
+        return self
+
+    # --------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+
+    # --------------------------------------------------------------------------
+    def add(self,
+            dates,
+            values):
+        """
+        Adds a run of days to the running sums, e.g. a single day or a slab of
+        consecutive days read at once.
+
+        :param dates: dates of the days, in ascending order
+        :param values: array of the days' values, shape (days, lat, lon), with NaNs as missing values
+        """
+
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        values = np.asarray(values)
+        for cadence in self._periods:
+
+            # split the days into runs falling into the same period
+            starts = period_starts(dates, cadence)
+            run_starts = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+            run_ends = np.append(run_starts[1:], len(dates))
+
+            for run_start, run_end in zip(run_starts, run_ends):
+
+                period = self._periods[cadence]
+                if period is not None and period[0] != starts[run_start]:
+                    if starts[run_start] < period[0]:
+                        raise ValueError('Days out of order, {0} follows {1}'.format(dates[run_start], period[0]))
+                    self._emit(cadence)
+                    period = None
+                if period is None:
+                    period = [starts[run_start],
+                              np.zeros(values.shape[1:], dtype='f4'),
+                              np.zeros(values.shape[1:], dtype='i2')]
+                    self._periods[cadence] = period
+
+                with cmorph_metrics.timed('aggregate') as sample:
+                    run = values[run_start:run_end]
+                    period[1] += np.nansum(run, axis=0)
+                    period[2] += np.count_nonzero(~np.isnan(run), axis=0).astype('i2')
+                    sample.bytes = run.nbytes
+
+    # --------------------------------------------------------------------------
+    def _emit(self,
+              cadence: str):
+
+        period_start, total, valid_days = self._periods[cadence]
+        self._periods[cadence] = None
+
+        min_valid_days = max(1, int(np.ceil(self.min_valid_fraction * period_length(period_start, cadence))))
+        total[valid_days < min_valid_days] = np.NaN
+        self.emit(cadence, period_start, total, valid_days)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Hands the final (possibly partial) period of each cadence to the output function.
+        """
+
+        for cadence, period in self._periods.items():
+            if period is not None:
+                self._emit(cadence)
+
+
+# ------------------------------------------------------------------------------
+def _create_cadence_netcdf(netcdf_file: str,
+                           cadence: str,
+                           title: str,
+                           lat_values,
+                           lon_values,
+                           time_values,
+                           units_since_year: int,
+                           chunking=None,
+                           complevel=0,
+                           shuffle=False,
+                           encoding=None):
+
+    output_dataset = netCDF4.Dataset(netcdf_file, 'w')
+
+    output_dataset.createDimension('time', None)
+    output_dataset.createDimension('lat', len(lat_values))
+    output_dataset.createDimension('lon', len(lon_values))
+    output_dataset.title = title
+
+    # the coordinate variables, with each time step at the first day of its period
+    time_variable = output_dataset.createVariable('time', 'i4', ('time',))
+    lat_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
+    lon_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
+    time_variable.units = 'days since {0}-01-01'.format(units_since_year)
+    time_variable.long_name = 'Time, first day of the {0}'.format(cadence)
+    time_variable.calendar = 'gregorian'
+    lat_variable.units = 'degrees_north'
+    lat_variable.long_name = 'Latitude'
+    lon_variable.units = 'degrees_east'
+    lon_variable.long_name = 'Longitude'
+    time_variable[:] = time_values
+    lat_variable[:] = np.array(lat_values, 'f4')
+    lon_variable[:] = np.array(lon_values, 'f4')
+
+    # the periods' totals and their numbers of valid days
+    data_variable = cmorph_netcdf.create_prcp_variable(output_dataset,
+                                                       ('time', 'lat', 'lon',),
+                                                       chunking,
+                                                       len(time_values),
+                                                       len(lat_values),
+                                                       len(lon_values),
+                                                       complevel,
+                                                       shuffle,
+                                                       encoding)
+    data_variable.units = 'mm'
+    data_variable.standard_name = 'precipitation'
+    data_variable.long_name = 'Precipitation, {0} total'.format(cadence)
+    data_variable.cell_methods = 'time: sum'
+    data_variable.description = title
+    count_variable = output_dataset.createVariable('valid_days',
+                                                   'i2',
+                                                   ('time', 'lat', 'lon',),
+                                                   fill_value=0,
+                                                   **cmorph_netcdf.prcp_variable_options(chunking,
+                                                                                         len(time_values),
+                                                                                         len(lat_values),
+                                                                                         len(lon_values),
+                                                                                         complevel,
+                                                                                         shuffle))
+    count_variable.long_name = 'Number of days with valid precipitation values in the {0}'.format(cadence)
+
+    return output_dataset
+
+
+# ------------------------------------------------------------------------------
+class CadenceWriter:
+    """
+    Writer of aggregated periods into a NetCDF of their own per cadence, used
+    as the output function of an Aggregator. The time axis of each NetCDF is
+    laid out up front from the full date range, so periods without any days
+    remain as NaNs.
+    """
+
+    def __init__(self,
+                 outputs,
+                 first_date,
+                 last_date,
+                 title: str,
+                 lat_values,
+                 lon_values,
+                 units_since_year=1900,
+                 chunking=None,
+                 complevel=0,
+                 shuffle=False,
+                 encoding=None):
+        """
+        :param outputs: list of (cadence, NetCDF file) tuples
+        :param first_date: first day of the date range being aggregated
+        :param last_date: final day of the date range being aggregated
+        :param str title: title of the outputs
+        :param lat_values: latitude coordinate values
+        :param lon_values: longitude coordinate values
+        :param int units_since_year: year of the time units' reference date
+        :param chunking: chunk layout of the variables, "map", "series", an explicit (time, lat, lon) tuple, or
+            None to leave it up to the NetCDF library
+        :param int complevel: zlib compression level of the variables, 0 for no compression
+        :param bool shuffle: whether to apply the shuffle filter to the variables before compression
+        :param tuple encoding: storage encoding of the totals, from cmorph_netcdf.parse_encoding(), None for
+            full precision float32, packed int16 totals need a scale factor allowing for the longest period's totals
+        """
+
+        self.cadences = [cadence for cadence, _ in outputs]
+        self._datasets = {}
+        self._periods = {}
+        try:
+            for cadence, netcdf_file in outputs:
+                periods = periods_between(first_date, last_date, cadence)
+                time_values = (periods - np.datetime64('{0:04d}-01-01'.format(units_since_year), 'D')).astype(np.int64)
+                self._datasets[cadence] = _create_cadence_netcdf(netcdf_file,
+                                                                 cadence,
+                                                                 title,
+                                                                 lat_values,
+                                                                 lon_values,
+                                                                 time_values,
+                                                                 units_since_year,
+                                                                 chunking,
+                                                                 complevel,
+                                                                 shuffle,
+                                                                 encoding)
+                self._periods[cadence] = periods
+        except BaseException:
+            self.close()
+            raise
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+
+        return self
+
+    # --------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    # --------------------------------------------------------------------------
+    def __call__(self,
+                 cadence: str,
+                 period_start,
+                 total,
+                 valid_days):
+        """
+        Writes a period's total and valid day counts at the period's time step.
+        """
+
+        time_index = np.searchsorted(self._periods[cadence], period_start)
+        if time_index >= len(self._periods[cadence]) or self._periods[cadence][time_index] != period_start:
+            _logger.warning('Skipping %s %s, outside of the date range', cadence, period_start)
+            return
+
+        dataset = self._datasets[cadence]
+        with cmorph_metrics.timed('write') as sample:
+            dataset.variables['prcp'][time_index, :, :] = cmorph_netcdf.pack_values(dataset.variables['prcp'], total)
+            dataset.variables['valid_days'][time_index, :, :] = valid_days
+            sample.bytes = total.nbytes + valid_days.nbytes
+        _logger.info('Wrote %s %s', cadence, period_start)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+
+
+# ------------------------------------------------------------------------------
+def read_daily_netcdf(netcdf_file: str,
+                      slab_size=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                      variable_name='prcp',
+                      stop=None):
+    """
+    Reads the days of a daily NetCDF in slabs of consecutive time steps, skipping
+    the steps without a time value (e.g. of an output not completely written).
+
+    :param str netcdf_file: daily NetCDF, with time units of "days since <date>"
+    :param int slab_size: number of days read at once
+    :param str variable_name: name of the (time, lat, lon) variable
+    :param int stop: time step at which to stop reading, all steps if None
+    :return: generator of (dates, values) tuples, with the slab's dates as
+        datetime64[D] and its values as a (days, lat, lon) array with NaNs as missing values
+    """
+
+    with netCDF4.Dataset(netcdf_file, 'r') as dataset:
+
+        time_variable = dataset.variables['time']
+        origin = np.datetime64(time_variable.units.split('since')[1].strip()[:10], 'D')
+        time_values = time_variable[:stop]
+        valid = ~np.ma.getmaskarray(time_values)
+        dates = origin + np.ma.filled(time_values, 0).astype(np.int64).astype('timedelta64[D]')
+
+        variable = dataset.variables[variable_name]
+        for start in range(0, len(dates), slab_size):
+            slab = slice(start, min(start + slab_size, len(dates)))
+            if not np.any(valid[slab]):
+                continue
+            values = np.ma.filled(variable[slab].astype('f4'), np.NaN)
+            yield dates[slab][valid[slab]], values[valid[slab]]
+
+
+# ------------------------------------------------------------------------------
+def aggregate_daily_netcdf(daily_netcdf_file: str,
+                           outputs,
+                           min_valid_fraction=0.0,
+                           slab_size=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                           chunking=None,
+                           complevel=0,
+                           shuffle=False,
+                           encoding=None):
+    """
+    Aggregates an existing daily NetCDF to several cadences in a single pass,
+    with each cadence written to a NetCDF of its own.
+
+    :param str daily_netcdf_file: daily NetCDF, e.g. the output of ingest_cmorph_daily.py
+    :param outputs: list of (cadence, NetCDF file) tuples
+    :param float min_valid_fraction: fraction of a period's days which must be
+        valid for a grid cell's total, otherwise the total is NaN
+    :param int slab_size: number of days read from the daily NetCDF at once
+    :param chunking: chunk layout of the outputs' variables
+    :param int complevel: zlib compression level of the outputs' variables, 0 for no compression
+    :param bool shuffle: whether to apply the shuffle filter to the outputs' variables before compression
+    :param tuple encoding: storage encoding of the outputs' totals, from cmorph_netcdf.parse_encoding()
+    """
+
+    with netCDF4.Dataset(daily_netcdf_file, 'r') as dataset:
+        title = getattr(dataset, 'title', '')
+        lat_values = dataset.variables['lat'][:]
+        lon_values = dataset.variables['lon'][:]
+        time_variable = dataset.variables['time']
+        units_since_year = int(time_variable.units.split('since')[1].strip()[:4])
+        origin = np.datetime64(time_variable.units.split('since')[1].strip()[:10], 'D')
+
+        # the days through the last one holding data, the steps after it (e.g. of a
+        # pre-sized output not completely written) may be without time values
+        last_index = cmorph_netcdf.last_ingested_step(dataset.variables['prcp'], time_variable)
+        if last_index is None:
+            raise ValueError('No ingested days in {0}'.format(daily_netcdf_file))
+        time_values = time_variable[:last_index + 1]
+        first_date = origin + int(time_values.compressed()[0])
+        last_date = origin + int(time_values[-1])
+
+    with CadenceWriter(outputs,
+                       first_date,
+                       last_date,
+                       title,
+                       lat_values,
+                       lon_values,
+                       units_since_year,
+                       chunking,
+                       complevel,
+                       shuffle,
+                       encoding) as writer, \
+            Aggregator(writer.cadences, writer, min_valid_fraction) as aggregator:
+        for dates, values in read_daily_netcdf(daily_netcdf_file, slab_size, stop=last_index + 1):
+            aggregator.add(dates, values)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    """
+    Aggregates a daily NetCDF to several cadences in a single pass, for example:
+
+    $ python -u cmorph_aggregate.py --daily_file /data/cmorph/cmorph_raw.nc \
+                                    --cadence dekad:/data/cmorph/cmorph_raw_dekad.nc \
+                                    --cadence season:/data/cmorph/cmorph_raw_season.nc
+    """
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d  %H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--daily_file",
+                        help="Daily NetCDF to aggregate",
+                        required=True)
+    parser.add_argument("--cadence",
+                        help="Cadence to write to its own NetCDF output file, as cadence:path with the cadence one "
+                             "of {0}, may be repeated".format(', '.join(CADENCES)),
+                        type=parse_cadence,
+                        action='append',
+                        dest='cadences',
+                        required=True)
+    parser.add_argument("--min_valid_fraction",
+                        help="Fraction of a period's days which must be valid for a total, otherwise it's missing",
+                        type=float,
+                        default=0.0,
+                        required=False)
+    parser.add_argument("--slab_size",
+                        help="Number of days read from the daily NetCDF at once",
+                        type=int,
+                        default=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                        required=False)
+    parser.add_argument("--chunking",
+                        help="Chunk layout of the output variables: map, series, or an explicit chunk shape as "
+                             "time,lat,lon",
+                        type=cmorph_netcdf.parse_chunking,
+                        required=False)
+    parser.add_argument("--complevel",
+                        help="Compression level (1 through 9) of the output variables, 0 for no compression",
+                        type=int,
+                        choices=range(0, 10),
+                        default=0,
+                        required=False)
+    parser.add_argument("--shuffle",
+                        help="Apply the shuffle filter to the output variables before compression",
+                        action='store_true',
+                        required=False)
+    parser.add_argument("--encoding",
+                        help="Storage encoding of the totals: float32, int16:scale (packed 16-bit integers with a "
+                             "precision of scale mm, allowing for totals up to 65534 times the scale), digits:N or "
+                             "bitround:N (quantized 32-bit floats)",
+                        type=cmorph_netcdf.parse_encoding,
+                        required=False)
+    args = parser.parse_args()
+
+    aggregate_daily_netcdf(args.daily_file,
+                           args.cadences,
+                           args.min_valid_fraction,
+                           args.slab_size,
+                           args.chunking,
+                           args.complevel,
+                           args.shuffle,
+                           args.encoding)
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+import logging
+import threading
+
+import numpy as np
+
+import cmorph_catalog
+import cmorph_ctl
+import cmorph_io
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# default number of daily files kept memory-mapped for reuse by later reads
+DEFAULT_OPEN_FILES = 32
+
+
+# ------------------------------------------------------------------------------
+class CmorphArchive:
+    """
+    Lazy, random access view of a directory of (decompressed) raw CMORPH daily
+    files as a single (time, lat, lon) array, for reading a few days or a small
+    region without ingesting the whole archive:
+
+        archive = CmorphArchive(cmorph_ctl.read_descriptor('CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl'),
+                                '/data/cmorph/raw')
+        window = archive[-30:, 100:140, 200:260]
+
+    Indexing is NumPy style, with an integer, a slice or an array of indices
+    (or booleans) per dimension, and nothing is read until the array is
+    indexed. Only the files of the time steps asked for are opened, through
+    memory maps, and of each only the grid rows covering the latitudes asked
+    for are touched. The values are converted from the files' byte order and
+    missing values become NaNs, as by the ingests. Days without a file read as
+    NaNs.
+
+    The time axis runs from the first through the final file's day, with the
+    descriptor's number of time steps per day (e.g. 8 for the CRT 3-hourly
+    files, each holding a day's 3-hourly grids). The most recently used files
+    are kept mapped, up to a bounded number, so that reads of the same days
+    don't reopen them.
+    """
+
+    def __init__(self,
+                 data_desc: dict,
+                 directory: str,
+                 open_files=DEFAULT_OPEN_FILES):
+        """
+        :param dict data_desc: data description dictionary from cmorph_ctl.parse_descriptor(),
+            whose DSET template gives the daily files' names
+        :param str directory: directory containing the decompressed daily files
+        :param int open_files: maximum number of files kept memory-mapped
+        """
+
+        if open_files < 1:
+            raise ValueError('Invalid number of open files: {0}'.format(open_files))
+
+        self.data_desc = data_desc
+        self.directory = directory
+        self.open_files = open_files
+
+        self.catalog = cmorph_catalog.FileCatalog.scan(directory, cmorph_ctl.file_prefix(data_desc['dset']))
+        if len(self.catalog) == 0:
+            raise ValueError('No daily files in {0}'.format(directory))
+
+        # the files of all days from the first through the final file's, None for the missing days
+        self.dates = np.arange(self.catalog.dates[0], self.catalog.dates[-1] + 1)
+        self._files = np.full(len(self.dates), None, dtype=object)
+        self._files[cmorph_catalog.day_offsets(self.catalog.dates, self.dates[0])] = self.catalog.sources
+
+        self.steps_per_day = data_desc['steps_per_day']
+        self.lat_values = np.array(data_desc['ydef_values'], dtype='f4')
+        self.lon_values = np.array(data_desc['xdef_values'], dtype='f4')
+        self._grid_shape = (data_desc['ydef_count'], data_desc['xdef_count'])
+        self._grid_bytes = self._grid_shape[0] * self._grid_shape[1] * np.dtype('f4').itemsize
+
+        # path -> memory map of the file's bytes, in order of use
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    @property
+    def shape(self):
+
+        return (len(self.dates) * self.steps_per_day,) + self._grid_shape
+
+    # --------------------------------------------------------------------------
+    @property
+    def ndim(self):
+
+        return 3
+
+    # --------------------------------------------------------------------------
+    @property
+    def dtype(self):
+
+        return np.dtype('f4')
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+
+        return self.shape[0]
+
+    # --------------------------------------------------------------------------
+    @property
+    def times(self):
+        """
+        :return: the start time of each time step
+        :rtype: ndarray of datetime64[m]
+        """
+
+        minutes = 24 * 60 // self.steps_per_day
+        offsets = np.arange(self.steps_per_day) * np.timedelta64(minutes, 'm')
+        return (self.dates.astype('datetime64[m]')[:, np.newaxis] + offsets).ravel()
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the files kept memory-mapped, the archive can still be read afterwards.
+        """
+
+        with self._lock:
+            self._maps.clear()
+
+    # --------------------------------------------------------------------------
+    def __getitem__(self,
+                    key):
+        """
+        :param key: index of the time dimension, or a tuple of the indices of
+            up to three dimensions (time, lat, lon), each an integer, a slice,
+            or an array of indices or booleans
+        :return: the values, with NaNs for missing values and missing days, the
+            dimensions indexed by an integer being dropped, as by NumPy
+        :rtype: ndarray
+        """
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError('Too many indices for a 3-dimensional archive: {0}'.format(len(key)))
+        key = key + (slice(None),) * (3 - len(key))
+
+        # the indices along each dimension, a scalar for an integer index
+        indices = [np.arange(size)[index] for size, index in zip(self.shape, key)]
+        steps, rows, columns = (np.atleast_1d(index) for index in indices)
+
+        values = np.full((len(steps), len(rows), len(columns)), np.NaN, dtype='f4')
+        if values.size > 0:
+
+            # only the rows and columns spanned by the indices are read, the
+            # window is then indexed relative to its first row and column
+            row_range = (int(rows.min()), int(rows.max()) + 1)
+            column_range = (int(columns.min()), int(columns.max()) + 1)
+            window_rows = rows - row_range[0]
+            window_columns = columns - column_range[0]
+
+            for position, step in enumerate(steps):
+                day, record = divmod(int(step), self.steps_per_day)
+                path = self._files[day]
+                if path is None:
+                    continue
+                window = cmorph_io.load_daily_window(self._record(path, record),
+                                                     self._grid_shape,
+                                                     row_range,
+                                                     [column_range],
+                                                     self.data_desc['little_endian'],
+                                                     self.data_desc['undef'])
+                values[position] = window[np.ix_(window_rows, window_columns)]
+
+        # drop the dimensions indexed by an integer
+        return values[tuple(0 if np.ndim(index) == 0 else slice(None) for index in indices)]
+
+    # --------------------------------------------------------------------------
+    def _record(self,
+                path: str,
+                record: int):
+
+        # the bytes of one of a file's grids, a view of the file's memory map
+        with self._lock:
+            mapped = self._maps.get(path)
+            if mapped is not None:
+                self._maps.move_to_end(path)
+            else:
+                mapped = np.memmap(path, dtype=np.uint8, mode='r')
+                self._maps[path] = mapped
+                while len(self._maps) > self.open_files:
+                    self._maps.popitem(last=False)
+
+        start = record * self._grid_bytes
+        if len(mapped) < start + self._grid_bytes:
+            raise ValueError('Daily file too short for {0} grids of {1}: {2}'.format(record + 1,
+                                                                                    self._grid_shape, path))
+        return mapped[start:start + self._grid_bytes]
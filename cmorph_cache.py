@@ -0,0 +1,320 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# default size budget for the cache, 50 GB is roughly the full compressed daily archive of a single product
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+
+# name of the manifest of the cached files' remote metadata, at the top of the cache directory
+MANIFEST_NAME = 'manifest.json'
+
+# seconds since a temporary file was last written beyond which it's taken as
+# left behind by an interrupted run, rather than being written by another
+# process sharing the cache (e.g. a shard of a sharded ingest)
+STALE_TEMP_SECONDS = 60 * 60
+
+
+# ------------------------------------------------------------------------------
+class DownloadCache:
+    """
+    Persistent cache of downloaded (compressed) CMORPH files, kept in a local
+    directory and keyed by product and date, e.g. "adjusted/CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_20180101.bz2".
+
+    The total size of the cached files is kept under a maximum number of bytes
+    by evicting the least recently used files, with a file's modification time
+    marking its last use (access times are unreliable on noatime mounts), so
+    the recency order survives from one run to the next.
+
+    A manifest of the cached files is kept alongside them, recording for each
+    file the remote metadata it was downloaded with (URL, size, ETag and
+    Last-Modified headers or the FTP listing's modification time) and the
+    checksum of its contents, so a cached file can be revalidated against the
+    server, and a file which really changed told apart from one re-sent as is.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param str cache_dir: directory where cached files are kept, created if necessary
+        :param int max_bytes: maximum total size of the cached files
+        """
+
+        if max_bytes <= 0:
+            raise ValueError('Invalid cache size: {0}'.format(max_bytes))
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # index of the cached files, key -> size, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+        # the manifest, key -> metadata, and the keys whose metadata changed since the manifest was written
+        self._manifest = {}
+        self._dirty = set()
+        self._flush_lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+        self._manifest = {key: metadata for key, metadata in self._read_manifest().items() if key in self._entries}
+
+    # --------------------------------------------------------------------------
+    def _scan(self):
+
+        entries = []
+        now = time.time()
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if file_name == MANIFEST_NAME and dir_path == self.cache_dir:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if file_name.endswith('.tmp'):
+                        # removed if left behind by an interrupted run, another process may be writing it otherwise
+                        if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    # moved into place or evicted by another process sharing the cache
+                    continue
+                key = os.path.relpath(path, self.cache_dir).replace(os.sep, '/')
+                entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    # --------------------------------------------------------------------------
+    def _path(self,
+              key: str):
+
+        return os.path.join(self.cache_dir, *key.split('/'))
+
+    # --------------------------------------------------------------------------
+    def get(self,
+            key: str,
+            count_hit=True):
+        """
+        Looks up a file in the cache, marking it as recently used if present.
+
+        :param str key: product/file name key
+        :param bool count_hit: whether a cached file counts as a hit right away,
+            otherwise it's left for the caller to count with record(), once the
+            cached copy is known to be used (e.g. after revalidating it)
+        :return: path of the cached file, or None if the file isn't cached
+        """
+
+        path = self._path(key)
+        with self._lock:
+
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # removed from outside
+                self._total_bytes -= self._entries.pop(key)
+                self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if count_hit:
+                self.hits += 1
+            return path
+
+    # --------------------------------------------------------------------------
+    def record(self,
+               hit: bool):
+        """
+        Counts a lookup made with get(count_hit=False) once its outcome is known.
+
+        :param bool hit: whether the cached copy was used, rather than the file
+            being downloaded again
+        """
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # --------------------------------------------------------------------------
+    def metadata(self,
+                 key: str):
+        """
+        :param str key: product/file name key
+        :return: the metadata recorded in the manifest for the cached file, or
+            None if the file isn't cached or was cached without any
+        :rtype: dict
+        """
+
+        with self._lock:
+            metadata = self._manifest.get(key)
+            return None if metadata is None else dict(metadata)
+
+    # --------------------------------------------------------------------------
+    def put(self,
+            key: str,
+            source_path: str,
+            metadata=None):
+        """
+        Adds a copy of a file to the cache, then evicts least recently used files
+        as necessary to keep the cache within its size budget.
+
+        :param str key: product/file name key
+        :param str source_path: file to copy into the cache
+        :param dict metadata: remote metadata and checksum of the file, recorded
+            in the manifest (JSON serializable)
+        """
+
+        self._store(key, lambda temp_path: shutil.copyfile(source_path, temp_path), metadata)
+
+    # --------------------------------------------------------------------------
+    def put_bytes(self,
+                  key: str,
+                  data,
+                  metadata=None):
+        """
+        Adds a file to the cache from its contents in memory, then evicts least
+        recently used files as necessary to keep the cache within its size budget.
+
+        :param str key: product/file name key
+        :param data: bytes-like file contents
+        :param dict metadata: remote metadata and checksum of the file, recorded
+            in the manifest (JSON serializable)
+        """
+
+        def write(temp_path):
+            with open(temp_path, 'wb') as f_out:
+                f_out.write(data)
+
+        self._store(key, write, metadata)
+
+    # --------------------------------------------------------------------------
+    def _store(self,
+               key,
+               write_function,
+               metadata):
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file and move into place, so that concurrent
+        # readers (or an interrupted run) never see a partially written file
+        temp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+        try:
+            write_function(temp_path)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            if metadata is None:
+                self._forget(key)
+            else:
+                self._manifest[key] = metadata
+                self._dirty.add(key)
+
+        self.evict()
+
+    # --------------------------------------------------------------------------
+    def evict(self):
+        """
+        Removes the least recently used files until the total size of the cache
+        is within the size budget.
+        """
+
+        with self._lock:
+            while self._total_bytes > self.max_bytes and self._entries:
+                key, size = self._entries.popitem(last=False)
+                _logger.debug('Evicting %s from the download cache', key)
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                self._total_bytes -= size
+                self._forget(key)
+
+    # --------------------------------------------------------------------------
+    def _forget(self,
+                key: str):
+
+        # drops a file's metadata, called with the lock held
+        if self._manifest.pop(key, None) is not None:
+            self._dirty.add(key)
+
+    # --------------------------------------------------------------------------
+    def _read_manifest(self):
+
+        path = os.path.join(self.cache_dir, MANIFEST_NAME)
+        try:
+            with open(path) as f_in:
+                return json.load(f_in)
+        except FileNotFoundError:
+            return {}
+        except ValueError as ex:
+            _logger.warning('Ignoring the unreadable download cache manifest %s: %s', path, ex)
+            return {}
+
+    # --------------------------------------------------------------------------
+    def flush(self):
+        """
+        Writes the changes to the manifest, merged into the manifest as it is on
+        disk, so that processes sharing the cache (e.g. the shards of a sharded
+        ingest) keep each other's entries.
+        """
+
+        with self._flush_lock:
+
+            with self._lock:
+                if not self._dirty:
+                    return
+                changes = {key: self._manifest.get(key) for key in self._dirty}
+                self._dirty = set()
+
+            manifest = self._read_manifest()
+            for key, metadata in changes.items():
+                if metadata is None:
+                    manifest.pop(key, None)
+                else:
+                    manifest[key] = metadata
+
+            # written to a temporary file and moved into place, like the cached files
+            path = os.path.join(self.cache_dir, MANIFEST_NAME)
+            temp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+            try:
+                with open(temp_path, 'w') as f_out:
+                    json.dump(manifest, f_out)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    # --------------------------------------------------------------------------
+    def log_stats(self):
+        """
+        Logs the cache hit/miss counts.
+        """
+
+        _logger.info('Download cache %s:  %d hits, %d misses', self.cache_dir, self.hits, self.misses)
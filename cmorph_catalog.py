@@ -0,0 +1,213 @@
+import logging
+import os
+import re
+
+import numpy as np
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# the date stamp at the end of a daily file name, e.g. "CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_20170101.bz2"
+_DATE_STAMP = re.compile(r'_(\d{8})(\.\w+)*$')
+
+
+# ------------------------------------------------------------------------------
+def parse_dates(names):
+    """
+    Parses the dates of daily files from their names, in bulk.
+
+    :param names: file names or paths of daily files, each ending with a
+        "_YYYYMMDD" date stamp, optionally followed by extensions
+    :return: array of the files' dates
+    :rtype: ndarray of datetime64[D]
+    """
+
+    stamps = []
+    for name in names:
+        match = _DATE_STAMP.search(os.path.basename(name))
+        if match is None:
+            raise ValueError('No date stamp in file name: {0}'.format(name))
+        stamps.append(int(match.group(1)))
+    stamps = np.array(stamps, dtype=np.int64)
+
+    # assemble the dates from their year, month and day fields
+    years = stamps // 10000
+    months = stamps // 100 % 100
+    days = stamps % 100
+    dates = ((years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]')).astype('datetime64[D]') \
+        + (days - 1).astype('timedelta64[D]')
+
+    # invalid fields (e.g. February 30th) roll over into the following month
+    invalid = (months < 1) | (months > 12) | (days < 1) | \
+              (dates.astype('datetime64[M]') != (years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]'))
+    if np.any(invalid):
+        raise ValueError('Invalid date stamp: {0}'.format(stamps[np.argmax(invalid)]))
+
+    return dates
+
+
+# ------------------------------------------------------------------------------
+def day_offsets(dates,
+                origin):
+    """
+    Computes the number of days from an origin date to each of several dates,
+    i.e. the time indices of the dates along a daily time axis starting at the origin.
+
+    :param dates: dates, as datetime64 values or datetime objects
+    :param origin: date of the time axis' first time step
+    :return: array of day offsets
+    :rtype: ndarray of ints
+    """
+
+    return (np.asarray(dates, dtype='datetime64[D]') - np.datetime64(origin, 'D')).astype(np.int64)
+
+
+# ------------------------------------------------------------------------------
+def days_since(first_date,
+               last_date,
+               since_year: int):
+    """
+    Computes the time coordinate values of a daily time axis, in days since
+    January 1st of a reference year.
+
+    :param first_date: date of the first time step
+    :param last_date: date of the final time step
+    :param int since_year: year of the time units' reference date
+    :return: array of the time steps, measured in days since January 1st of the since year
+    :rtype: ndarray of ints
+    """
+
+    first_day = day_offsets(first_date, np.datetime64('{0:04d}-01-01'.format(since_year)))
+    return np.arange(first_day, first_day + day_offsets(last_date, first_date) + 1)
+
+
+# ------------------------------------------------------------------------------
+class FileCatalog:
+    """
+    Sorted index of the daily files available to an ingest, built once from a
+    single directory scan (or remote listing) with the dates parsed from the
+    file names in bulk.
+
+    The ingest uses the catalog's dates, rather than the order or the number of
+    files, to compute where each day is written along the time axis, so a
+    missing day leaves a gap (of NaNs) instead of shifting the following days.
+    """
+
+    def __init__(self,
+                 dates,
+                 sources):
+        """
+        :param dates: dates of the files, in any order
+        :param sources: the files' paths (or URLs), in the same order as the dates
+        """
+
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        sources = np.asarray(sources, dtype=object)
+        if len(dates) != len(sources):
+            raise ValueError('Mismatched numbers of dates and files: {0} and {1}'.format(len(dates), len(sources)))
+
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        sources = sources[order]
+
+        # keep a single file per date, the last one listed
+        unique = np.ones(len(dates), dtype=bool)
+        unique[:-1] = dates[1:] != dates[:-1]
+        if not np.all(unique):
+            _logger.warning('Ignoring %d duplicate daily files, e.g. %s', np.count_nonzero(~unique), sources[~unique][0])
+
+        self.dates = dates[unique]
+        self.sources = sources[unique]
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def from_names(cls,
+                   names):
+        """
+        Builds a catalog from a list of daily file names or paths, e.g. a remote listing.
+
+        :param names: file names or paths, each ending with a "_YYYYMMDD" date stamp
+        :return: the catalog of the files
+        :rtype: FileCatalog
+        """
+
+        names = list(names)
+        return cls(parse_dates(names), names)
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def scan(cls,
+             directory: str,
+             prefix: str,
+             suffix=''):
+        """
+        Builds a catalog of the daily files of a product found in a local directory.
+
+        :param str directory: directory containing the daily files
+        :param str prefix: file name prefix of the product's daily files, which
+            is followed by the "YYYYMMDD" date stamp
+        :param str suffix: file name extension following the date stamp, if any
+        :return: the catalog of the matching files
+        :rtype: FileCatalog
+        """
+
+        pattern = re.compile(re.escape(prefix) + r'\d{8}' + re.escape(suffix) + '$')
+        with os.scandir(directory) as entries:
+            paths = [entry.path for entry in entries if pattern.match(entry.name)]
+
+        catalog = cls.from_names(paths)
+        if len(catalog) > 0:
+            _logger.info('Found %d daily files in %s, %s through %s',
+                         len(catalog), directory, catalog.dates[0], catalog.dates[-1])
+        else:
+            _logger.warning('Found no daily files matching %s*%s in %s', prefix, suffix, directory)
+
+        return catalog
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+
+        return len(self.dates)
+
+    # --------------------------------------------------------------------------
+    def between(self,
+                start,
+                stop):
+        """
+        :param start: first date of the range
+        :param stop: date following the final date of the range
+        :return: the dates and the files within the range [start, stop), in date order
+        :rtype: tuple
+        """
+
+        first, last = np.searchsorted(self.dates, np.array([start, stop], dtype='datetime64[D]'))
+        return self.dates[first:last], list(self.sources[first:last])
+
+    # --------------------------------------------------------------------------
+    def month(self,
+              year: int,
+              month: int):
+        """
+        :param int year: year
+        :param int month: 1 == January, ..., 12 == December
+        :return: the dates and the files of the month, in date order
+        :rtype: tuple
+        """
+
+        start = np.datetime64('{0:04d}-{1:02d}'.format(year, month), 'M')
+        return self.between(start.astype('datetime64[D]'), (start + 1).astype('datetime64[D]'))
+
+    # --------------------------------------------------------------------------
+    def missing(self,
+                start,
+                stop):
+        """
+        :param start: first date of the range
+        :param stop: date following the final date of the range
+        :return: the dates within the range [start, stop) without a file, i.e. the gaps
+        :rtype: ndarray of datetime64[D]
+        """
+
+        dates = np.arange(np.datetime64(start, 'D'), np.datetime64(stop, 'D'))
+        return dates[~np.isin(dates, self.dates)]
@@ -0,0 +1,404 @@
+from datetime import datetime, timedelta
+import hashlib
+import http.client
+import json
+import logging
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import cmorph_download
+import cmorph_http
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# directory of the local cache of data descriptors, and the age beyond which a
+# cached descriptor is revalidated against the server before being used
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cmorph', 'descriptors')
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+# ------------------------------------------------------------------------------
+# the units of TDEF increments, as (unit, minutes), months and years having no fixed length
+_TIME_UNITS = {'mn': 1, 'hr': 60, 'dy': 24 * 60, 'mo': None, 'yr': None}
+
+# a GrADS absolute time, "[hh[:mm]z][dd]mmmyyyy", e.g. "01jan1998" or "00z01jan1998"
+_GRADS_TIME = re.compile(r'^(?:(\d{1,2})(?::(\d{2}))?z)?(\d{1,2})?([a-z]{3})(\d{4})$')
+_MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+# the substitutions of a DSET template, e.g. "%y4%m2%d2"
+_TEMPLATE_FIELDS = re.compile(r'%(y2|y4|m1|m2|mc|d1|d2|h1|h2|h3|n2|j3)')
+
+
+# ------------------------------------------------------------------------------
+def parse_time(value: str):
+    """
+    Parses a GrADS absolute time, e.g. "01jan1998", "00z01jan1998" or "12:30z1jan1998".
+
+    :param str value: the time
+    :return: the time, with the day defaulting to the first of the month
+    :rtype: datetime
+    """
+
+    match = _GRADS_TIME.match(value.lower())
+    if match is None or match.group(4) not in _MONTHS:
+        raise ValueError('Invalid GrADS time: {0}'.format(value))
+
+    hour, minute, day, month, year = match.groups()
+    return datetime(int(year), _MONTHS.index(month) + 1, int(day or 1), int(hour or 0), int(minute or 0))
+
+
+# ------------------------------------------------------------------------------
+def parse_increment(value: str):
+    """
+    Parses a GrADS time increment, e.g. "1dy", "3hr" or "30mn".
+
+    :param str value: the increment
+    :return: (number, unit) of the increment, with the unit one of "mn", "hr", "dy", "mo" or "yr"
+    :rtype: tuple
+    """
+
+    match = re.match(r'^(\d+)(mn|hr|dy|mo|yr)$', value.lower())
+    if match is None or int(match.group(1)) < 1:
+        raise ValueError('Invalid GrADS time increment: {0}'.format(value))
+
+    return int(match.group(1)), match.group(2)
+
+
+# ------------------------------------------------------------------------------
+def expand_template(template: str,
+                    timestamp):
+    """
+    Expands the substitutions of a DSET template for a time step, e.g.
+    "CMORPH_V1.0_RAW_0.25deg-DLY_00Z_%y4%m2%d2" to "CMORPH_V1.0_RAW_0.25deg-DLY_00Z_20170101".
+
+    :param str template: the template
+    :param timestamp: date or datetime of the time step
+    :return: the template with the time step's fields substituted
+    :rtype: str
+    """
+
+    def substitute(match):
+        field = match.group(1)
+        if field == 'y2':
+            return '{0:02d}'.format(timestamp.year % 100)
+        elif field == 'y4':
+            return '{0:04d}'.format(timestamp.year)
+        elif field == 'm1':
+            return str(timestamp.month)
+        elif field == 'm2':
+            return '{0:02d}'.format(timestamp.month)
+        elif field == 'mc':
+            return _MONTHS[timestamp.month - 1]
+        elif field == 'd1':
+            return str(timestamp.day)
+        elif field == 'd2':
+            return '{0:02d}'.format(timestamp.day)
+        elif field == 'j3':
+            return '{0:03d}'.format(timestamp.timetuple().tm_yday)
+        elif field == 'n2':
+            return '{0:02d}'.format(getattr(timestamp, 'minute', 0))
+        hour = getattr(timestamp, 'hour', 0)
+        return str(hour) if field == 'h1' else '{0:0{1}d}'.format(hour, int(field[1]))
+
+    return _TEMPLATE_FIELDS.sub(substitute, template)
+
+
+# ------------------------------------------------------------------------------
+def file_name(template: str,
+              timestamp):
+    """
+    :param str template: DSET template of a data descriptor, see parse_descriptor()
+    :param timestamp: date or datetime of a daily (or sub-daily) file
+    :return: name of the (uncompressed) data file for the time step, e.g. "CMORPH_V1.0_RAW_0.25deg-DLY_00Z_20170101"
+    :rtype: str
+    """
+
+    return os.path.basename(expand_template(template, timestamp))
+
+
+# ------------------------------------------------------------------------------
+def file_prefix(template: str):
+    """
+    :param str template: DSET template of a data descriptor, see parse_descriptor()
+    :return: the part of the data files' names preceding the template's time fields, e.g. for listing the files
+    :rtype: str
+    """
+
+    name = os.path.basename(template)
+    return name[:name.index('%')] if '%' in name else name
+
+
+# ------------------------------------------------------------------------------
+def _dimension(keyword: str,
+               tokens: list):
+    """
+    Parses the count and values of an XDEF, YDEF or ZDEF entry, either LINEAR
+    (start and increment) or LEVELS (the values, possibly over several lines).
+    """
+
+    count = int(tokens[0])
+    mapping = tokens[1].upper()
+    if mapping == 'LINEAR':
+        start = float(tokens[2])
+        increment = float(tokens[3])
+        values = [start + index * increment for index in range(count)]
+    elif mapping == 'LEVELS':
+        values = [float(token) for token in tokens[2:2 + count]]
+        if len(values) != count:
+            raise ValueError('Expected {0} {1} levels, found {2}'.format(count, keyword, len(values)))
+        start = values[0]
+        increment = values[1] - values[0] if count > 1 else 0.0
+    else:
+        raise ValueError('Unsupported {0} mapping: {1}'.format(keyword, tokens[1]))
+
+    return {'count': count, 'start': start, 'increment': increment, 'values': values}
+
+
+# ------------------------------------------------------------------------------
+def parse_descriptor(text: str):
+    """
+    Parses the contents of a GrADS data descriptor (.ctl) file, example below:
+
+        DSET ../0.25deg-DLY_00Z/%y4/%y4%m2/CMORPH_V1.0_RAW_0.25deg-DLY_00Z_%y4%m2%d2
+        TITLE  CMORPH Version 1.0BETA Version, daily precip from 00Z-24Z
+        OPTIONS template little_endian
+        UNDEF  -999.0
+        XDEF 1440 LINEAR    0.125  0.25
+        YDEF  480 LINEAR  -59.875  0.25
+        ZDEF   01 LEVELS 1
+        TDEF 99999 LINEAR  01jan1998 1dy
+        VARS 1
+        cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)
+        ENDVARS
+
+    Keywords are case insensitive, comment lines (starting with "*") and blank
+    lines are skipped, and LEVELS values may continue over several lines.
+
+    :param str text: contents of the descriptor
+    :return: data description dictionary, with the DSET template ("dset"),
+        "title", "undef", the "options" and whether the data is "little_endian",
+        the count, start, increment and values of each of the X, Y and Z
+        dimensions (e.g. "xdef_count", "xdef_start", "xdef_increment",
+        "xdef_values"), the time steps' "tdef_count", "start_date", "tdef_increment"
+        as (number, unit) and "steps_per_day", and the "variables" as a list of
+        dictionaries with their "name", "levels", GrADS units "code", data
+        "format" and "description",
+        with the first one's description also as "variable_description"
+    :rtype: dict
+    """
+
+    # group the lines into entries, each a keyword with its tokens, with LEVELS values continuing over lines
+    entries = []
+    for line in text.splitlines():
+        words = line.split()
+        if not words or words[0].startswith('*'):
+            continue
+        if entries and entries[-1][0] in ('XDEF', 'YDEF', 'ZDEF') and \
+                entries[-1][1][1].upper() == 'LEVELS' and len(entries[-1][1]) < int(entries[-1][1][0]) + 2:
+            entries[-1][1].extend(words)
+            continue
+        entries.append((words[0].upper(), words[1:], line.strip()))
+
+    data_dict = {'options': [], 'variables': []}
+    variable_count = None
+    for keyword, tokens, line in entries:
+
+        if variable_count is not None:
+            # one line per variable, "name levels code format description", the
+            # GrADS units code (e.g. 99) and data format (e.g. yyyyy) not being
+            # part of the description
+            if keyword == 'ENDVARS':
+                variable_count = None
+            else:
+                data_dict['variables'].append({'name': line.split()[0],
+                                               'levels': int(tokens[0]),
+                                               'code': tokens[1],
+                                               'format': tokens[2],
+                                               'description': ' '.join(tokens[3:])})
+            continue
+
+        if keyword == 'DSET':
+            data_dict['dset'] = line.split(None, 1)[1]
+        elif keyword == 'TITLE':
+            data_dict['title'] = ' '.join(tokens)
+        elif keyword == 'UNDEF':
+            data_dict['undef'] = float(tokens[0])
+        elif keyword == 'OPTIONS':
+            data_dict['options'].extend(token.lower() for token in tokens)
+        elif keyword in ('XDEF', 'YDEF', 'ZDEF'):
+            prefix = keyword.lower()
+            for name, value in _dimension(keyword, tokens).items():
+                data_dict['{0}_{1}'.format(prefix, name)] = value
+        elif keyword == 'TDEF':
+            if tokens[1].upper() != 'LINEAR':
+                raise ValueError('Unsupported TDEF mapping: {0}'.format(tokens[1]))
+            data_dict['tdef_count'] = int(tokens[0])
+            data_dict['start_date'] = parse_time(tokens[2])
+            data_dict['tdef_increment'] = parse_increment(tokens[3])
+        elif keyword == 'VARS':
+            variable_count = int(tokens[0])
+
+    for required in ('dset', 'undef', 'xdef_count', 'ydef_count', 'start_date'):
+        if required not in data_dict:
+            raise ValueError('Data descriptor without {0}'.format(required.split('_')[0].upper()))
+    if len(data_dict['variables']) == 0:
+        raise ValueError('Data descriptor without VARS')
+
+    # the byte order, GrADS files are little endian unless stated otherwise
+    data_dict['little_endian'] = 'big_endian' not in data_dict['options']
+    data_dict['template'] = 'template' in data_dict['options']
+
+    # the number of time steps per day, e.g. 8 for an increment of "3hr" or 1 for "1dy" (or longer)
+    number, unit = data_dict['tdef_increment']
+    minutes = _TIME_UNITS[unit]
+    if minutes is not None and number * minutes < 24 * 60:
+        data_dict['steps_per_day'] = (24 * 60) // (number * minutes)
+    else:
+        data_dict['steps_per_day'] = 1
+
+    data_dict.setdefault('title', '')
+    data_dict['variable_description'] = data_dict['variables'][0]['description']
+
+    return data_dict
+
+
+# ------------------------------------------------------------------------------
+def read_descriptor(descriptor_file: str):
+    """
+    :param str descriptor_file: path of a GrADS data descriptor (.ctl) file
+    :return: data description dictionary, see parse_descriptor()
+    :rtype: dict
+    """
+
+    with open(descriptor_file, 'r') as fp:
+        return parse_descriptor(fp.read())
+
+
+# ------------------------------------------------------------------------------
+def load_descriptor(url: str,
+                    cache_dir=None,
+                    max_age=DEFAULT_MAX_AGE):
+    """
+    Loads a data descriptor from the server, through a local cache, so that a
+    run only goes to the network for a descriptor that isn't cached or whose
+    cached copy is stale (older than the maximum age).
+
+    A stale copy is revalidated with a conditional request where the protocol
+    allows it (using the ETag and Last-Modified of the cached copy), so an
+    unchanged descriptor isn't downloaded again, and it's used as it is if the
+    server can't be reached. Without a cached copy a failed download is retried
+    with exponential backoff.
+
+    :param str url: URL of the descriptor
+    :param str cache_dir: directory of the cache, created if necessary, DEFAULT_CACHE_DIR if None
+    :param float max_age: seconds for which a cached descriptor is used without revalidation
+    :return: data description dictionary, see parse_descriptor()
+    :rtype: dict
+    """
+
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # the descriptor and its validators are cached under a name derived from the URL
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + '_' + os.path.basename(url)
+    descriptor_file = os.path.join(cache_dir, key)
+    metadata_file = descriptor_file + '.json'
+
+    metadata = None
+    if os.path.exists(descriptor_file) and os.path.exists(metadata_file):
+        with open(metadata_file, 'r') as fp:
+            metadata = json.load(fp)
+        if time.time() - metadata['validated'] < max_age:
+            return read_descriptor(descriptor_file)
+
+    # fetch the descriptor, or confirm the cached copy is still current, only with
+    # the validators the server gave, without any the request is unconditional
+    request = urllib.request.Request(url)
+    if metadata is not None and url.startswith('http'):
+        if metadata.get('etag'):
+            request.add_header('If-None-Match', metadata['etag'])
+        if metadata.get('last_modified'):
+            request.add_header('If-Modified-Since', metadata['last_modified'])
+
+    def fetch():
+        with urllib.request.urlopen(request, timeout=cmorph_http.DEFAULT_TIMEOUT) as response:
+            return response.read(), response.headers
+
+    # without a cached copy to fall back on, a failed download is retried
+    retries = cmorph_download.DEFAULT_RETRIES if metadata is None else 0
+    try:
+        contents, headers = cmorph_download.retry(fetch, url, retries)
+    except urllib.error.HTTPError as ex:
+        if ex.code != 304:
+            if metadata is None:
+                raise
+            _logger.warning('Failed to revalidate %s, using the cached copy: %s', url, ex)
+            return read_descriptor(descriptor_file)
+        _logger.info('Cached data descriptor for %s is current', url)
+        contents = None
+        headers = ex.headers
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as ex:
+        if metadata is None:
+            raise
+        _logger.warning('Failed to revalidate %s, using the cached copy: %s', url, ex)
+        return read_descriptor(descriptor_file)
+
+    if contents is not None:
+
+        # make sure it parses before it's cached
+        data_dict = parse_descriptor(contents.decode('ascii', errors='replace'))
+        _write_atomically(descriptor_file, contents)
+        _logger.info('Downloaded data descriptor %s', url)
+        metadata = {'url': url,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified')}
+    else:
+        data_dict = read_descriptor(descriptor_file)
+        metadata['etag'] = headers.get('ETag') or metadata.get('etag')
+        metadata['last_modified'] = headers.get('Last-Modified') or metadata.get('last_modified')
+
+    metadata['validated'] = time.time()
+    _write_atomically(metadata_file, json.dumps(metadata).encode('utf-8'))
+
+    return data_dict
+
+
+# ------------------------------------------------------------------------------
+def _write_atomically(path: str,
+                      contents: bytes):
+
+    # written to a temporary file and moved into place, since several
+    # processes (e.g. the shards of an ingest) may share the cache
+    temp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    try:
+        with open(temp_path, 'wb') as f_out:
+            f_out.write(contents)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# ------------------------------------------------------------------------------
+def time_step(data_desc: dict,
+              index: int):
+    """
+    :param dict data_desc: data description dictionary from parse_descriptor()
+    :param int index: index of a time step, 0 for the first
+    :return: the time of the time step
+    :rtype: datetime
+    """
+
+    number, unit = data_desc['tdef_increment']
+    start = data_desc['start_date']
+    if unit in ('mo', 'yr'):
+        months = start.month - 1 + index * number * (12 if unit == 'yr' else 1)
+        return start.replace(year=start.year + months // 12, month=months % 12 + 1)
+
+    return start + timedelta(minutes=index * number * _TIME_UNITS[unit])
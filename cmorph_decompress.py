@@ -0,0 +1,276 @@
+import bz2
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import gzip
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import zlib
+
+import cmorph_metrics
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# leading bytes identifying each compression, the same for concatenated
+# (multi-stream) files as written by parallel compressors
+_MAGIC = ((b'BZh', 'bz2'),
+          (b'\x1f\x8b', 'gz'))
+
+# number of leading bytes needed to identify a compression
+MAGIC_SIZE = max(len(magic) for magic, _ in _MAGIC)
+
+# errors of decompressing a corrupt or truncated file
+DECODE_ERRORS = (OSError, EOFError, zlib.error)
+
+
+# ------------------------------------------------------------------------------
+def detect_compression(head: bytes):
+    """
+    Identifies the compression of a file from its leading bytes, rather than
+    from its name or the product and year it belongs to.
+
+    :param bytes head: leading bytes of the file, at least MAGIC_SIZE of them
+    :return: 'bz2', 'gz', or None for a file which isn't compressed (e.g. a NetCDF)
+    :rtype: str
+    """
+
+    for magic, compression in _MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+# ------------------------------------------------------------------------------
+def fast_decoder(compression: str):
+    """
+    Finds a faster decoder for a compression, compatible with the standard
+    library's (including for concatenated streams), if one is installed:
+    python-isal for gzip and indexed_bzip2 for bz2.
+
+    :param str compression: 'bz2' or 'gz'
+    :return: function opening a file (path or binary file object) for reading
+        its decompressed contents, or None if no faster decoder is installed
+    """
+
+    try:
+        if compression == 'gz':
+            from isal import igzip
+            return igzip.open
+        if compression == 'bz2':
+            import indexed_bzip2
+            return indexed_bzip2.open
+    except ImportError:
+        pass
+    return None
+
+
+# ------------------------------------------------------------------------------
+def _open(file,
+          compression: str,
+          fast: bool):
+
+    # the decompressed contents of a file (path or binary file object), read with the faster decoder if called for
+    if fast:
+        decoder = fast_decoder(compression)
+        if decoder is not None:
+            return contextlib.closing(decoder(file))
+    if compression == 'bz2':
+        return bz2.open(file, 'rb')
+    return gzip.open(file, 'rb')
+
+
+# ------------------------------------------------------------------------------
+def decompress_file(source: str,
+                    destination: str,
+                    fast=True):
+    """
+    Decompresses a bz2 or gzip file, identified by its leading bytes, into
+    another file, removing the compressed file once done. A file which isn't
+    compressed is left as it is.
+
+    :param str source: path of the compressed file
+    :param str destination: path of the decompressed file, overwritten if present
+    :param bool fast: whether to use a faster decoder, if one is installed
+    :return: path of the decompressed file (the source if it wasn't compressed),
+        and the seconds taken and bytes written by the decompression
+    :raises: one of DECODE_ERRORS for a corrupt or truncated file, with no
+        decompressed file left behind
+    """
+
+    start = time.perf_counter()
+    with open(source, 'rb') as f_head:
+        compression = detect_compression(f_head.read(MAGIC_SIZE))
+    if compression is None:
+        return source, 0.0, 0
+
+    try:
+        with _open(source, compression, fast) as f_in, open(destination, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+            size = f_out.tell()
+    except BaseException:
+        # don't leave a partial file behind
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    os.remove(source)
+
+    return destination, time.perf_counter() - start, size
+
+
+# ------------------------------------------------------------------------------
+def decompress_bytes(contents,
+                     fast=True):
+    """
+    Decompresses the contents of a bz2 or gzip file, identified by their
+    leading bytes. Contents which aren't compressed are returned as they are.
+
+    :param contents: the file's contents, bytes or bytearray
+    :param bool fast: whether to use a faster decoder, if one is installed
+    :return: the decompressed contents (a bytearray), and the seconds taken
+        and bytes produced by the decompression
+    """
+
+    start = time.perf_counter()
+    compression = detect_compression(bytes(contents[:MAGIC_SIZE]))
+    if compression is None:
+        return contents, 0.0, 0
+
+    with _open(io.BytesIO(contents), compression, fast) as f_in:
+        decompressed = bytearray(f_in.read())
+
+    return decompressed, time.perf_counter() - start, len(decompressed)
+
+
+# ------------------------------------------------------------------------------
+def _call(function,
+          args=()):
+
+    # the function's result, or the error of a corrupt or truncated file
+    try:
+        return function(*args)
+    except DECODE_ERRORS as ex:
+        return ex
+
+
+# ------------------------------------------------------------------------------
+class Decompressor:
+    """
+    Decompression stage of the ingests, spreading the decompression of the
+    downloaded bz2/gzip files across a pool of processes, so that it isn't
+    bound to a single core. The compression of each file is identified by its
+    leading bytes, and a faster compatible decoder is used where installed.
+
+    With a single worker the files are decompressed in the calling thread,
+    without a pool. The pool is started on first use and kept for the run,
+    it's shared by all the threads using the decompressor.
+    """
+
+    def __init__(self,
+                 workers=1,
+                 fast=True):
+        """
+        :param int workers: number of processes decompressing files, 1 to
+            decompress in the calling thread
+        :param bool fast: whether to use a faster decoder, if one is installed
+        """
+
+        if workers < 1:
+            raise ValueError('Invalid number of decompression workers: {0}'.format(workers))
+
+        self.workers = workers
+        self.fast = fast
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if fast:
+            for compression in ('bz2', 'gz'):
+                if fast_decoder(compression) is not None:
+                    _logger.info('Using a faster %s decoder', compression)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Shuts down the pool of processes, if started.
+        """
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    # --------------------------------------------------------------------------
+    def decompress_files(self,
+                         files):
+        """
+        Decompresses downloaded files, removing each compressed file once done.
+
+        :param files: list of (compressed file, decompressed file) paths, or
+            None for a file which failed to download
+        :return: list of the decompressed files, in the same order, the
+            compressed file where it wasn't compressed, or None where the
+            file is None or failed to decompress (e.g. a corrupt file)
+        """
+
+        return self._run(decompress_file, [None if paths is None else paths + (self.fast,) for paths in files])
+
+    # --------------------------------------------------------------------------
+    def decompress_contents(self,
+                            contents):
+        """
+        Decompresses the contents of downloaded files.
+
+        :param contents: list of the files' contents (bytes or bytearrays), or
+            None for a file which failed to download
+        :return: list of the decompressed contents (bytearrays), in the same
+            order, the contents themselves where they weren't compressed, or
+            None where the contents are None or failed to decompress
+        """
+
+        return self._run(decompress_bytes, [None if data is None else (data, self.fast) for data in contents])
+
+    # --------------------------------------------------------------------------
+    def _run(self,
+             function,
+             jobs):
+
+        if self.workers == 1 or sum(job is not None for job in jobs) < 2:
+            results = [None if job is None else _call(function, job) for job in jobs]
+        else:
+            executor = self._pool()
+            futures = [None if job is None else executor.submit(function, *job) for job in jobs]
+            results = [None if future is None else _call(future.result) for future in futures]
+
+        # the decompressions took place out of sight of the metrics if in the pool, so they're added here
+        decompressed = []
+        for job, result in zip(jobs, results):
+            if result is None:
+                decompressed.append(None)
+                continue
+            if isinstance(result, Exception):
+                # handled like a file which failed to download
+                _logger.warning('Failed to decompress %s: %s',
+                                job[0] if isinstance(job[0], str) else 'downloaded contents', result)
+                decompressed.append(None)
+                continue
+            output, seconds, size = result
+            if size > 0:
+                cmorph_metrics.record('decompress', seconds, size)
+            decompressed.append(output)
+
+        return decompressed
+
+    # --------------------------------------------------------------------------
+    def _pool(self):
+
+        # started from a clean interpreter, since the ingests fork from several threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
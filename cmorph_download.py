@@ -0,0 +1,805 @@
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+import ftplib
+import hashlib
+import http.client
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+import cmorph_decompress
+import cmorph_ftp
+import cmorph_http
+import cmorph_metrics
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# size of the blocks read from a response body when streaming a download
+_CHUNK_SIZE = 1024 * 1024
+
+# number of times a failed download is retried, and the seconds waited before
+# the first retry, doubled for each further retry
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 2.0
+
+
+# ------------------------------------------------------------------------------
+class Downloader:
+    """
+    Download engine used by the ingest scripts to fetch batches of daily CMORPH
+    files (typically a whole month or year at once) with a bounded number of
+    concurrent transfers.
+
+    Results are always returned in the same order as the requested files, so
+    callers can rely on date ordering regardless of which transfer finishes first.
+
+    If a download cache is provided then jobs carrying a cache key are served
+    from the cache when possible, and downloaded files are added to the cache.
+    A cached file is first revalidated against the server, using the metadata
+    recorded in the cache's manifest when it was downloaded: the size and
+    modification time of an FTP directory listing, or a conditional HTTP request
+    (If-None-Match / If-Modified-Since), so that only files which changed on the
+    server are downloaded again.
+
+    HTTP and HTTPS downloads go through a pool of kept-alive connections, so
+    consecutive files from the same server reuse a connection rather than
+    paying for a new TCP and TLS handshake each. Likewise FTP downloads go
+    through persistent FTP sessions, which are also used to list the server's
+    directories, so that only the files which exist are requested.
+
+    A failed download is retried a bounded number of times, with exponential
+    backoff and jitter between the attempts, and a transfer cut short resumes
+    from the bytes already received (with an HTTP Range request or FTP REST)
+    rather than starting over. The files which still failed are reported at
+    the end of the run.
+    """
+
+    def __init__(self,
+                 workers=1,
+                 cache=None,
+                 pool_size=None,
+                 retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        """
+        :param int workers: maximum number of concurrent transfers, 1 for serial downloads
+        :param cache: optional cmorph_cache.DownloadCache consulted before going to the network
+        :param int pool_size: maximum number of idle HTTP(S) connections or FTP sessions kept
+            open per server for reuse, the number of workers if None
+        :param int retries: number of times a failed download is retried, 0 for no retries
+        :param float backoff: seconds waited before the first retry of a download, doubled
+            for each further retry, with a random jitter of +/- 50%
+        """
+
+        if workers < 1:
+            raise ValueError('Invalid number of download workers: {0}'.format(workers))
+        if retries < 0:
+            raise ValueError('Invalid number of download retries: {0}'.format(retries))
+        if backoff < 0:
+            raise ValueError('Invalid download backoff: {0}'.format(backoff))
+
+        self.workers = workers
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = workers if pool_size is None else pool_size
+        self.pool = cmorph_http.ConnectionPool(self.pool_size)
+
+        # (host, port, user) -> FTP session pool, created on first use
+        self._ftp_pools = {}
+
+        # URL -> (size in bytes, modification time), of the files found by directory listings,
+        # which their downloads are checked against and cached files revalidated against
+        self._listed = {}
+        self._lock = threading.Lock()
+
+        # cached files found to be current, and the cache keys of those which changed on the server
+        self.unchanged = 0
+        self.changed = []
+
+        # retries of failed transfers, those of which resumed a partial transfer,
+        # and the (URL, error) of the downloads which failed even after retrying
+        self.retried = 0
+        self.resumed = 0
+        self.failed = []
+
+    # --------------------------------------------------------------------------
+    def log_stats(self):
+        """
+        Logs the reuse of the pooled HTTP(S) connections and FTP sessions, the
+        outcome of revalidating cached files, and the retries and failures of the
+        downloads, with the URL of each file which failed for good.
+        """
+
+        if self.retried > 0:
+            _logger.info('Download retries:  %d, of which %d resumed a partial transfer', self.retried, self.resumed)
+        if self.failed:
+            _logger.warning('Failed to download %d files:\n%s', len(self.failed),
+                            '\n'.join('\t{0}: {1}'.format(url, error) for url, error in self.failed))
+
+        if self.unchanged > 0 or self.changed:
+            _logger.info('Revalidated cached files:  %d unchanged, %d changed on the server',
+                         self.unchanged, len(self.changed))
+        if self.changed:
+            _logger.info('Changed on the server since they were cached: %s', ', '.join(sorted(self.changed)))
+
+        self.pool.log_stats()
+        for ftp_pool in list(self._ftp_pools.values()):
+            ftp_pool.log_stats()
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the idle connections and logs out of the idle FTP sessions.
+        """
+
+        self.pool.close()
+        for ftp_pool in list(self._ftp_pools.values()):
+            ftp_pool.close()
+
+    # --------------------------------------------------------------------------
+    def can_list(self,
+                 url: str):
+        """
+        :param str url: URL of a directory
+        :return: whether the directory can be listed, i.e. it's on an FTP server
+        :rtype: bool
+        """
+
+        return urllib.parse.urlsplit(url).scheme == 'ftp'
+
+    # --------------------------------------------------------------------------
+    def list_directory(self,
+                       url: str):
+        """
+        Lists a directory of an FTP server with MLSD, over one of the persistent sessions.
+
+        The sizes of the files listed are remembered, and the files' downloads
+        are checked against them, so a truncated transfer counts as a failure.
+        Cached copies of the files are revalidated against their sizes and
+        modification times, without any further request.
+
+        :param str url: ftp URL of the directory
+        :return: dictionary of the directory's entries, name -> (type, size), with
+            type "file" or "dir" and size the number of bytes (None if not given)
+        :rtype: dict
+        """
+
+        if not self.can_list(url):
+            raise ValueError('Unsupported URL for a directory listing: {0}'.format(url))
+
+        entries = self._ftp_pool(url).list(_ftp_path(url))
+
+        base_url = url if url.endswith('/') else url + '/'
+        with self._lock:
+            for name, (kind, size, modified) in entries.items():
+                if kind == 'file' and size is not None:
+                    self._listed[base_url + name] = (size, modified)
+
+        return {name: (kind, size) for name, (kind, size, _) in entries.items()}
+
+    # --------------------------------------------------------------------------
+    def list_files(self,
+                   url: str):
+        """
+        Lists the files of a directory, where the server can be listed, so that
+        only the files which exist need be requested.
+
+        :param str url: URL of the directory
+        :return: dictionary of the directory's files, name -> size in bytes (None
+            if not given), or None if the directory can't be listed, i.e. the
+            server isn't an FTP server or the listing failed
+        :rtype: dict
+        """
+
+        if not self.can_list(url):
+            return None
+
+        try:
+            entries = self.list_directory(url)
+        except (urllib.error.URLError, OSError, EOFError) as ex:
+            _logger.warning('Failed to list %s, requesting its files regardless: %s', url, ex)
+            return None
+
+        return {name: size for name, (kind, size) in entries.items() if kind == 'file'}
+
+    # --------------------------------------------------------------------------
+    def _ftp_pool(self,
+                  url: str):
+
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.hostname, parts.port, parts.username)
+        with self._lock:
+            if key not in self._ftp_pools:
+                self._ftp_pools[key] = cmorph_ftp.FtpSessionPool.for_url(url, max_sessions=self.pool_size)
+            return self._ftp_pools[key]
+
+    # --------------------------------------------------------------------------
+    def fetch(self,
+              jobs,
+              skip_failed=False):
+        """
+        Downloads a batch of files.
+
+        :param jobs: list of (URL, local file path) tuples, or of (URL, local file
+            path, cache key) tuples for files which should go through the cache
+        :param bool skip_failed: if True then a failed download results in None
+            at the corresponding position of the result list, otherwise the error
+            is raised once all transfers of the batch have been attempted
+        :return: list of local file paths, in the same order as the jobs
+        """
+
+        return self._run(self._fetch_one, jobs, skip_failed)
+
+    # --------------------------------------------------------------------------
+    def fetch_bytes(self,
+                    jobs,
+                    skip_failed=False):
+        """
+        Downloads a batch of files into memory, decompressing each response body
+        incrementally as it streams in so that nothing is written to disk.
+
+        :param jobs: list of (URL, compression) tuples, with compression one of
+            "bz2", "gz", "auto" to identify the compression (if any) of each file
+            from its leading bytes, or None for files which are not compressed, or of (URL,
+            compression, cache key) tuples for files which should go through the cache
+        :param bool skip_failed: if True then a failed download results in None
+            at the corresponding position of the result list, otherwise the error
+            is raised once all transfers of the batch have been attempted
+        :return: list of bytearrays with the decompressed file contents, in the
+            same order as the jobs
+        """
+
+        return self._run(self._fetch_one_bytes, jobs, skip_failed)
+
+    # --------------------------------------------------------------------------
+    def _run(self,
+             fetch_function,
+             jobs,
+             skip_failed):
+
+        if self.workers == 1 or len(jobs) < 2:
+            results = [fetch_function(*job) for job in jobs]
+        else:
+            # the transfers' stages are timed as part of the caller's period of the ingest
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+                results = list(executor.map(cmorph_metrics.bind(lambda job: fetch_function(*job)), jobs))
+
+        # keep the metadata of the files just cached, should the run not get any further
+        if self.cache is not None:
+            self.cache.flush()
+
+        # either drop failures or raise the first error, in date order
+        outputs = []
+        for result in results:
+            if isinstance(result, Exception):
+                if not skip_failed:
+                    raise result
+                outputs.append(None)
+            else:
+                outputs.append(result)
+
+        return outputs
+
+    # --------------------------------------------------------------------------
+    def _open(self,
+              url,
+              headers=None,
+              offset=0):
+
+        # requests the file from the offset onwards if resuming, though the server may send the whole file
+        if offset:
+            headers = dict(headers or {}, Range='bytes={0}-'.format(offset))
+
+        # the request, including any connection set up, is timed as part of the download
+        with cmorph_metrics.timed('download'):
+            if self.pool.handles(url):
+                return self.pool.open(url, headers)
+            if urllib.parse.urlsplit(url).scheme == 'ftp':
+                return self._ftp_pool(url).open(_ftp_path(url), offset)
+            request = urllib.request.Request(url, headers=headers or {})
+            return urllib.request.urlopen(request, timeout=cmorph_http.DEFAULT_TIMEOUT)
+
+    # --------------------------------------------------------------------------
+    def _transfer(self,
+                  url: str,
+                  write,
+                  restart,
+                  response=None):
+        """
+        Streams a file from the server, retrying a failed transfer with exponential
+        backoff and resuming from the bytes already received, where the server
+        supports it, otherwise starting over.
+
+        :param str url: URL of the file
+        :param write: function called with each chunk of the file's contents
+        :param restart: function called to discard the chunks written so far,
+            when the transfer has to start over
+        :param response: open response of the first attempt, if already requested
+        :return: the response of the final attempt and the size of the file
+        """
+
+        received = 0
+        validator = None
+        for attempt in range(self.retries + 1):
+            writing = False
+            try:
+                if response is None:
+                    headers = None
+                    if received and validator:
+                        # a file changed in the meantime is sent whole rather than resumed
+                        headers = {'If-Range': validator}
+                    response = self._open(url, headers, received)
+
+                with response:
+                    offset = _response_offset(response)
+                    if offset != received:
+                        restart()
+                        received = 0
+                    elif offset:
+                        with self._lock:
+                            self.resumed += 1
+                    validator = _validator(response) or validator
+                    expected = self._expected_size(url, response, offset)
+
+                    def consume(chunk):
+                        nonlocal received, writing
+                        writing = True
+                        write(chunk)
+                        writing = False
+                        received += len(chunk)
+
+                    _copy_stream(response, consume)
+
+                if expected is not None and received != expected:
+                    message = 'Incomplete download of {0}: {1} of {2} bytes'.format(url, received, expected)
+                    if received > expected:
+                        restart()
+                        received = 0
+                    raise OSError(message)
+
+                return response, received
+
+            except (urllib.error.URLError, http.client.HTTPException, OSError, EOFError, zlib.error) as ex:
+
+                response = None
+
+                # a chunk which failed part way through being written (e.g. failing to decompress) can't be resumed from
+                if writing:
+                    restart()
+                    received = 0
+
+                if attempt == self.retries or not is_transient(ex):
+                    raise
+
+                delay = retry_delay(attempt, self.backoff)
+                _logger.warning('Failed to download %s, retrying in %.1f s (%d of %d): %s',
+                                url, delay, attempt + 1, self.retries, ex)
+                with self._lock:
+                    self.retried += 1
+                time.sleep(delay)
+
+    # --------------------------------------------------------------------------
+    def _expected_size(self,
+                       url: str,
+                       response,
+                       offset: int):
+
+        # the size of a file found by a listing, or else given by its response's Content-Length
+        with self._lock:
+            listed = self._listed.get(url)
+        if listed is not None:
+            return listed[0]
+
+        headers = getattr(response, 'headers', None)
+        if headers is None or headers.get('Content-Length') is None or headers.get('Content-Encoding'):
+            return None
+        return offset + int(headers.get('Content-Length'))
+
+    # --------------------------------------------------------------------------
+    def _failure(self,
+                 url: str,
+                 error):
+
+        # a download which failed for good, reported at the end of the run
+        _logger.warning('Failed to download %s: %s', url, error)
+        with self._lock:
+            self.failed.append((url, str(error)))
+
+    # --------------------------------------------------------------------------
+    def _lookup(self,
+                url: str,
+                cache_key: str):
+        """
+        Looks up a file in the cache, revalidating a cached copy against the server.
+
+        :return: tuple of the path of the file's cached copy, if it's current,
+            and the open response of the file's download, if its cached copy
+            turned out to have changed on the server, (None, None) if the file
+            isn't cached
+        """
+
+        # a cached copy only counts as a hit once it's found to be current
+        cached_path = self.cache.get(cache_key, count_hit=False)
+        if cached_path is None:
+            return None, None
+
+        try:
+            response = self._revalidate(url, cache_key, cached_path)
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as ex:
+            _logger.warning('Failed to revalidate %s, using the cached copy: %s', url, ex)
+            self.cache.record(hit=True)
+            return cached_path, None
+
+        if response is None:
+            with self._lock:
+                self.unchanged += 1
+            self.cache.record(hit=True)
+            return cached_path, None
+
+        self.cache.record(hit=False)
+        return None, response
+
+    # --------------------------------------------------------------------------
+    def _revalidate(self,
+                    url: str,
+                    cache_key: str,
+                    cached_path: str):
+
+        # returns None if the cached copy is current, otherwise the open response of the file's download
+        metadata = self.cache.metadata(cache_key)
+        if metadata is None or metadata.get('size') != os.path.getsize(cached_path):
+            # cached without a manifest entry, downloaded again so that it can be revalidated from now on
+            _logger.debug('No metadata for the cached %s', cache_key)
+            return self._open(url)
+
+        # a directory listing tells whether the file changed, without any further request
+        with self._lock:
+            listed = self._listed.get(url)
+        if listed is not None:
+            if listed == (metadata['size'], metadata.get('modified')):
+                return None
+            return self._open(url)
+
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        if not headers or urllib.parse.urlsplit(url).scheme == 'ftp':
+            # nothing to revalidate against, e.g. an FTP file whose directory couldn't be listed
+            return None
+
+        try:
+            response = self._open(url, headers)
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304:
+                return None
+            raise
+
+        if response.status == 304:
+            response.read()
+            response.close()
+            return None
+
+        return response
+
+    # --------------------------------------------------------------------------
+    def _cache_put(self,
+                   url: str,
+                   cache_key: str,
+                   response,
+                   size: int,
+                   checksum: str,
+                   put_function):
+
+        # caches a downloaded file along with its metadata, noting whether its contents changed
+        headers = getattr(response, 'headers', None)
+        with self._lock:
+            listed = self._listed.get(url)
+        metadata = {'url': url,
+                    'size': size,
+                    'sha1': checksum,
+                    'etag': headers.get('ETag') if headers is not None else None,
+                    'last_modified': headers.get('Last-Modified') if headers is not None else None,
+                    'modified': listed[1] if listed is not None else None}
+
+        previous = self.cache.metadata(cache_key)
+        put_function(metadata)
+
+        if previous is not None and previous.get('sha1') != checksum:
+            with self._lock:
+                self.changed.append(cache_key)
+
+    # --------------------------------------------------------------------------
+    def _fetch_one(self,
+                   url,
+                   local_path,
+                   cache_key=None):
+
+        use_cache = self.cache is not None and cache_key is not None
+        response = None
+
+        try:
+            if use_cache:
+                cached_path, response = self._lookup(url, cache_key)
+                if cached_path is not None:
+                    _logger.info('Using cached %s', cache_key)
+                    with cmorph_metrics.timed('download') as sample:
+                        shutil.copyfile(cached_path, local_path)
+                        sample.bytes = os.path.getsize(local_path)
+                    return local_path
+
+            _logger.info('Downloading %s', url)
+
+            digest = hashlib.sha1()
+            with open(local_path, 'wb') as f_out:
+
+                def write(chunk):
+                    digest.update(chunk)
+                    f_out.write(chunk)
+
+                def restart():
+                    nonlocal digest
+                    digest = hashlib.sha1()
+                    f_out.seek(0)
+                    f_out.truncate()
+
+                response, size = self._transfer(url, write, restart, response)
+
+            if use_cache:
+                self._cache_put(url, cache_key, response, size, digest.hexdigest(),
+                                lambda metadata: self.cache.put(cache_key, local_path, metadata))
+            return local_path
+
+        except (urllib.error.URLError, http.client.HTTPException, OSError, EOFError, zlib.error) as ex:
+
+            self._failure(url, ex)
+
+            # don't leave a partial file behind
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+            return ex
+
+    # --------------------------------------------------------------------------
+    def _fetch_one_bytes(self,
+                         url,
+                         compression,
+                         cache_key=None):
+
+        use_cache = self.cache is not None and cache_key is not None
+        decompressor = _StreamDecompressor(compression)
+        response = None
+
+        try:
+            if use_cache:
+                cached_path, response = self._lookup(url, cache_key)
+                if cached_path is not None:
+                    _logger.info('Using cached %s', cache_key)
+                    with open(cached_path, 'rb') as f_in:
+                        _copy_stream(f_in, decompressor.decompress)
+                    return decompressor.result()
+
+            _logger.info('Downloading %s', url)
+
+            # keep the compressed bytes as well if they're going into the cache
+            compressed = bytearray()
+
+            def write(chunk):
+                if use_cache:
+                    compressed.extend(chunk)
+                decompressor.decompress(chunk)
+
+            def restart():
+                nonlocal decompressor
+                decompressor = _StreamDecompressor(compression)
+                del compressed[:]
+
+            response, size = self._transfer(url, write, restart, response)
+            contents = decompressor.result()
+
+            if use_cache:
+                self._cache_put(url, cache_key, response, size, hashlib.sha1(compressed).hexdigest(),
+                                lambda metadata: self.cache.put_bytes(cache_key, compressed, metadata))
+
+            return contents
+
+        except (urllib.error.URLError, http.client.HTTPException, OSError, EOFError, zlib.error) as ex:
+
+            self._failure(url, ex)
+            return ex
+
+
+# ------------------------------------------------------------------------------
+def _copy_stream(stream,
+                 consume):
+
+    # returns the number of bytes copied
+    size = 0
+    while True:
+        with cmorph_metrics.timed('download') as sample:
+            chunk = stream.read(_CHUNK_SIZE)
+            sample.bytes = len(chunk)
+        if not chunk:
+            return size
+        size += len(chunk)
+        consume(chunk)
+
+
+# ------------------------------------------------------------------------------
+def is_transient(error):
+    """
+    :param Exception error: error of a failed download
+    :return: whether the download is worth retrying, it isn't for an HTTP client
+        error (e.g. a file which doesn't exist) or a permanent FTP error reply
+    :rtype: bool
+    """
+
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in (408, 429) or error.code >= 500
+    if isinstance(error.__cause__, ftplib.error_perm):
+        return False
+    return True
+
+
+# ------------------------------------------------------------------------------
+def retry_delay(attempt: int,
+                backoff=DEFAULT_BACKOFF):
+    """
+    :param int attempt: number of the retry, 0 for the first
+    :param float backoff: seconds waited before the first retry
+    :return: seconds to wait before the retry, doubled for each further retry,
+        with a random jitter of +/- 50% so that concurrent downloads don't retry in lockstep
+    :rtype: float
+    """
+
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+# ------------------------------------------------------------------------------
+def retry(function,
+          url: str,
+          retries=DEFAULT_RETRIES,
+          backoff=DEFAULT_BACKOFF):
+    """
+    Calls a function requesting a URL, retrying it on a transient failure with
+    exponential backoff, for requests which don't go through a Downloader.
+
+    :param function: function without arguments which requests the URL
+    :param str url: the URL, for logging
+    :param int retries: number of times the function is retried
+    :param float backoff: seconds waited before the first retry
+    :return: the function's result
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as ex:
+            if attempt == retries or not is_transient(ex):
+                raise
+            delay = retry_delay(attempt, backoff)
+            _logger.warning('Failed to download %s, retrying in %.1f s (%d of %d): %s',
+                            url, delay, attempt + 1, retries, ex)
+            time.sleep(delay)
+
+
+# ------------------------------------------------------------------------------
+def _response_offset(response):
+
+    # the position in the file at which a response's body starts, non-zero for a resumed transfer
+    offset = getattr(response, 'offset', None)
+    if offset is not None:
+        return offset
+
+    if getattr(response, 'status', None) == 206:
+        match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+        if match is None:
+            raise http.client.HTTPException('Invalid Content-Range: {0}'.format(response.headers.get('Content-Range')))
+        return int(match.group(1))
+
+    return 0
+
+
+# ------------------------------------------------------------------------------
+def _validator(response):
+
+    # the ETag (if strong) or else the Last-Modified of a response, which a resumed request is conditional on
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+# ------------------------------------------------------------------------------
+def _ftp_path(url: str):
+
+    # the path of an ftp URL, relative to the login directory as for urllib
+    return urllib.parse.unquote(urllib.parse.urlsplit(url).path).lstrip('/')
+
+
+# ------------------------------------------------------------------------------
+class _StreamDecompressor:
+    """
+    Incremental bz2/gzip decompression of a byte stream into a single growing buffer.
+    Concatenated (multi-stream) files, as written by parallel compressors, are supported.
+    With "auto" compression the stream's compression is identified by its leading bytes.
+    """
+
+    def __init__(self,
+                 compression):
+
+        if compression not in ('bz2', 'gz', 'auto', None):
+            raise ValueError('Unsupported compression: {0}'.format(compression))
+
+        self.compression = compression
+        self.buffer = bytearray()
+        self._head = bytearray()
+        self._decompressor = self._new_decompressor()
+        self._in_stream = False
+
+    # --------------------------------------------------------------------------
+    def _new_decompressor(self):
+
+        if self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        elif self.compression == 'gz':
+            return zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return None
+
+    # --------------------------------------------------------------------------
+    def decompress(self,
+                   chunk):
+
+        # the leading bytes are held back until there are enough of them to identify the compression
+        if self.compression == 'auto':
+            self._head += chunk
+            if len(self._head) < cmorph_decompress.MAGIC_SIZE:
+                return
+            self.compression = cmorph_decompress.detect_compression(bytes(self._head))
+            self._decompressor = self._new_decompressor()
+            chunk = bytes(self._head)
+            del self._head[:]
+
+        if self._decompressor is None:
+            self.buffer += chunk
+            return
+
+        with cmorph_metrics.timed('decompress') as sample:
+            size = len(self.buffer)
+            while chunk:
+                self.buffer += self._decompressor.decompress(chunk)
+                if not self._decompressor.eof:
+                    self._in_stream = True
+                    break
+
+                # end of a compressed stream, any remaining data starts another one
+                chunk = self._decompressor.unused_data
+                self._decompressor = self._new_decompressor()
+                self._in_stream = False
+            sample.bytes = len(self.buffer) - size
+
+    # --------------------------------------------------------------------------
+    def result(self):
+
+        # a file too short to be compressed
+        self.buffer += self._head
+        del self._head[:]
+
+        if self._in_stream:
+            raise EOFError('Compressed stream ended before the end-of-stream marker was reached')
+
+        return self.buffer
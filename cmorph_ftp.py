@@ -0,0 +1,332 @@
+import ftplib
+import logging
+import threading
+import urllib.error
+import urllib.parse
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# seconds to wait for the server when connecting or reading a reply or data
+DEFAULT_TIMEOUT = 60
+
+# errors meaning an idle session was closed by the server (e.g. "421 Timeout"),
+# the command is sent again over a fresh session
+_STALE_SESSION_ERRORS = (ftplib.error_temp, EOFError, OSError)
+
+# reason given for a control connection closed by the server, e.g. while logging in
+_CLOSED = 'connection closed by the server'
+
+
+# ------------------------------------------------------------------------------
+class FtpSessionPool:
+    """
+    Persistent, logged in FTP sessions to a server, used both to list the
+    archive's directories and to transfer the daily files, so that a run logs
+    in once per session rather than once per file.
+
+    Sessions are checked out for the duration of a listing or transfer and
+    returned to the pool afterwards. Concurrent transfers each get a session of
+    their own, and at most max_sessions idle sessions are kept, any others are
+    closed after use.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port=None,
+                 max_sessions=1,
+                 user='anonymous',
+                 password='anonymous@',
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param str host: host name of the server
+        :param int port: port of the server, 21 if None
+        :param int max_sessions: maximum number of idle sessions kept open
+        :param str user: user name, anonymous by default
+        :param str password: password
+        :param float timeout: seconds to wait for the server
+        """
+
+        if max_sessions < 1:
+            raise ValueError('Invalid number of FTP sessions: {0}'.format(max_sessions))
+
+        self.host = host
+        self.port = port or ftplib.FTP_PORT
+        self.max_sessions = max_sessions
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+        self.sessions_opened = 0
+        self.listings = 0
+        self.transfers = 0
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def for_url(cls,
+                url: str,
+                **kwargs):
+        """
+        :param str url: ftp URL of a file or directory on the server, with any
+            user and password of the URL used to log in
+        :return: session pool for the URL's server
+        :rtype: FtpSessionPool
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        if parts.username is not None:
+            kwargs.setdefault('user', urllib.parse.unquote(parts.username))
+            kwargs.setdefault('password', urllib.parse.unquote(parts.password or ''))
+
+        return cls(parts.hostname, parts.port, **kwargs)
+
+    # --------------------------------------------------------------------------
+    def list(self,
+             path: str):
+        """
+        Lists a directory with MLSD.
+
+        :param str path: path of the directory on the server, e.g. "02_RAW/2017/201701"
+        :return: dictionary of the directory's entries, name -> (type, size, modified),
+            with type "file" or "dir", size the number of bytes and modified the
+            modification time as given by the server, e.g. "20180101063512" (None
+            if not given)
+        :rtype: dict
+        """
+
+        # the listing switches the session to ASCII mode, it's switched back for the transfers
+        def mlsd(ftp):
+            entries = list(ftp.mlsd(path, facts=['type', 'size', 'modify']))
+            ftp.voidcmd('TYPE I')
+            return entries
+
+        entries = {}
+        for name, facts in self._call(mlsd):
+            kind = facts.get('type', '').lower()
+            if kind in ('cdir', 'pdir'):
+                continue
+            size = facts.get('size')
+            entries[name] = (kind, None if size is None else int(size), facts.get('modify'))
+
+        with self._lock:
+            self.listings += 1
+
+        return entries
+
+    # --------------------------------------------------------------------------
+    def open(self,
+             path: str,
+             offset=0):
+        """
+        Starts the transfer of a file.
+
+        :param str path: path of the file on the server
+        :param int offset: number of bytes from the start of the file at which
+            the transfer starts (with REST), to resume an interrupted transfer
+        :return: the transfer, a readable stream to be used as a context manager
+            (or closed), with the session going back to the pool once complete,
+            its offset attribute is where the transfer starts, 0 if the server
+            refused to restart the transfer at the offset
+        :raises urllib.error.URLError: if the server refuses the transfer, e.g.
+            for a file which doesn't exist, with the ftplib error as its cause
+        """
+
+        def retrieve(ftp):
+            nonlocal offset
+            if offset:
+                try:
+                    return ftp.transfercmd('RETR ' + path, rest=offset)
+                except ftplib.error_perm:
+                    # REST isn't supported (or the RETR itself failed), the whole file is requested instead
+                    offset = 0
+            return ftp.transfercmd('RETR ' + path)
+
+        ftp, reused = self._checkout()
+        try:
+            try:
+                connection = retrieve(ftp)
+            except _STALE_SESSION_ERRORS:
+                ftp.close()
+                if not reused:
+                    raise
+                _logger.debug('Stale FTP session to %s, reconnecting', self.host)
+                ftp, reused = self._checkout(reuse=False)
+                connection = retrieve(ftp)
+        except ftplib.error_perm as ex:
+            # the session itself is fine, e.g. for "550 No such file"
+            self._release(ftp)
+            raise urllib.error.URLError('ftp error: {0}'.format(ex)) from ex
+        except (ftplib.Error, EOFError) as ex:
+            ftp.close()
+            raise urllib.error.URLError('ftp error: {0}'.format(str(ex) or _CLOSED)) from ex
+        except BaseException:
+            ftp.close()
+            raise
+
+        with self._lock:
+            self.transfers += 1
+
+        return _Transfer(self, ftp, connection, offset)
+
+    # --------------------------------------------------------------------------
+    def _call(self,
+              function):
+
+        # runs a command on a session, with a fresh session if an idle one turns out to be stale
+        ftp, reused = self._checkout()
+        try:
+            try:
+                result = function(ftp)
+            except _STALE_SESSION_ERRORS:
+                ftp.close()
+                if not reused:
+                    raise
+                _logger.debug('Stale FTP session to %s, reconnecting', self.host)
+                ftp, reused = self._checkout(reuse=False)
+                result = function(ftp)
+        except ftplib.error_perm as ex:
+            self._release(ftp)
+            raise urllib.error.URLError('ftp error: {0}'.format(ex)) from ex
+        except (ftplib.Error, EOFError) as ex:
+            ftp.close()
+            raise urllib.error.URLError('ftp error: {0}'.format(str(ex) or _CLOSED)) from ex
+        except BaseException:
+            ftp.close()
+            raise
+
+        self._release(ftp)
+        return result
+
+    # --------------------------------------------------------------------------
+    def _checkout(self,
+                  reuse=True):
+
+        with self._lock:
+            if reuse and self._idle:
+                return self._idle.pop(), True
+            self.sessions_opened += 1
+
+        ftp = ftplib.FTP(timeout=self.timeout)
+        try:
+            ftp.connect(self.host, self.port)
+            ftp.login(self.user, self.password)
+            ftp.voidcmd('TYPE I')
+        except (ftplib.Error, EOFError) as ex:
+            ftp.close()
+            raise urllib.error.URLError('ftp error: {0}'.format(str(ex) or _CLOSED)) from ex
+        except BaseException:
+            ftp.close()
+            raise
+
+        return ftp, False
+
+    # --------------------------------------------------------------------------
+    def _release(self,
+                 ftp):
+
+        with self._lock:
+            if len(self._idle) < self.max_sessions:
+                self._idle.append(ftp)
+                return
+
+        _quit(ftp)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Logs out of the idle sessions.
+        """
+
+        with self._lock:
+            sessions = self._idle
+            self._idle = []
+
+        for ftp in sessions:
+            _quit(ftp)
+
+    # --------------------------------------------------------------------------
+    def log_stats(self):
+        """
+        Logs the number of sessions opened for the listings and transfers.
+        """
+
+        if self.listings + self.transfers > 0:
+            _logger.info('FTP sessions to %s:  %d listings, %d transfers, %d sessions opened',
+                         self.host, self.listings, self.transfers, self.sessions_opened)
+
+
+# ------------------------------------------------------------------------------
+def _quit(ftp):
+
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+
+# ------------------------------------------------------------------------------
+class _Transfer:
+    """
+    Data connection of a file transfer, which hands the session back to the
+    pool when closed, once the server has confirmed the transfer is complete.
+    """
+
+    def __init__(self,
+                 pool: FtpSessionPool,
+                 ftp,
+                 connection,
+                 offset=0):
+
+        self._pool = pool
+        self._ftp = ftp
+        self._connection = connection
+        self.offset = offset
+        self._stream = connection.makefile('rb')
+        self._complete = False
+
+    # --------------------------------------------------------------------------
+    def read(self,
+             amount=-1):
+
+        # the transfer is complete once the end of the data is reached, which a read of everything does
+        data = self._stream.read(amount)
+        if (not data and amount != 0) or amount is None or amount < 0:
+            self._complete = True
+        return data
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        if self._ftp is None:
+            return
+        ftp = self._ftp
+        self._ftp = None
+
+        self._stream.close()
+        self._connection.close()
+
+        # an abandoned transfer leaves the session in an unknown state
+        if not self._complete:
+            ftp.close()
+            return
+
+        try:
+            ftp.voidresp()
+        except ftplib.all_errors as ex:
+            ftp.close()
+            raise urllib.error.URLError('ftp error: {0}'.format(ex)) from ex
+        self._pool._release(ftp)
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+
+        return self
+
+    # --------------------------------------------------------------------------
+    def __exit__(self, *args):
+
+        self.close()
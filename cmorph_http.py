@@ -0,0 +1,262 @@
+import http.client
+import logging
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# seconds to wait for the server when connecting or reading a response
+DEFAULT_TIMEOUT = 60
+
+# the number of redirects followed for a single request
+_MAX_REDIRECTS = 5
+
+# errors meaning an idle kept-alive connection was closed by the server, the
+# request is sent again over a fresh connection
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                            http.client.BadStatusLine,
+                            ConnectionResetError,
+                            BrokenPipeError)
+
+
+# ------------------------------------------------------------------------------
+class ConnectionPool:
+    """
+    Persistent HTTP and HTTPS connections, kept alive between requests and
+    reused for the next request to the same server. This avoids a TCP (and TLS)
+    handshake for each of the many small daily files fetched from a server.
+
+    Connections are checked out for the duration of a request and returned to
+    the pool once the response has been read in full. Concurrent requests each
+    get a connection of their own, and at most max_connections idle connections
+    are kept per server, any others are closed after use.
+
+    Only http and https URLs are handled, and only if no proxy is configured
+    for the scheme, other URLs should be opened with urllib instead.
+    """
+
+    def __init__(self,
+                 max_connections=1,
+                 ssl_context=None,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param int max_connections: maximum number of idle connections kept open per server
+        :param ssl.SSLContext ssl_context: context for HTTPS connections, the
+            default context (verifying certificates against the system's CAs,
+            or those of the SSL_CERT_FILE environment variable) if None
+        :param float timeout: seconds to wait for the server when connecting or reading
+        """
+
+        if max_connections < 1:
+            raise ValueError('Invalid number of pooled connections: {0}'.format(max_connections))
+
+        self.max_connections = max_connections
+        self.ssl_context = ssl_context if ssl_context is not None else ssl.create_default_context()
+        self.timeout = timeout
+
+        # (scheme, host, port) -> idle connections, the most recently used last
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    # --------------------------------------------------------------------------
+    def handles(self,
+                url: str):
+        """
+        :param str url: URL of a file
+        :return: whether the URL can be opened through the pool
+        :rtype: bool
+        """
+
+        scheme = urllib.parse.urlsplit(url).scheme
+        return scheme in ('http', 'https') and scheme not in urllib.request.getproxies()
+
+    # --------------------------------------------------------------------------
+    def open(self,
+             url: str,
+             headers=None):
+        """
+        Sends a GET request over a pooled connection, following redirects.
+
+        :param str url: http or https URL of the file
+        :param dict headers: additional request headers
+        :return: the response, to be used as a context manager (or closed), with
+            the connection going back to the pool if the body was read in full
+        :raises urllib.error.HTTPError: for an error status
+        """
+
+        for _ in range(_MAX_REDIRECTS + 1):
+
+            response = self._request(url, headers or {})
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                location = urllib.parse.urljoin(url, response.getheader('Location'))
+                response.read()
+                response.close()
+                url = location
+                continue
+
+            if response.status >= 400:
+                error = urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+                response.read()
+                response.close()
+                raise error
+
+            return response
+
+        raise urllib.error.URLError('Too many redirects for {0}'.format(url))
+
+    # --------------------------------------------------------------------------
+    def _request(self,
+                 url: str,
+                 headers: dict):
+
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection, reused = self._checkout(key)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+
+            # the server closed the idle connection, send the request again over a new one
+            _logger.debug('Stale connection to %s, reconnecting', parts.netloc)
+            connection, reused = self._checkout(key, reuse=False)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            except BaseException:
+                connection.close()
+                raise
+        except BaseException:
+            connection.close()
+            raise
+
+        with self._lock:
+            self.requests += 1
+
+        return _PooledResponse(response, lambda: self._release(key, connection, response))
+
+    # --------------------------------------------------------------------------
+    def _checkout(self,
+                  key: tuple,
+                  reuse=True):
+
+        with self._lock:
+            idle = self._idle.get(key)
+            if reuse and idle:
+                self.connections_reused += 1
+                return idle.pop(), True
+            self.connections_opened += 1
+
+        scheme, host, port = key
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        return connection, False
+
+    # --------------------------------------------------------------------------
+    def _release(self,
+                 key: tuple,
+                 connection,
+                 response):
+
+        # the connection can only be reused once its response has been read in full
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_connections:
+                    idle.append(connection)
+                    return
+
+        response.close()
+        connection.close()
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+
+        for connection in connections:
+            connection.close()
+
+    # --------------------------------------------------------------------------
+    def log_stats(self):
+        """
+        Logs the request and connection counts, once any request has gone through the pool.
+        """
+
+        if self.requests > 0:
+            _logger.info('HTTP connection pool:  %d requests, %d connections opened, %d reused',
+                         self.requests, self.connections_opened, self.connections_reused)
+
+
+# ------------------------------------------------------------------------------
+class _PooledResponse:
+    """
+    Response of a pooled request, which hands its connection back to the pool
+    when closed.
+    """
+
+    def __init__(self,
+                 response,
+                 release):
+
+        self._response = response
+        self._release = release
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    # --------------------------------------------------------------------------
+    def getheader(self,
+                  name,
+                  default=None):
+
+        return self._response.getheader(name, default)
+
+    # --------------------------------------------------------------------------
+    def read(self,
+             amount=None):
+
+        return self._response.read(amount)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        if self._release is not None:
+            release = self._release
+            self._release = None
+            release()
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+
+        return self
+
+    # --------------------------------------------------------------------------
+    def __exit__(self, *args):
+
+        self.close()
@@ -0,0 +1,117 @@
+import netCDF4
+import numpy as np
+
+import cmorph_metrics
+
+
+# ------------------------------------------------------------------------------
+def load_daily(source):
+    """
+    Loads the values of a daily CMORPH binary file, either from disk or from an
+    in-memory buffer holding the (already decompressed) file contents.
+
+    No copy is made for buffers, the resulting array is a view over the buffer's
+    memory, which is writable if the buffer is (e.g. a bytearray).
+
+    :param source: path of a decompressed daily file, or a bytes-like object
+    :return: flat array of the raw 32-bit float values, in file byte order
+    :rtype: ndarray
+    """
+
+    with cmorph_metrics.timed('decode') as sample:
+        if isinstance(source, str):
+            values = np.fromfile(source, 'f')
+        else:
+            values = np.frombuffer(source, 'f')
+        sample.bytes = values.nbytes
+
+    return values
+
+
+# ------------------------------------------------------------------------------
+def load_daily_window(source,
+                      grid_shape,
+                      rows,
+                      columns,
+                      little_endian=True,
+                      undef=None,
+                      records=None):
+    """
+    Loads a rectangular window of the values of a daily CMORPH binary file,
+    either from disk or from an in-memory buffer holding the (already
+    decompressed) file contents. Files of sub-daily values, with several
+    consecutive grids (records) per file, are read as a single block.
+
+    Only the grid rows (latitudes) covering the window are read, through a
+    memory map of the file (or a view of the buffer), and the byte order
+    conversion and missing value masking are applied to the window only, so for
+    a regional window the work done scales with the region's size rather than
+    the global grid's. A window crossing the seam of the grid's longitudes is
+    read as two contiguous column ranges which are stitched together.
+
+    :param source: path of a decompressed daily file, or a bytes-like object
+    :param tuple grid_shape: (lat, lon) shape of the full grid in the file
+    :param tuple rows: (start, end) range of the window's lat indices
+    :param list columns: (start, end) ranges of the window's lon indices,
+        in the order in which they're stitched together
+    :param bool little_endian: whether the file's values are little endian
+    :param float undef: missing value of the file, converted to NaN, or None
+    :param int records: number of grids in the file, e.g. 8 for 3-hourly
+        values, or None for a single grid
+    :return: array of the window's 32-bit float values in native byte order,
+        with shape (rows, columns), or (records, rows, columns) if records is given
+    :rtype: ndarray
+    """
+
+    dtype = np.dtype('<f4' if little_endian else '>f4')
+    row_start, row_end = rows
+
+    if records is None:
+        # only the window's rows are mapped, these are contiguous in the file
+        window_shape = (row_end - row_start, grid_shape[1])
+        offset = row_start * grid_shape[1] * dtype.itemsize
+    else:
+        # all the records are mapped, but only the pages of the window's rows of each are touched
+        window_shape = (records,) + tuple(grid_shape)
+        offset = 0
+
+    with cmorph_metrics.timed('decode') as sample:
+        if isinstance(source, str):
+            values = np.memmap(source, dtype, mode='r', offset=offset, shape=window_shape)
+        else:
+            values = np.frombuffer(source, dtype, count=int(np.prod(window_shape)), offset=offset)
+            values = values.reshape(window_shape)
+        if records is not None:
+            values = values[:, row_start:row_end]
+
+        # copy out the window, converting to native byte order along the way
+        if len(columns) == 1:
+            window = values[..., columns[0][0]:columns[0][1]].astype('f4')
+        else:
+            window = np.concatenate([values[..., start:end] for start, end in columns], axis=-1).astype('f4', copy=False)
+        del values
+        sample.bytes = window.nbytes
+
+    # convert missing values to NaNs
+    if undef is not None:
+        with cmorph_metrics.timed('mask') as sample:
+            window[window == undef] = np.NaN
+            sample.bytes = window.nbytes
+
+    return window
+
+
+# ------------------------------------------------------------------------------
+def open_icdr(source):
+    """
+    Opens a daily ICDR NetCDF file, either from disk or from an in-memory buffer.
+
+    :param source: path of a daily ICDR NetCDF file, or a bytes-like object
+    :return: the opened dataset, which the caller should close
+    :rtype: netCDF4.Dataset
+    """
+
+    if isinstance(source, str):
+        return netCDF4.Dataset(source, mode='r')
+
+    return netCDF4.Dataset('inmemory.nc', mode='r', memory=bytes(source))
@@ -0,0 +1,238 @@
+import argparse
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import random
+import re
+import ssl
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+class _LatencyRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler which waits a fixed amount of time before answering,
+    as a stand-in for the round trip latency of the remote CPC/CICS servers.
+    Connections are kept alive between requests, and single byte ranges
+    ("Range: bytes=N-") are served, as by the remote servers.
+
+    A fraction of the requests can be made to fail, to exercise the retries of
+    the downloads: half of the faults answer "503 Service Unavailable", the
+    others send only half of the file's contents before dropping the connection.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    fault_rate = 0.0
+
+    def do_GET(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        fault = self.fault_rate > 0 and random.random() < self.fault_rate
+        if fault and random.random() < 0.5:
+            self.send_error(503, 'Injected fault')
+            return
+
+        f = self.send_head()
+        if f:
+            try:
+                if fault:
+                    contents = f.read()
+                    self.wfile.write(contents[:len(contents) // 2])
+                    self.close_connection = True
+                else:
+                    self.copyfile(f, self.wfile)
+            finally:
+                f.close()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', '').strip())
+        if match is None or not os.path.isfile(path):
+            return super().send_head()
+
+        # the rest of the file from the start of the range, if the file didn't change since the If-Range date
+        f = open(path, 'rb')
+        stat = os.fstat(f.fileno())
+        last_modified = self.date_time_string(stat.st_mtime)
+        if self.headers.get('If-Range', last_modified) != last_modified:
+            f.close()
+            return super().send_head()
+
+        start = int(match.group(1))
+        if start >= stat.st_size:
+            f.close()
+            self.send_error(416, 'Range Not Satisfiable')
+            return None
+
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, stat.st_size - 1, stat.st_size))
+        self.send_header('Content-Length', str(stat.st_size - start))
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        return f
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+# ------------------------------------------------------------------------------
+def serve_http(root_dir: str,
+               port=0,
+               latency=0.0,
+               certfile=None,
+               fault_rate=0.0):
+    """
+    Starts a local HTTP server in a background thread, serving the files below
+    a directory laid out like the remote archive, so downloads can be exercised
+    and timed offline.
+
+    With a certificate the server speaks HTTPS, as a stand-in for the CPC
+    server, clients then need to trust the certificate, e.g. through the
+    SSL_CERT_FILE environment variable. A self-signed certificate for
+    127.0.0.1 can be made with:
+
+        $ openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj /CN=127.0.0.1 \\
+                      -addext subjectAltName=IP:127.0.0.1 -keyout server.pem -out server.pem
+
+    :param str root_dir: directory to serve, the URL path maps onto this directory
+    :param int port: port to listen on, 0 to pick a free port
+    :param float latency: seconds to wait before answering each request
+    :param str certfile: PEM file with the server's certificate and private key, None to serve plain HTTP
+    :param float fault_rate: fraction of the requests which fail, either with an error status or cut short
+    :return: the server object (call shutdown() to stop it) and its base URL
+    """
+
+    handler = type('_RequestHandler', (_LatencyRequestHandler,), {'latency': latency, 'fault_rate': fault_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port),
+                                 functools.partial(handler, directory=root_dir))
+    server.daemon_threads = True
+
+    scheme = 'http'
+    if certfile is not None:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = '{0}://127.0.0.1:{1}/'.format(scheme, server.server_address[1])
+    _logger.info('Serving %s at %s', root_dir, base_url)
+
+    return server, base_url
+
+
+# ------------------------------------------------------------------------------
+def serve_ftp(root_dir: str,
+              port=0,
+              fault_rate=0.0):
+    """
+    Starts a local anonymous FTP server in a background thread, requires pyftpdlib.
+
+    A fraction of the transfers can be made to fail, to exercise the retries of
+    the downloads: half of the faults answer "451" (a transient error), the
+    others send only half of the file's contents.
+
+    :param str root_dir: directory to serve as the FTP root
+    :param int port: port to listen on, 0 to pick a free port
+    :param float fault_rate: fraction of the transfers which fail, either with an error reply or cut short
+    :return: the server object (call close_all() to stop it) and its base URL
+    """
+
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    def ftp_RETR(self, file):
+        if not (fault_rate > 0 and random.random() < fault_rate):
+            return FTPHandler.ftp_RETR(self, file)
+
+        offset = self._restart_position
+        self._restart_position = 0
+        if random.random() < 0.5:
+            self.respond('451 Injected fault.')
+            return None
+
+        with open(file, 'rb') as f_in:
+            f_in.seek(offset)
+            contents = f_in.read()
+        self.push_dtp_data(contents[:len(contents) // 2], cmd='RETR')
+        return file
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root_dir)
+    handler = type('_FTPHandler', (FTPHandler,), {'authorizer': authorizer, 'ftp_RETR': ftp_RETR})
+
+    # pyftpdlib's threaded servers share a class-wide stop event, which a stopped server
+    # sets once more on its way out, so each server gets its own for servers to come and go
+    server_class = type('_ThreadedFTPServer', (ThreadedFTPServer,), {'_exit': threading.Event(),
+                                                                     '_lock': threading.Lock()})
+    server = server_class(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = 'ftp://127.0.0.1:{0}/'.format(server.address[1])
+    _logger.info('Serving %s at %s', root_dir, base_url)
+
+    return server, base_url
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    # Serves a local directory as a stand-in for the remote CMORPH archive, e.g.
+    #
+    # $ python -u cmorph_local_server.py --root_dir /data/cmorph_mirror --port 8000 --latency 0.05
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d  %H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root_dir",
+                        help="Directory to serve, laid out like the remote archive",
+                        required=True)
+    parser.add_argument("--port",
+                        help="Port to listen on",
+                        type=int,
+                        default=8000)
+    parser.add_argument("--protocol",
+                        help="Protocol to serve, https requires --certfile",
+                        choices=['http', 'https', 'ftp'],
+                        default='http')
+    parser.add_argument("--certfile",
+                        help="PEM file with the certificate and private key of the HTTPS server",
+                        required=False)
+    parser.add_argument("--latency",
+                        help="Seconds to wait before answering each HTTP request",
+                        type=float,
+                        default=0.0)
+    parser.add_argument("--fault_rate",
+                        help="Fraction of the file requests which fail, with an error or cut short",
+                        type=float,
+                        default=0.0)
+    args = parser.parse_args()
+    if (args.protocol == 'https') != (args.certfile is not None):
+        parser.error('--certfile is required with, and only with, --protocol https')
+
+    if args.protocol in ('http', 'https'):
+        server, url = serve_http(args.root_dir, args.port, args.latency, args.certfile, args.fault_rate)
+    else:
+        server, url = serve_ftp(args.root_dir, args.port, args.fault_rate)
+
+    print('Serving %s at %s, press Ctrl-C to stop' % (args.root_dir, url))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,380 @@
+from collections import OrderedDict
+import contextlib
+import contextvars
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# the stages of an ingest, in the order they're reported, any other stage
+# which is timed is reported after these
+STAGES = ('download', 'decompress', 'decode', 'mask', 'aggregate', 'write')
+
+# ------------------------------------------------------------------------------
+# the metrics and the period (e.g. month) which timed stages are attributed to,
+# set by IngestMetrics.period() for the code running within it
+_CURRENT = contextvars.ContextVar('cmorph_metrics_current', default=None)
+
+
+# ------------------------------------------------------------------------------
+class _Sample:
+    """
+    Number of bytes processed by a timed stage, set by the code being timed.
+    """
+
+    __slots__ = ('bytes',)
+
+    def __init__(self):
+
+        self.bytes = 0
+
+
+# ------------------------------------------------------------------------------
+@contextlib.contextmanager
+def timed(stage: str):
+    """
+    Times a stage of the ingest, e.g. the download or decoding of a daily file,
+    adding its elapsed time (and bytes processed) to the metrics of the current
+    period. Outside of any period nothing is recorded, so library code can be
+    timed unconditionally.
+
+        with cmorph_metrics.timed('decompress') as sample:
+            data = bz2.decompress(compressed)
+            sample.bytes = len(data)
+
+    :param str stage: name of the stage, one of STAGES
+    :return: context manager giving a sample whose bytes attribute is added to
+        the stage's byte count
+    """
+
+    sample = _Sample()
+    current = _CURRENT.get()
+    if current is None:
+        yield sample
+        return
+
+    start = time.perf_counter()
+    try:
+        yield sample
+    finally:
+        metrics, period = current
+        metrics.record(period, stage, time.perf_counter() - start, sample.bytes)
+
+
+# ------------------------------------------------------------------------------
+def bind(function):
+    """
+    Binds a function to the current period, for running on another thread
+    (e.g. a thread pool's) with its stages attributed to the same period.
+
+    :param function: function to be called on another thread, possibly
+        from several threads at once
+    :return: function which calls the function within the current period
+    """
+
+    current = _CURRENT.get()
+
+    def bound(*args, **kwargs):
+        token = _CURRENT.set(current)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _CURRENT.reset(token)
+
+    return bound
+
+
+# ------------------------------------------------------------------------------
+def record(stage: str,
+           seconds: float,
+           nbytes=0):
+    """
+    Adds a stage's elapsed time (and bytes processed) to the metrics of the
+    current period, for a stage timed elsewhere, e.g. in another process
+    which can't see the current period. Outside of any period nothing is
+    recorded.
+
+    :param str stage: name of the stage, one of STAGES
+    :param float seconds: elapsed time of the stage
+    :param int nbytes: number of bytes processed by the stage
+    """
+
+    current = _CURRENT.get()
+    if current is not None:
+        metrics, period = current
+        metrics.record(period, stage, seconds, nbytes)
+
+
+# ------------------------------------------------------------------------------
+def month_period(year: int,
+                 month: int):
+    """
+    :param int year: year
+    :param int month: 1 == January, ..., 12 == December
+    :return: label of the month's period, e.g. "2017-01"
+    :rtype: str
+    """
+
+    return '{0:04d}-{1:02d}'.format(year, month)
+
+
+# ------------------------------------------------------------------------------
+class IngestMetrics:
+    """
+    Per-stage timers and byte counters of an ingest, kept for each period of
+    the ingest loop (typically a month) so that a slow run can be traced to the
+    stage responsible: download, decompression, decoding, masking of missing
+    values, aggregation or the writes.
+
+    Stage times are summed over all the threads working on a period, so with
+    concurrent downloads or pipelining they can add up to more than the
+    elapsed (wall clock) time.
+    """
+
+    def __init__(self,
+                 ingest: str,
+                 output=None):
+        """
+        :param str ingest: name of the ingest, e.g. the script's module name
+        :param str output: path of the ingest's output, which identifies the run
+            amongst others of the same ingest (e.g. the shards of a year each)
+        """
+
+        self.ingest = ingest
+        self.output = output
+        self.start_time = datetime.now()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+        # period -> {'days', 'start', 'end', 'stages': stage -> [seconds, bytes]}, in order of first use
+        self._periods = OrderedDict()
+
+    # --------------------------------------------------------------------------
+    def _period(self,
+                period: str):
+
+        if period not in self._periods:
+            self._periods[period] = {'days': 0, 'start': time.perf_counter(), 'stages': {}}
+        return self._periods[period]
+
+    # --------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def period(self,
+               period: str):
+        """
+        Attributes the stages timed by the code running within the context to a
+        period of the ingest, e.g. "2017-01".
+
+        :param str period: label of the period
+        """
+
+        with self._lock:
+            self._period(period)
+
+        token = _CURRENT.set((self, period))
+        try:
+            yield
+        finally:
+            _CURRENT.reset(token)
+
+    # --------------------------------------------------------------------------
+    def wrap(self,
+             function,
+             period_of):
+        """
+        Wraps a function of a work item, e.g. the produce or consume function of
+        a pipeline over the months of an ingest, so that the stages it times are
+        attributed to the item's period, whichever thread it runs on.
+
+        :param function: function called with a work item and any further arguments
+        :param period_of: function giving the label of a work item's period
+        :return: the wrapped function
+        """
+
+        def wrapped(item, *args):
+            with self.period(period_of(item)):
+                return function(item, *args)
+
+        return wrapped
+
+    # --------------------------------------------------------------------------
+    def record(self,
+               period: str,
+               stage: str,
+               seconds: float,
+               nbytes=0):
+        """
+        Adds the elapsed time and bytes processed by a stage to a period's totals.
+
+        :param str period: label of the period
+        :param str stage: name of the stage
+        :param float seconds: elapsed time of the stage
+        :param int nbytes: number of bytes processed by the stage
+        """
+
+        with self._lock:
+            totals = self._period(period)['stages'].setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += nbytes
+
+    # --------------------------------------------------------------------------
+    def add_days(self,
+                 period: str,
+                 days: int):
+        """
+        :param str period: label of the period
+        :param int days: number of days ingested within the period
+        """
+
+        with self._lock:
+            self._period(period)['days'] += days
+
+    # --------------------------------------------------------------------------
+    def summary(self,
+                period=None):
+        """
+        :param str period: label of the period, None for the totals of the whole ingest
+        :return: dictionary with the number of days, elapsed seconds, and the
+            seconds and bytes of each stage, in reporting order
+        :rtype: dict
+        """
+
+        with self._lock:
+            if period is None:
+                periods = list(self._periods.values())
+                elapsed = time.perf_counter() - self._start
+            else:
+                periods = [self._periods[period]]
+                elapsed = periods[0].get('end', time.perf_counter()) - periods[0]['start']
+
+            stages = {}
+            for totals in periods:
+                for stage, (seconds, nbytes) in totals['stages'].items():
+                    stage_totals = stages.setdefault(stage, [0.0, 0])
+                    stage_totals[0] += seconds
+                    stage_totals[1] += nbytes
+
+        order = [stage for stage in STAGES if stage in stages] + sorted(set(stages) - set(STAGES))
+        return {'days': sum(totals['days'] for totals in periods),
+                'elapsed_seconds': elapsed,
+                'stages': OrderedDict((stage, {'seconds': stages[stage][0], 'bytes': stages[stage][1]})
+                                      for stage in order)}
+
+    # --------------------------------------------------------------------------
+    def log_period(self,
+                   period: str):
+        """
+        Logs the per-stage times and throughputs of a period, once it's complete,
+        which also marks the end of the period's elapsed time.
+
+        :param str period: label of the period
+        """
+
+        with self._lock:
+            self._periods[period].setdefault('end', time.perf_counter())
+        _logger.info('%s: %s', period, _format_summary(self.summary(period)))
+
+    # --------------------------------------------------------------------------
+    def log_totals(self):
+        """
+        Logs the per-stage times and throughputs of the whole ingest.
+        """
+
+        _logger.info('Ingest totals: %s', _format_summary(self.summary()))
+
+    # --------------------------------------------------------------------------
+    def write(self,
+              metrics_file: str):
+        """
+        Writes the metrics of the ingest to a file, in the Prometheus text format
+        if the file has a ".prom" extension (for the node exporter's textfile
+        collector), otherwise as a JSON document with the totals and each period.
+
+        The file is written to a temporary file and moved into place, so that a
+        collector never reads a partially written file.
+
+        :param str metrics_file: path of the metrics file
+        """
+
+        if metrics_file.endswith('.prom'):
+            contents = self._prometheus()
+        else:
+            with self._lock:
+                periods = list(self._periods)
+            contents = json.dumps({'ingest': self.ingest,
+                                   'output': self.output,
+                                   'start_time': self.start_time.isoformat(),
+                                   'totals': self.summary(),
+                                   'periods': OrderedDict((period, self.summary(period)) for period in periods)},
+                                  indent=4)
+
+        temp_file = '{0}.{1}.tmp'.format(metrics_file, uuid.uuid4().hex)
+        try:
+            with open(temp_file, 'w') as f_out:
+                f_out.write(contents)
+            os.replace(temp_file, metrics_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+        _logger.info('Wrote the ingest metrics to %s', metrics_file)
+
+    # --------------------------------------------------------------------------
+    def _prometheus(self):
+
+        totals = self.summary()
+        labels = 'ingest="{0}"'.format(_escape_label(self.ingest))
+        if self.output is not None:
+            labels += ',output="{0}"'.format(_escape_label(os.path.basename(self.output)))
+
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} gauge'.format(name))
+            for sample_labels, value in samples:
+                lines.append('{0}{{{1}}} {2!r}'.format(name, sample_labels, value))
+
+        stage_labels = [('{0},stage="{1}"'.format(labels, stage), stage_totals)
+                        for stage, stage_totals in totals['stages'].items()]
+        gauge('cmorph_ingest_stage_seconds', 'Time spent in each stage of the last ingest, summed over threads',
+              [(stage_label, float(stage['seconds'])) for stage_label, stage in stage_labels])
+        gauge('cmorph_ingest_stage_bytes', 'Bytes processed by each stage of the last ingest',
+              [(stage_label, int(stage['bytes'])) for stage_label, stage in stage_labels])
+        gauge('cmorph_ingest_days', 'Days ingested by the last ingest',
+              [(labels, int(totals['days']))])
+        gauge('cmorph_ingest_elapsed_seconds', 'Elapsed time of the last ingest',
+              [(labels, float(totals['elapsed_seconds']))])
+        gauge('cmorph_ingest_last_run_timestamp_seconds', 'Time at which the last ingest completed',
+              [(labels, float(time.time()))])
+
+        return '\n'.join(lines) + '\n'
+
+
+# ------------------------------------------------------------------------------
+def _escape_label(value: str):
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# ------------------------------------------------------------------------------
+def _format_summary(summary: dict):
+
+    parts = ['{0} days in {1:.2f} s'.format(summary['days'], summary['elapsed_seconds'])]
+    for stage, totals in summary['stages'].items():
+        part = '{0} {1:.2f} s'.format(stage, totals['seconds'])
+        if totals['bytes'] > 0:
+            megabytes = totals['bytes'] / 1024 ** 2
+            part += ' {0:.1f} MB'.format(megabytes)
+            if totals['seconds'] > 0:
+                part += ' ({0:.1f} MB/s)'.format(megabytes / totals['seconds'])
+        parts.append(part)
+
+    return ', '.join(parts)
@@ -0,0 +1,466 @@
+import logging
+import random
+import time
+
+import netCDF4
+import numpy as np
+
+import cmorph_metrics
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# named chunk layouts for the precipitation variable:
+#   "map": one chunk per time step, fastest for reading/writing whole grids
+#   "series": long runs of time steps over small tiles, fastest for reading a grid cell's time series
+CHUNK_LAYOUTS = ('map', 'series')
+
+# default number of time steps buffered by a SlabWriter before each write, about a month of daily values
+DEFAULT_SLAB_SIZE = 31
+
+# number of time steps and the lat/lon tile size of the "series" layout, about 1 MB per chunk for 32-bit values
+_SERIES_TIME_STEPS = 1024
+_SERIES_TILE_SIZE = 16
+
+# storage encodings of the precipitation variable:
+#   "float32": full precision 32-bit floats
+#   "int16": 16-bit integers packed with scale_factor/add_offset, with the scale factor as the precision in mm
+#   "digits": 32-bit floats quantized to a number of decimal digits (least_significant_digit), which compress better
+#   "bitround": 32-bit floats quantized to a number of significant bits (BitRound, requires netCDF-C 4.9 or later)
+ENCODINGS = ('float32', 'int16', 'digits', 'bitround')
+
+# default precision of packed int16 values in mm, CMORPH's own precision, for a range of 0 through 655.34 mm
+DEFAULT_INT16_SCALE = 0.01
+
+# fill value of packed int16 values
+_INT16_FILL = np.int16(-32768)
+
+
+# ------------------------------------------------------------------------------
+def parse_chunking(value: str):
+    """
+    Parses a chunking command line argument, either one of the named layouts or
+    an explicit "time,lat,lon" chunk shape.
+
+    :param str value: "map", "series", or an explicit chunk shape such as "365,16,16"
+    :return: the layout name, a (time, lat, lon) tuple, or None if value is None
+    """
+
+    if value is None or value in CHUNK_LAYOUTS:
+        return value
+
+    try:
+        chunk_sizes = tuple(int(size) for size in value.split(','))
+    except ValueError:
+        chunk_sizes = ()
+    if len(chunk_sizes) != 3 or min(chunk_sizes) < 1:
+        raise ValueError('Invalid chunking: {0}, expected one of {1} or "time,lat,lon"'.format(value, CHUNK_LAYOUTS))
+
+    return chunk_sizes
+
+
+# ------------------------------------------------------------------------------
+def parse_encoding(value: str):
+    """
+    Parses an encoding command line argument.
+
+    :param str value: "float32", "int16" or "int16:scale" (e.g. "int16:0.1" for
+        monthly totals), "digits:N" or "bitround:N"
+    :return: (encoding, parameter) tuple, with the int16 scale factor or the
+        number of digits or bits as the parameter, or None if value is None
+    """
+
+    if value is None:
+        return None
+
+    encoding, _, parameter = value.partition(':')
+    try:
+        if encoding == 'float32' and parameter == '':
+            return encoding, None
+        elif encoding == 'int16':
+            scale_factor = float(parameter) if parameter != '' else DEFAULT_INT16_SCALE
+            if scale_factor > 0:
+                return encoding, scale_factor
+        elif encoding in ('digits', 'bitround') and int(parameter) > 0:
+            return encoding, int(parameter)
+    except ValueError:
+        pass
+
+    raise ValueError('Invalid encoding: {0}, expected float32, int16, int16:scale, digits:N or bitround:N'.format(value))
+
+
+# ------------------------------------------------------------------------------
+def compute_chunksizes(chunking,
+                       time_len: int,
+                       lat_len: int,
+                       lon_len: int):
+    """
+    Computes the chunk shape of a (time, lat, lon) variable.
+
+    :param chunking: "map", "series", or an explicit (time, lat, lon) tuple
+    :param int time_len: number of time steps (the time dimension may grow beyond this)
+    :param int lat_len: length of the lat dimension
+    :param int lon_len: length of the lon dimension
+    :return: (time, lat, lon) chunk sizes
+    :rtype: tuple
+    """
+
+    if chunking == 'map':
+        return 1, lat_len, lon_len
+    elif chunking == 'series':
+        return (max(1, min(time_len, _SERIES_TIME_STEPS)),
+                min(lat_len, _SERIES_TILE_SIZE),
+                min(lon_len, _SERIES_TILE_SIZE))
+
+    # explicit chunk shape, limited to the fixed dimensions' lengths
+    return chunking[0], min(chunking[1], lat_len), min(chunking[2], lon_len)
+
+
+# ------------------------------------------------------------------------------
+def prcp_variable_options(chunking,
+                          time_len: int,
+                          lat_len: int,
+                          lon_len: int,
+                          complevel=0,
+                          shuffle=False):
+    """
+    Builds the storage keyword arguments for netCDF4.Dataset.createVariable()
+    for the (time, lat, lon) precipitation variable.
+
+    :param chunking: "map", "series", an explicit (time, lat, lon) tuple, or None
+        to leave the chunk shape up to the NetCDF library
+    :param int time_len: number of time steps
+    :param int lat_len: length of the lat dimension
+    :param int lon_len: length of the lon dimension
+    :param int complevel: zlib compression level, 0 for no compression
+    :param bool shuffle: whether to apply the HDF5 shuffle filter before compression
+    :return: keyword arguments for createVariable()
+    :rtype: dict
+    """
+
+    if not 0 <= complevel <= 9:
+        raise ValueError('Invalid compression level: {0}'.format(complevel))
+
+    options = {'zlib': complevel > 0,
+               'complevel': max(complevel, 1),
+               'shuffle': shuffle and complevel > 0}
+    if chunking is not None:
+        options['chunksizes'] = compute_chunksizes(chunking, time_len, lat_len, lon_len)
+
+    return options
+
+
+# ------------------------------------------------------------------------------
+def create_prcp_variable(dataset,
+                         dimensions,
+                         chunking,
+                         time_len: int,
+                         lat_len: int,
+                         lon_len: int,
+                         complevel=0,
+                         shuffle=False,
+                         encoding=None,
+                         name='prcp'):
+    """
+    Creates the (time, lat, lon) precipitation variable of a NetCDF with the
+    storage layout and the encoding called for. Missing values are NaNs, or
+    the fill value for packed integers. Values to be written to the variable
+    should go through pack_values() first.
+
+    :param dataset: netCDF4.Dataset in which the variable is created
+    :param tuple dimensions: names of the variable's (time, lat, lon) dimensions
+    :param chunking: "map", "series", an explicit (time, lat, lon) tuple, or None
+        to leave the chunk shape up to the NetCDF library
+    :param int time_len: number of time steps
+    :param int lat_len: length of the lat dimension
+    :param int lon_len: length of the lon dimension
+    :param int complevel: zlib compression level, 0 for no compression
+    :param bool shuffle: whether to apply the HDF5 shuffle filter before compression
+    :param tuple encoding: (encoding, parameter) from parse_encoding(), None for full precision float32
+    :param str name: name of the variable
+    :return: the variable, without any descriptive attributes
+    :rtype: netCDF4.Variable
+    """
+
+    options = prcp_variable_options(chunking, time_len, lat_len, lon_len, complevel, shuffle)
+    encoding, parameter = encoding or ('float32', None)
+
+    if encoding == 'int16':
+        # the lowest packed value is 0 mm, so the full range of the integers goes to the (non-negative) values,
+        # with double precision attributes so that 0 mm unpacks to exactly 0
+        variable = dataset.createVariable(name, 'i2', dimensions, fill_value=_INT16_FILL, **options)
+        variable.scale_factor = np.float64(parameter)
+        variable.add_offset = np.float64(-(np.iinfo('i2').min + 1) * parameter)
+        return variable
+    elif encoding == 'digits':
+        options['least_significant_digit'] = parameter
+    elif encoding == 'bitround':
+        options['significant_digits'] = parameter
+        options['quantize_mode'] = 'BitRound'
+    elif encoding != 'float32':
+        raise ValueError('Invalid encoding: {0}, expected one of {1}'.format(encoding, ENCODINGS))
+
+    return dataset.createVariable(name, 'f4', dimensions, fill_value=np.NaN, **options)
+
+
+# ------------------------------------------------------------------------------
+def pack_values(variable,
+                values):
+    """
+    Prepares floating point values, with NaNs as missing values, for writing
+    to a variable. For a packed integer variable the NaNs are masked, so they're
+    written as the fill value, and values beyond the packed range are clipped
+    to it. Values for other variables are returned as they are.
+
+    :param variable: netCDF4.Variable to be written
+    :param values: array of values
+    :return: the values to write
+    """
+
+    if variable.dtype.kind != 'i':
+        return values
+
+    # the packed range, less the lowest integer which is the fill value
+    integer_info = np.iinfo(variable.dtype)
+    scale_factor = getattr(variable, 'scale_factor', 1.0)
+    add_offset = getattr(variable, 'add_offset', 0.0)
+    low = (integer_info.min + 1) * scale_factor + add_offset
+    high = integer_info.max * scale_factor + add_offset
+
+    values = np.ma.filled(values, np.NaN)
+    missing = np.isnan(values)
+    if np.any(~missing & ((values < low) | (values > high))):
+        _logger.warning('Clipping values beyond the packed range %s through %s of %s', low, high, variable.name)
+
+    return np.ma.masked_array(np.clip(np.where(missing, low, values), low, high), mask=missing)
+
+
+# ------------------------------------------------------------------------------
+class SlabWriter:
+    """
+    Buffered writer of the time steps of a (time, lat, lon) variable, which
+    collects time steps into a preallocated (N, lat, lon) float32 slab and writes
+    each full slab to the variable as a single hyperslab, instead of issuing one
+    small write (and one growth of the unlimited dimension) per time step.
+
+    Every time step of the writer's range [start, stop) is written exactly once,
+    with NaNs for time steps that are never provided (e.g. a missing daily file),
+    so prefill can safely be turned off on the dataset. The variable is extended
+    through the final time step of the range up front, unless the writer is
+    given the time coordinate values, which are then written along with each
+    slab so that the time variable only ever covers the time steps actually
+    written, e.g. for an interrupted ingest to be resumed from.
+
+    Time steps are expected in ascending order, typically one after another,
+    and any which precede the current slab are written individually.
+    """
+
+    def __init__(self,
+                 variable,
+                 slab_size=DEFAULT_SLAB_SIZE,
+                 start=0,
+                 stop=None,
+                 time_variable=None,
+                 time_values=None):
+        """
+        :param variable: (time, lat, lon) netCDF4.Variable to write
+        :param int slab_size: number of time steps per write, for example a month of days or the time chunk depth
+        :param int start: index of the first time step to be written
+        :param int stop: index following the final time step to be written, None to only write the
+            time steps actually provided
+        :param time_variable: netCDF4.Variable of the time coordinate, written along with each slab, or None
+        :param time_values: time coordinate values of the time steps from start onwards, required with time_variable
+        """
+
+        if slab_size < 1:
+            raise ValueError('Invalid slab size: {0}'.format(slab_size))
+
+        self.variable = variable
+        self.slab_size = slab_size
+        self.stop = stop
+        self.start = start
+        self.time_variable = time_variable
+        self.time_values = None if time_values is None else np.asarray(time_values)
+        if time_variable is not None and self.time_values is None:
+            raise ValueError('Time values are required along with the time variable')
+        self._buffer = np.full((slab_size,) + variable.shape[1:], np.NaN, dtype='f4')
+        self._slab_start = start
+        self._count = 0
+
+        # pre-size the variable along the time dimension, the final time step
+        # is overwritten with its actual values if those are provided later
+        if stop is not None and stop > start and time_variable is None:
+            variable[stop - 1, :, :] = pack_values(variable, self._buffer[0])
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+
+        return self
+
+    # --------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+
+    # --------------------------------------------------------------------------
+    def write(self,
+              time_index: int,
+              values):
+        """
+        Adds the values of a time step to the slab, writing out the slab first
+        if the time step falls beyond it.
+
+        :param int time_index: index of the time step within the variable
+        :param values: array of the time step's values, shape (lat, lon) or (1, lat, lon)
+        """
+
+        values = np.ma.filled(values, np.NaN).reshape(self._buffer.shape[1:])
+
+        if time_index < self._slab_start:
+            self.flush()
+            with cmorph_metrics.timed('write') as sample:
+                self.variable[time_index, :, :] = pack_values(self.variable, values)
+                sample.bytes = values.nbytes
+            self._write_times(time_index, time_index + 1)
+            return
+
+        # write out slabs until the time step falls within the current one,
+        # any time steps skipped along the way are written as NaNs
+        while time_index >= self._slab_start + self.slab_size:
+            self._count = self.slab_size
+            self.flush()
+
+        offset = time_index - self._slab_start
+        self._buffer[offset] = values
+        self._count = max(self._count, offset + 1)
+
+    # --------------------------------------------------------------------------
+    def flush(self):
+        """
+        Writes the time steps collected so far to the variable in a single write.
+        """
+
+        if self._count == 0:
+            return
+
+        with cmorph_metrics.timed('write') as sample:
+            self.variable[self._slab_start: self._slab_start + self._count, :, :] = \
+                pack_values(self.variable, self._buffer[:self._count])
+            sample.bytes = self._buffer[:self._count].nbytes
+        self._write_times(self._slab_start, self._slab_start + self._count)
+        self._slab_start += self._count
+        self._buffer[:self._count] = np.NaN
+        self._count = 0
+
+    # --------------------------------------------------------------------------
+    def _write_times(self,
+                     start: int,
+                     stop: int):
+
+        # the time coordinate values of the time steps [start, stop) just written, if the writer writes them
+        if self.time_variable is None:
+            return
+        if stop - self.start > len(self.time_values):
+            raise IndexError('No time values for time steps beyond {0}'.format(self.start + len(self.time_values) - 1))
+        self.time_variable[start:stop] = self.time_values[start - self.start:stop - self.start]
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        """
+        Writes the remaining time steps, with NaNs for any time steps of the
+        writer's range which were never provided.
+        """
+
+        if self.stop is not None:
+            while self._slab_start + self._count < self.stop:
+                self._count = min(self.slab_size, self.stop - self._slab_start)
+                self.flush()
+
+        self.flush()
+
+
+# ------------------------------------------------------------------------------
+def last_ingested_step(variable,
+                       time_variable,
+                       block_size=DEFAULT_SLAB_SIZE):
+    """
+    Finds the final time step of a (time, lat, lon) variable holding ingested
+    data, i.e. with a time coordinate value and at least one value which isn't
+    missing, so that an ingest is resumed after the data actually written
+    rather than after time steps which were only sized, or left as NaNs by an
+    interrupted run or failed downloads. The time steps are read back from the
+    end, a block at a time.
+
+    :param variable: (time, lat, lon) netCDF4.Variable
+    :param time_variable: netCDF4.Variable of the time coordinate
+    :param int block_size: number of time steps read at once
+    :return: index of the final time step holding data, or None if there's none
+    :rtype: int
+    """
+
+    valid_times = ~np.ma.getmaskarray(time_variable[:])
+    stop = min(len(valid_times), variable.shape[0])
+    while stop > 0:
+        start = max(0, stop - block_size)
+        if np.any(valid_times[start:stop]):
+            values = np.ma.filled(np.ma.asarray(variable[start:stop, :, :], dtype='f4'), np.NaN)
+            holding_data = valid_times[start:stop] & np.any(~np.isnan(values), axis=(1, 2))
+            if np.any(holding_data):
+                return start + int(np.flatnonzero(holding_data)[-1])
+        stop = start
+
+    return None
+
+
+# ------------------------------------------------------------------------------
+def benchmark_read_patterns(netcdf_file: str,
+                            variable_name='prcp',
+                            samples=20,
+                            seed=0):
+    """
+    Measures the latency of the two main read patterns against a (time, lat, lon)
+    variable: reading the full grid of a single time step (map read), and reading
+    the full time series of a single grid cell (series read).
+
+    :param str netcdf_file: NetCDF file to read
+    :param str variable_name: name of the (time, lat, lon) variable
+    :param int samples: number of random maps and series to read
+    :param int seed: seed for choosing the random time steps and grid cells
+    :return: dictionary with the variable's chunking and filters, and the median
+        and maximum latencies in seconds of each read pattern
+    :rtype: dict
+    """
+
+    rng = random.Random(seed)
+
+    with netCDF4.Dataset(netcdf_file, 'r') as dataset:
+
+        variable = dataset.variables[variable_name]
+        time_len, lat_len, lon_len = variable.shape
+
+        map_latencies = []
+        for _ in range(samples):
+            time_index = rng.randrange(time_len)
+            start = time.perf_counter()
+            variable[time_index, :, :]
+            map_latencies.append(time.perf_counter() - start)
+
+        series_latencies = []
+        for _ in range(samples):
+            lat_index = rng.randrange(lat_len)
+            lon_index = rng.randrange(lon_len)
+            start = time.perf_counter()
+            variable[:, lat_index, lon_index]
+            series_latencies.append(time.perf_counter() - start)
+
+        return {'shape': variable.shape,
+                'chunking': variable.chunking(),
+                'filters': variable.filters(),
+                'map_read_median': float(np.median(map_latencies)),
+                'map_read_max': float(np.max(map_latencies)),
+                'series_read_median': float(np.median(series_latencies)),
+                'series_read_max': float(np.max(series_latencies))}
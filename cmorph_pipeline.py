@@ -0,0 +1,73 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# default number of produced (fetched and decoded) items which may be held in
+# memory ahead of the writer, including those still being produced
+DEFAULT_QUEUE_DEPTH = 2
+
+
+# ------------------------------------------------------------------------------
+def run_pipeline(items,
+                 produce,
+                 consume,
+                 workers=1,
+                 queue_depth=DEFAULT_QUEUE_DEPTH):
+    """
+    Runs a producer/consumer pipeline over a sequence of work items, typically
+    the months of an ingest: a pool of workers produces the items (downloading
+    and decoding the daily files) while a single consumer, the calling thread,
+    takes the results in their original order (writing them into the output),
+    so network waits, decoding and writes overlap with one another.
+
+    The number of items in flight, i.e. being produced or produced and waiting
+    for the consumer, is bounded by the queue depth, which bounds the memory used
+    to hold decoded data. Producing is paused whenever the queue is full.
+
+    :param items: iterable of work items, in the order they should be consumed
+    :param produce: function called on each item from a worker thread, its
+        return value is passed on to the consumer
+    :param consume: function called with each item and its produced result,
+        in item order, from the calling thread
+    :param int workers: number of producer threads, 0 to run the producer in
+        the calling thread, one item at a time (no pipelining)
+    :param int queue_depth: maximum number of items in flight
+    """
+
+    if workers < 0:
+        raise ValueError('Invalid number of pipeline workers: {0}'.format(workers))
+    if queue_depth < 1:
+        raise ValueError('Invalid queue depth: {0}'.format(queue_depth))
+
+    if workers == 0:
+        for item in items:
+            consume(item, produce(item))
+        return
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+
+                # wait for the oldest item and hand it to the consumer if the queue is full
+                if len(pending) >= queue_depth:
+                    oldest_item, future = pending.popleft()
+                    consume(oldest_item, future.result())
+
+                pending.append((item, executor.submit(produce, item)))
+
+            # drain the queue
+            while pending:
+                oldest_item, future = pending.popleft()
+                consume(oldest_item, future.result())
+
+        except BaseException:
+            # don't wait on (or produce) items which will never be consumed
+            _logger.debug('Cancelling %d pending pipeline items', len(pending))
+            for _, future in pending:
+                future.cancel()
+            raise
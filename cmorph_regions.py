@@ -0,0 +1,148 @@
+import numpy as np
+
+# ------------------------------------------------------------------------------
+# continental US bounding box (west, south, east, north), in 0..360 longitudes,
+# covering the same grid window as the original hard-coded CONUS subset
+CONUS = (232.0, 23.0, 295.25, 50.25)
+
+
+# ------------------------------------------------------------------------------
+def parse_bbox(value: str):
+    """
+    Parses a bounding box command line argument.
+
+    :param str value: "west,south,east,north" in degrees, with longitudes
+        either in -180..180 or 0..360, e.g. "-20,-35,55,38" or "120,-10,250,60"
+    :return: (west, south, east, north) tuple of floats
+    """
+
+    try:
+        bbox = tuple(float(bound) for bound in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise ValueError('Invalid bounding box: {0}, expected "west,south,east,north"'.format(value))
+
+    west, south, east, north = bbox
+    if not (-90.0 <= south < north <= 90.0):
+        raise ValueError('Invalid bounding box latitudes: {0}'.format(value))
+    if not (-180.0 <= west <= 360.0 and -180.0 <= east <= 360.0):
+        raise ValueError('Invalid bounding box longitudes: {0}'.format(value))
+
+    return bbox
+
+
+# ------------------------------------------------------------------------------
+def compute_window(lat_values,
+                   lon_values,
+                   bbox=None):
+    """
+    Computes the grid window covering a bounding box, i.e. the grid cells whose
+    centers fall within the box.
+
+    A box crossing the seam of the grid's longitudes (the 0/360 meridian for the
+    CMORPH grid) results in two column ranges, one running to the end of the
+    grid's columns and the other starting at the first column, which stitched
+    together (in that order) give monotonically increasing longitudes.
+
+    :param lat_values: ascending latitudes of the grid
+    :param lon_values: ascending longitudes of the grid, covering 360 degrees
+    :param bbox: (west, south, east, north) bounding box, with longitudes in
+        either -180..180 or 0..360, or None for the full grid
+    :return: dictionary with the window's "rows", a (start, end) range of lat
+        indices, "columns", a list of one or two (start, end) ranges of lon
+        indices, and the window's "lat_values" and "lon_values", with the
+        longitudes in the same convention as the bounding box's west bound
+    :rtype: dict
+    """
+
+    lat_values = np.asarray(lat_values, dtype=float)
+    lon_values = np.asarray(lon_values, dtype=float)
+
+    if bbox is None:
+        return {'rows': (0, lat_values.size),
+                'columns': [(0, lon_values.size)],
+                'lat_values': lat_values,
+                'lon_values': lon_values}
+
+    west, south, east, north = bbox
+
+    # the rows of the latitudes within the box
+    row_start = int(np.searchsorted(lat_values, south, side='left'))
+    row_end = int(np.searchsorted(lat_values, north, side='right'))
+    if row_start >= row_end:
+        raise ValueError('No grid rows within latitudes {0} to {1}'.format(south, north))
+
+    # the box's longitudes, shifted into the 360 degrees starting at the grid's western edge,
+    # with the east bound following the west bound even if the box crosses the seam
+    width = east - west if east > west else east - west + 360.0
+    lon_edge = lon_values[0] - (lon_values[1] - lon_values[0]) / 2.0
+    shift = ((west - lon_edge) // 360.0) * 360.0
+    west_shifted = west - shift
+    east_shifted = west_shifted + width
+
+    if east_shifted <= lon_edge + 360.0:
+        columns = [(int(np.searchsorted(lon_values, west_shifted, side='left')),
+                    int(np.searchsorted(lon_values, east_shifted, side='right')))]
+        window_lons = lon_values[columns[0][0]:columns[0][1]]
+    else:
+        # two contiguous slabs, from the west bound to the seam and from the seam to the east bound
+        columns = [(int(np.searchsorted(lon_values, west_shifted, side='left')), lon_values.size),
+                   (0, int(np.searchsorted(lon_values, east_shifted - 360.0, side='right')))]
+        window_lons = np.concatenate([lon_values[columns[0][0]:columns[0][1]],
+                                      lon_values[columns[1][0]:columns[1][1]] + 360.0])
+    if sum(end - start for start, end in columns) == 0:
+        raise ValueError('No grid columns within longitudes {0} to {1}'.format(west, east))
+
+    return {'rows': (row_start, row_end),
+            'columns': columns,
+            'lat_values': lat_values[row_start:row_end],
+            'lon_values': window_lons + shift}
+
+
+# ------------------------------------------------------------------------------
+def slice_window(data,
+                 window: dict,
+                 row_offset=0):
+    """
+    Slices a region's window out of data covering a larger window of full-width
+    grid rows, stitching together the window's column ranges.
+
+    :param data: array with the lat and lon dimensions last, covering full rows
+        of the grid starting at the row offset
+    :param dict window: the region's window, from compute_window()
+    :param int row_offset: index of the grid row corresponding to the data's first row
+    :return: array of the window's values
+    :rtype: ndarray
+    """
+
+    rows = slice(window['rows'][0] - row_offset, window['rows'][1] - row_offset)
+    if len(window['columns']) == 1:
+        start, end = window['columns'][0]
+        return data[..., rows, start:end]
+
+    return np.concatenate([data[..., rows, start:end] for start, end in window['columns']], axis=-1)
+
+
+# ------------------------------------------------------------------------------
+def parse_region(value: str):
+    """
+    Parses a region command line argument.
+
+    :param str value: "name:bbox:path", with the bounding box as
+        "west,south,east,north" (see parse_bbox()), "conus", or "global" for the
+        full grid, e.g. "east_africa:21,-12,52,18:/data/cmorph/east_africa.nc"
+    :return: (name, bbox, path) tuple, with a bbox of None for the full grid
+    """
+
+    try:
+        name, bbox, path = value.split(':', 2)
+    except ValueError:
+        raise ValueError('Invalid region: {0}, expected "name:bbox:path"'.format(value))
+
+    if bbox == 'global':
+        return name, None, path
+    elif bbox == 'conus':
+        return name, CONUS, path
+
+    return name, parse_bbox(bbox), path
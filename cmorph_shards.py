@@ -0,0 +1,220 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import shutil
+from xml.sax.saxutils import quoteattr
+
+import netCDF4
+import numpy as np
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# attributes maintained by the netCDF library (dimension scale bookkeeping),
+# which aren't carried over into a virtual dataset
+_NETCDF_INTERNAL_ATTRIBUTES = ('CLASS', 'NAME', 'DIMENSION_LIST', 'REFERENCE_LIST',
+                               '_Netcdf4Dimid', '_Netcdf4Coordinates', '_NCProperties')
+
+
+# ------------------------------------------------------------------------------
+def shard_file_name(shard_dir: str,
+                    prefix: str,
+                    year: int):
+    """
+    :param str shard_dir: directory where the shards reside
+    :param str prefix: file name prefix of the shards
+    :param int year: year of the shard
+    :return: path of the shard NetCDF for a year
+    """
+
+    return os.path.join(shard_dir, '{0}_{1}.nc'.format(prefix, year))
+
+
+# ------------------------------------------------------------------------------
+def _ingest_shard(ingest_function,
+                  work_dir: str,
+                  shard_file: str,
+                  year: int,
+                  download_files: bool,
+                  ingest_kwargs: dict):
+
+    # each shard writes the metrics of its ingest to a file of its own, named for the year
+    if ingest_kwargs.get('metrics_file') is not None:
+        root, extension = os.path.splitext(ingest_kwargs['metrics_file'])
+        ingest_kwargs = dict(ingest_kwargs, metrics_file='{0}_{1}{2}'.format(root, year, extension))
+
+    # the daily files are downloaded into a work directory of the shard's own
+    # (the data descriptor comes from the local descriptor cache), which is
+    # removed along with whatever the shard's ingest left in it once it's done
+    if download_files:
+        work_dir = os.path.join(work_dir, 'shard_{0}'.format(year))
+        os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        ingest_function(work_dir, shard_file, download_files=download_files, years=[year], **ingest_kwargs)
+    finally:
+        if download_files:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return shard_file
+
+
+# ------------------------------------------------------------------------------
+def ingest_shards(ingest_function,
+                  work_dir: str,
+                  shard_dir: str,
+                  years,
+                  processes=None,
+                  prefix='cmorph',
+                  download_files=True,
+                  **ingest_kwargs):
+    """
+    Ingests each year into a NetCDF shard of its own, with the years ingested
+    concurrently by a pool of processes, so that a full rebuild scales with the
+    number of cores.
+
+    :param ingest_function: ingest function called for each year as
+        ingest_function(work_dir, shard_file, download_files=..., years=[year], **ingest_kwargs),
+        which must be importable at module level, for use by other processes
+    :param str work_dir: work directory of the ingest, if downloading files
+        then each shard gets a temporary subdirectory of its own below this
+    :param str shard_dir: directory where the shards are written, created if necessary
+    :param years: years to ingest
+    :param int processes: number of processes, None for the number of cores
+    :param str prefix: file name prefix of the shards
+    :param bool download_files: whether the ingest downloads the files
+    :param ingest_kwargs: further keyword arguments of the ingest function
+    :return: paths of the shards, in year order
+    :rtype: list
+    """
+
+    if not download_files and ingest_kwargs.get('remove_files', True):
+        raise ValueError('Shards ingested from local files must not remove files, '
+                         'as the shards share the work directory')
+
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_files = [shard_file_name(shard_dir, prefix, year) for year in years]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_ingest_shard,
+                                   ingest_function,
+                                   work_dir,
+                                   shard_file,
+                                   year,
+                                   download_files,
+                                   ingest_kwargs)
+                   for year, shard_file in zip(years, shard_files)]
+        for future in futures:
+            _logger.info('Ingested shard %s', future.result())
+
+    return shard_files
+
+
+# ------------------------------------------------------------------------------
+def _time_lengths(shard_files):
+
+    lengths = []
+    for shard_file in shard_files:
+        with netCDF4.Dataset(shard_file, 'r') as dataset:
+            lengths.append(len(dataset.dimensions['time']))
+
+    return lengths
+
+
+# ------------------------------------------------------------------------------
+def _relative_path(path: str,
+                   start_file: str):
+
+    return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(start_file)))
+
+
+# ------------------------------------------------------------------------------
+def write_ncml(shard_files,
+               ncml_file: str):
+    """
+    Publishes the shards as a single dataset through an NcML aggregation joining
+    them along the time dimension, a metadata-only file readable by THREDDS and
+    the netCDF-Java tools. The shards' time lengths are recorded so that readers
+    don't need to open every shard to assemble the time dimension.
+
+    :param shard_files: paths of the shards, in time order
+    :param str ncml_file: path of the NcML file, the shards are referenced relative to it
+    """
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2">',
+             '  <aggregation dimName="time" type="joinExisting">']
+    for shard_file, time_length in zip(shard_files, _time_lengths(shard_files)):
+        lines.append('    <netcdf location={0} ncoords="{1}"/>'.format(quoteattr(_relative_path(shard_file, ncml_file)),
+                                                                        time_length))
+    lines += ['  </aggregation>',
+              '</netcdf>']
+
+    with open(ncml_file, 'w') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+
+
+# ------------------------------------------------------------------------------
+def _copy_attributes(source,
+                     destination):
+
+    for name, value in source.attrs.items():
+        if name not in _NETCDF_INTERNAL_ATTRIBUTES:
+            destination.attrs[name] = value
+
+
+# ------------------------------------------------------------------------------
+def write_virtual_dataset(shard_files,
+                          output_file: str,
+                          variable_name='prcp'):
+    """
+    Publishes the shards as a single dataset through an HDF5 virtual dataset,
+    whose data variable maps onto the shards' variables without copying any data,
+    and which is readable as NetCDF4. Only the (small) coordinate variables are
+    copied, with the time values of all shards concatenated. Requires h5py.
+
+    :param shard_files: paths of the shards, in time order
+    :param str output_file: path of the virtual dataset file, the shards are
+        referenced relative to it and are expected to stay in place
+    :param str variable_name: name of the (time, lat, lon) data variable
+    """
+
+    import h5py
+
+    time_values = []
+    sources = []
+    for shard_file in shard_files:
+        with h5py.File(shard_file, 'r') as shard:
+            time_values.append(shard['time'][:])
+            sources.append(h5py.VirtualSource(_relative_path(shard_file, output_file),
+                                              variable_name,
+                                              shape=shard[variable_name].shape,
+                                              dtype=shard[variable_name].dtype))
+    time_values = np.concatenate(time_values)
+
+    # virtual datasets need the HDF5 1.10 file format, newer formats
+    # may not be readable by the HDF5 library of the NetCDF readers
+    with h5py.File(shard_files[0], 'r') as first_shard, h5py.File(output_file, 'w', libver=('v110', 'v110')) as output:
+
+        _copy_attributes(first_shard, output)
+
+        # coordinate variables as dimension scales, so they're seen as NetCDF dimensions
+        for coordinate_name, values in (('time', time_values),
+                                        ('lat', first_shard['lat'][:]),
+                                        ('lon', first_shard['lon'][:])):
+            coordinate = output.create_dataset(coordinate_name, data=values)
+            _copy_attributes(first_shard[coordinate_name], coordinate)
+            coordinate.make_scale(coordinate_name)
+
+        # the data variable, mapped onto the shards' variables one after another along the time dimension
+        _, lat_len, lon_len = sources[0].shape
+        layout = h5py.VirtualLayout(shape=(time_values.size, lat_len, lon_len), dtype=sources[0].dtype)
+        time_index = 0
+        for source in sources:
+            layout[time_index: time_index + source.shape[0]] = source
+            time_index += source.shape[0]
+        variable = output.create_virtual_dataset(variable_name, layout, fillvalue=np.NaN)
+        _copy_attributes(first_shard[variable_name], variable)
+        for axis, coordinate_name in enumerate(('time', 'lat', 'lon')):
+            variable.dims[axis].attach_scale(output[coordinate_name])
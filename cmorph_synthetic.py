@@ -0,0 +1,296 @@
+import argparse
+import bz2
+from datetime import datetime, timedelta
+import gzip
+import logging
+import os
+
+import netCDF4
+import numpy as np
+
+# ------------------------------------------------------------------------------
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# the global 0.25 degree grid of the CMORPH daily files, as (lat, lon) counts, starts and increments
+GRID_SHAPE = (480, 1440)
+_LAT_START = -59.875
+_LON_START = 0.125
+_INCREMENT = 0.25
+_UNDEF = -999.0
+
+# ------------------------------------------------------------------------------
+# paths of the daily files of each product relative to the archive root, which
+# stands in for the servers' roots, i.e. the CICS FTP archive read by
+# ingest_cmorph.py and ingest_cmorph_daily.py and the CPC archive read by
+# ingest_cmorph_daily_icdr.py, and the number of grids (time steps) per file
+_PRODUCTS = {
+    'cics_raw': ('olivier/data_CMORPH_NIDIS/02_RAW/{0:%Y}/{0:%Y%m}/CMORPH_V1.0_RAW_0.25deg-DLY_00Z_{0:%Y%m%d}', 1),
+    'cics_adjusted': ('olivier/data_CMORPH_NIDIS/01_GAUGE_ADJUSTED/{0:%Y}/{0:%Y%m}/'
+                      'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_{0:%Y%m%d}', 1),
+    'raw': ('precip/CMORPH_V0.x/RAW/0.25deg-DLY_00Z/{0:%Y}/{0:%Y%m}/CMORPH_V0.x_RAW_0.25deg-DLY_00Z_{0:%Y%m%d}', 1),
+    'adjusted': ('precip/CMORPH_V1.0/CRT/0.25deg-DLY_00Z/{0:%Y}/{0:%Y%m}/CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_{0:%Y%m%d}', 1),
+    'adjusted_3hourly': ('precip/CMORPH_V1.0/CRT/0.25deg-3HLY/{0:%Y}/{0:%Y%m}/CMORPH_V1.0_ADJ_0.25deg-3HLY_{0:%Y%m%d}', 8),
+    'icdr': ('precip/CMORPH_RT/ICDR/0.25deg-DLY_00Z/CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_{0:%Y%m%d}', 1),
+}
+PRODUCTS = tuple(_PRODUCTS)
+
+# ------------------------------------------------------------------------------
+# paths of the data descriptors relative to the archive root, with the time
+# step of each (daily or 3-hourly), as read by the ingest scripts
+_DESCRIPTORS = {
+    'olivier/data_CMORPH_NIDIS/03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl': False,
+    'precip/CMORPH_V1.0/CTL/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl': False,
+    'precip/CMORPH_V1.0/CTL/CMORPH_V1.0_CRT_0.25deg-3HLY.ctl': True,
+}
+
+
+# ------------------------------------------------------------------------------
+def compression(product: str,
+                date):
+    """
+    :param str product: one of PRODUCTS
+    :param date: date of the daily file
+    :return: compression of the product's daily file as stored on the server,
+        "gz", "bz2", or "nc" for the (uncompressed) ICDR NetCDF files
+    :rtype: str
+    """
+
+    if product == 'icdr':
+        return 'nc'
+    elif product == 'raw' or (product == 'cics_raw' and date.year < 2004):
+        return 'gz'
+    return 'bz2'
+
+
+# ------------------------------------------------------------------------------
+def daily_file_path(product: str,
+                    date):
+    """
+    :param str product: one of PRODUCTS
+    :param date: date of the daily file
+    :return: path of the product's daily file relative to the archive root,
+        including the compression extension
+    :rtype: str
+    """
+
+    if product not in _PRODUCTS:
+        raise ValueError('Invalid product: {0}'.format(product))
+
+    return _PRODUCTS[product][0].format(date) + '.' + compression(product, date)
+
+
+# ------------------------------------------------------------------------------
+def synthetic_grids(random_state,
+                    steps=1,
+                    shape=GRID_SHAPE,
+                    wet_fraction=0.3,
+                    missing_fraction=0.02):
+    """
+    Generates precipitation grids resembling the CMORPH values, mostly dry
+    with gamma distributed amounts in the wet cells and a scattering of
+    missing values, which compress about as well as the real files.
+
+    :param random_state: numpy.random.RandomState used for the values
+    :param int steps: number of grids, i.e. time steps per file
+    :param tuple shape: (lat, lon) shape of each grid
+    :param float wet_fraction: fraction of the cells with precipitation
+    :param float missing_fraction: fraction of the cells with the missing value
+    :return: array of 32-bit float values (mm) with shape (steps, lat, lon)
+    :rtype: ndarray
+    """
+
+    shape = (steps,) + tuple(shape)
+    values = random_state.gamma(0.6, 8.0 / steps, shape).astype('f4')
+    values[random_state.random_sample(shape) >= wet_fraction] = 0.0
+    values[random_state.random_sample(shape) < missing_fraction] = _UNDEF
+
+    return values
+
+
+# ------------------------------------------------------------------------------
+def write_descriptor(descriptor_file: str,
+                     start_date,
+                     three_hourly=False,
+                     grid_shape=GRID_SHAPE):
+    """
+    Writes a GrADS data descriptor (.ctl) matching the synthetic daily files.
+
+    :param str descriptor_file: path of the descriptor file
+    :param start_date: first date of the archive, the descriptor's TDEF start
+    :param bool three_hourly: if True then describe the 3-hourly files, with
+        their "00z01jan1998"-style start and 3-hour increment
+    :param tuple grid_shape: (lat, lon) shape of the grid, from the grid's
+        first cell, the full global grid by default
+    """
+
+    if three_hourly:
+        tdef = '00z{0}  3hr'.format(start_date.strftime('%d%b%Y').lower())
+        dset = '../0.25deg-3HLY/%y4/%y4%m2/CMORPH_V1.0_ADJ_0.25deg-3HLY_%y4%m2%d2'
+    else:
+        tdef = '{0}  1dy'.format(start_date.strftime('%d%b%Y').lower())
+        dset = '../0.25deg-DLY_00Z/%y4/%y4%m2/CMORPH_V1.0_RAW_0.25deg-DLY_00Z_%y4%m2%d2'
+
+    lines = ['DSET {0}'.format(dset),
+             'TITLE  Synthetic CMORPH Version 1.0, daily precip from 00Z-24Z',
+             'OPTIONS template little_endian',
+             'UNDEF  {0}'.format(_UNDEF),
+             'XDEF {0} LINEAR    {1}  {2}'.format(grid_shape[1], _LON_START, _INCREMENT),
+             'YDEF  {0} LINEAR  {1}  {2}'.format(grid_shape[0], _LAT_START, _INCREMENT),
+             'ZDEF   01 LEVELS 1',
+             'TDEF 99999 LINEAR  {0}'.format(tdef),
+             'VARS 1',
+             'cmorph   1   99 yyyyy Synthetic CMORPH precipitation (mm)',
+             'ENDVARS']
+
+    os.makedirs(os.path.dirname(descriptor_file), exist_ok=True)
+    with open(descriptor_file, 'w') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+
+
+# ------------------------------------------------------------------------------
+def write_daily_file(daily_file: str,
+                     values,
+                     date,
+                     file_compression: str):
+    """
+    Writes a synthetic daily file in the format of the remote archive, either a
+    compressed little endian binary file or an ICDR NetCDF.
+
+    :param str daily_file: path of the file
+    :param values: (steps, lat, lon) array of the file's values
+    :param date: date of the file
+    :param str file_compression: "gz", "bz2" or "nc"
+    """
+
+    os.makedirs(os.path.dirname(daily_file), exist_ok=True)
+
+    # write to a temporary file and move into place, so an interrupted
+    # build never leaves a truncated file to be served on the next run
+    temp_file = daily_file + '.tmp'
+    if file_compression == 'nc':
+        with netCDF4.Dataset(temp_file, 'w', format='NETCDF4') as dataset:
+            dataset.createDimension('time', None)
+            dataset.createDimension('lat', values.shape[1])
+            dataset.createDimension('lon', values.shape[2])
+            time_variable = dataset.createVariable('time', 'f8', ('time',))
+            time_variable.units = 'days since 1998-01-01 00:00:00'
+            time_variable[:] = [(date - datetime(1998, 1, 1).date()).days]
+            dataset.createVariable('lat', 'f4', ('lat',))[:] = _LAT_START + np.arange(values.shape[1]) * _INCREMENT
+            dataset.createVariable('lon', 'f4', ('lon',))[:] = _LON_START + np.arange(values.shape[2]) * _INCREMENT
+            dataset.createVariable('cmorph', 'f4', ('time', 'lat', 'lon',), zlib=True)[:] = values
+    else:
+        # the default levels of the gzip and bzip2 command line tools
+        if file_compression == 'gz':
+            f_out = gzip.open(temp_file, 'wb', compresslevel=6)
+        else:
+            f_out = bz2.open(temp_file, 'wb', compresslevel=9)
+        with f_out:
+            f_out.write(values.astype('<f4').tobytes())
+    os.replace(temp_file, daily_file)
+
+
+# ------------------------------------------------------------------------------
+def build_archive(root_dir: str,
+                  start_date,
+                  end_date,
+                  products=PRODUCTS,
+                  seed=0,
+                  overwrite=False,
+                  grid_shape=GRID_SHAPE):
+    """
+    Builds a synthetic CMORPH archive laid out like the remote servers, to be
+    served by cmorph_local_server for timing the ingest scripts offline.
+
+    Files already present are kept (unless overwriting), so a large archive is
+    only built once and then reused from one benchmark run to the next.
+
+    :param str root_dir: directory standing in for the servers' roots
+    :param datetime.date start_date: first date of the archive
+    :param datetime.date end_date: final date of the archive
+    :param products: products for which daily files are written, from PRODUCTS
+    :param int seed: seed of the random values, each file's values depend only
+        on the seed, the product and the date
+    :param bool overwrite: if True then rewrite files which are already present
+    :param tuple grid_shape: (lat, lon) shape of the grid, from the grid's first
+        cell, the full global grid by default, a smaller one making for quick runs
+    :return: dictionary of the paths (relative to the root) of each product's daily files
+    :rtype: dict
+    """
+
+    for product in products:
+        if product not in _PRODUCTS:
+            raise ValueError('Invalid product: {0}'.format(product))
+
+    for descriptor_path, three_hourly in _DESCRIPTORS.items():
+        write_descriptor(os.path.join(root_dir, descriptor_path), start_date, three_hourly, grid_shape)
+
+    files = {product: [] for product in products}
+    day_count = (end_date - start_date).days + 1
+    for day in range(day_count):
+
+        date = start_date + timedelta(days=day)
+        for product in products:
+
+            daily_path = daily_file_path(product, date)
+            files[product].append(daily_path)
+            daily_file = os.path.join(root_dir, daily_path)
+            if os.path.exists(daily_file) and not overwrite:
+                continue
+
+            random_state = np.random.RandomState([seed, date.toordinal(), PRODUCTS.index(product)])
+            write_daily_file(daily_file,
+                             synthetic_grids(random_state, _PRODUCTS[product][1], grid_shape),
+                             date,
+                             compression(product, date))
+
+        if date.day == 1:
+            _logger.info('Built the synthetic daily files for %s', date.strftime('%Y-%m'))
+
+    return files
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    # Builds a synthetic archive for benchmarking, to be served with cmorph_local_server.py, e.g.
+    #
+    # $ python -u cmorph_synthetic.py --root_dir /data/cmorph_mirror --start_date 2017-01-01 --end_date 2017-12-31
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d  %H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root_dir",
+                        help="Directory in which the archive is laid out like the remote servers",
+                        required=True)
+    parser.add_argument("--start_date",
+                        help="First date of the archive (YYYY-MM-DD format)",
+                        type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        required=True)
+    parser.add_argument("--end_date",
+                        help="Final date of the archive (YYYY-MM-DD format)",
+                        type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        required=True)
+    parser.add_argument("--product",
+                        help="Product for which daily files are built, may be repeated, all products by default",
+                        choices=PRODUCTS,
+                        action='append',
+                        dest='products')
+    parser.add_argument("--seed",
+                        help="Seed of the random values",
+                        type=int,
+                        default=0)
+    parser.add_argument("--overwrite",
+                        help="Rebuild the daily files which are already present",
+                        action='store_true',
+                        default=False)
+    args = parser.parse_args()
+
+    build_archive(args.root_dir,
+                  args.start_date,
+                  args.end_date,
+                  args.products or PRODUCTS,
+                  args.seed,
+                  args.overwrite)
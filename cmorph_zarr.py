@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# ------------------------------------------------------------------------------
+def create_store(store_path: str,
+                 data_desc: dict,
+                 lat_values,
+                 lon_values,
+                 time_values,
+                 units_since_year: int):
+    """
+    Creates a Zarr store as an alternative output to a NetCDF, with the same
+    coordinate variables, precipitation variable and attributes as the NetCDF
+    created by the ingest scripts. Requires zarr (version 3 or later).
+
+    The precipitation array is chunked by day, i.e. each day is a chunk of its
+    own, so that days can be written concurrently by any number of workers (or
+    processes) without coordination, with days which are never written reading
+    as NaNs. Once all days are written the store's metadata should be
+    consolidated with consolidate_store().
+
+    :param str store_path: path of the Zarr store (a directory), overwritten if present
+    :param dict data_desc: data description dictionary, for the title
+    :param lat_values: latitude coordinate values
+    :param lon_values: longitude coordinate values
+    :param time_values: time coordinate values, in days since January 1st of the units' since year
+    :param int units_since_year: year of the time units' reference date
+    :return: the store's root group, with the "prcp" array to be filled in day by day
+    """
+
+    import zarr
+
+    group = zarr.open_group(store_path, mode='w')
+    group.attrs['title'] = data_desc['title']
+
+    # the coordinate variables and their attributes
+    coordinates = (('time', 'i4', time_values, {'units': 'days since {0}-01-01'.format(units_since_year),
+                                                'long_name': 'Time',
+                                                'calendar': 'gregorian'}),
+                   ('lat', 'f4', lat_values, {'units': 'degrees_north',
+                                              'long_name': 'Latitude'}),
+                   ('lon', 'f4', lon_values, {'units': 'degrees_east',
+                                              'long_name': 'Longitude'}))
+    for name, dtype, values, attributes in coordinates:
+        array = group.create_array(name, shape=(len(values),), dtype=dtype, dimension_names=(name,))
+        array[:] = np.array(values, dtype)
+        array.attrs.update(attributes)
+
+    # the precipitation variable, one chunk per day
+    data_array = group.create_array('prcp',
+                                    shape=(len(time_values), len(lat_values), len(lon_values)),
+                                    chunks=(1, len(lat_values), len(lon_values)),
+                                    dtype='f4',
+                                    fill_value=np.NaN,
+                                    dimension_names=('time', 'lat', 'lon'))
+    data_array.attrs.update({'units': 'mm',
+                             'standard_name': 'precipitation',
+                             'long_name': 'Precipitation',
+                             'description': data_desc['title']})
+
+    return group
+
+
+# ------------------------------------------------------------------------------
+def consolidate_store(store_path: str):
+    """
+    Consolidates the metadata of a Zarr store into a single object, so that
+    readers (e.g. xarray/dask) open the store with a single read.
+
+    :param str store_path: path of the Zarr store
+    """
+
+    import zarr
+
+    zarr.consolidate_metadata(store_path)
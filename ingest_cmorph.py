@@ -1,18 +1,22 @@
 import argparse
-import bz2
 import calendar
 from datetime import datetime
 # import ftplib
-import gzip
 import logging
-import netCDF4
 import numpy as np
 import os
-import shutil
 import urllib.error
-import urllib.request
 import warnings
 
+import cmorph_aggregate
+import cmorph_cache
+import cmorph_ctl
+import cmorph_decompress
+import cmorph_download
+import cmorph_io
+import cmorph_metrics
+import cmorph_netcdf
+
 #-----------------------------------------------------------------------------------------------------------------------
 # set up a basic, global _logger which will write to the console as standard error
 logging.basicConfig(level=logging.INFO,
@@ -30,82 +34,99 @@ _MONTH_DAYS_NONLEAP = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 _MONTH_DAYS_LEAP = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 #-----------------------------------------------------------------------------------------------------------------------
-def _read_daily_cmorph_to_monthly_sum(cmorph_files,
-                                      data_desc,
-                                      data_year,
-                                      data_month):
+# base URL of the CMORPH archive, the daily files live below this in per-year/per-month directories
+_URL_BASE = 'ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/'
+
+#-----------------------------------------------------------------------------------------------------------------------
+# year of the time units' reference date, times are in days since January 1st of this year
+_UNITS_SINCE_YEAR = 1800
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _read_daily_cmorph(cmorph_file,
+                       data_desc):
+    """
+    Reads the values of a daily CMORPH binary file.
     
-    # for each file in the data directory read the data and add to the cumulative
-    summed_data = np.zeros((data_desc['xdef_count'] * data_desc['ydef_count'], ))
-    for cmorph_file in cmorph_files:
-        
-        # read the year and month from the file name, make sure they all match
-        file_year = int(cmorph_file[-8:-4])
-        file_month = int(cmorph_file[-4:-2])
-        if file_year != data_year:
-            continue
-        elif file_month != data_month:
-            continue
-
-        # read the daily binary data from file, byte swap if not little endian, and mask the missing/fill values
-        data = np.fromfile(cmorph_file, 'f')
+    :param cmorph_file: path of a daily file, or the decompressed file contents
+    :param data_desc: data description dictionary from _read_description()
+    :return: array of the day's values with shape (lat, lon), with missing values as NaNs
+    :rtype: ndarray
+    """
+    
+    # read the daily binary data from file (or memory), byte swap if not little endian, assume lat/lon orientation
+    data = cmorph_io.load_daily(cmorph_file)
+    with cmorph_metrics.timed('decode'):
         if not data_desc['little_endian']:
             data = data.byteswap()
-            
-        # replace missing values with zeros, so when we sum with previous values 
-        # we're not adding anything to the sum where we actually have missing data
-        data[data == data_desc['undef']] = 0.0
+        data = np.reshape(data.astype('f4'), (data_desc['ydef_count'], data_desc['xdef_count']))
         
-        # add to the summation array
-        summed_data += data
+    # convert missing values to NaNs, which the aggregation leaves out of the sums and the valid day counts
+    with cmorph_metrics.timed('mask') as sample:
+        data[data == data_desc['undef']] = np.NaN
+        sample.bytes = data.nbytes
 
-    return summed_data
+    return data
 
 #-----------------------------------------------------------------------------------------------------------------------
-def _get_years():
+def _get_years(downloader=None):
+    """
+    :param downloader: cmorph_download.Downloader through which the server's directory of raw data years is listed, 
+                       or None for the years known to be available, 1998 through 2017
+    :return: the years for which raw data is available, in ascending order
+    """
     
-    return list(range(1998, 2018))  # we know this, but not portable/reusable
-
-#FIXME use the below once we work out the proxy issue on Windows
-#
-#     # read the listing of directories from the list of raw data years, these should all be 4-digit years
-#     f = ftplib.FTP()
-#     f.connect('ftp://filsrv.cicsnc.org')
-#     f.login('anonymous')
-#     f.cwd('olivier/data_CMORPH_NIDIS/02_RAW')
-#     ls = f.mlsd()
-#     f.close()
-# 
-#     years = []
-#     for items in ls:
-#         if item['type'] == 'dir':
-#             year = item['name']
-#             if year.isdigit() and len(year) == 4 and int(year) > 1900:
-#                 years.append(year)
-#             
-#     return years
+    known_years = list(range(1998, 2018))
+    if downloader is None:
+        return known_years
+
+    # the raw data has a directory per year, named for the 4-digit year
+    url = _URL_BASE + '02_RAW/'
+    if not downloader.can_list(url):
+        return known_years
+    try:
+        listing = downloader.list_directory(url)
+    except (urllib.error.URLError, OSError, EOFError) as ex:
+        _logger.warning('Failed to list the years at %s, assuming 1998 through 2017: %s', url, ex)
+        return known_years
+
+    return sorted(int(name) for name, (kind, _) in listing.items() 
+                  if kind == 'dir' and name.isdigit() and len(name) == 4 and int(name) > 1900)
 
 #-----------------------------------------------------------------------------------------------------------------------
-def _download_data_descriptor(work_dir):
-    
-    file_url = "ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl"
-    data_descriptor_file = work_dir + '/cmorph_data_descriptor.txt'
-    urllib.request.urlretrieve(file_url, data_descriptor_file)
-    return data_descriptor_file
-    
+def _with_missing(results,
+                  available):
+    """
+    :param results: results of the downloads of the available files
+    :param available: whether each file is available, for all files
+    :return: the results for all files, with None for the files which aren't available
+    """
+
+    results = iter(results)
+    return [next(results) if found else None for found in available]
+
 #-----------------------------------------------------------------------------------------------------------------------
 def _download_daily_files(destination_dir,
                           year, 
                           month,
-                          raw=True):
+                          raw=True,
+                          downloader=None,
+                          in_memory=False,
+                          name_template=None,
+                          decompressor=None):
     """
     Downloads the daily files corresponding to a specific month.
     
     :param destination_dir: location where downloaded files will reside
     :param year:
-    :param month: 1 == January, ..., 12 == December
+    :param month: 1 == January, ..., 12 == December, or None to download all months of the year as a single batch
     :param raw: True: ingest raw data files, False: ingest the gauge adjusted data files
-    :return: list of the downloaded files (full paths)
+    :param downloader: cmorph_download.Downloader to use (concurrency, caching), a serial one if None
+    :param in_memory: if True then stream and decompress the files in memory rather than writing them to disk
+    :param name_template: DSET template of the data descriptor from which the files' names are generated, 
+                          the product's usual names are used if None
+    :param decompressor: cmorph_decompress.Decompressor through which the files are decompressed, a serial one if None
+    :return: list of the downloaded files (full paths), or of the decompressed file contents (bytearrays) if in_memory 
+             is True, in date order, with None for each file which failed to download
     """
 
     # determine which set of days per month we'll use based on if leap year or not    
@@ -114,219 +135,231 @@ def _download_daily_files(destination_dir,
     else:
         days_in_month = _MONTH_DAYS_NONLEAP
         
-    # the base URL we'll append to in order to get the individual file URLs
-    year_month = str(year) + str(month).zfill(2)
-    if raw:
-        url_base = 'ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/02_RAW/' + str(year) + '/' + year_month
-        filename_base = 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_'
+    # download either the single month or all the months of the year at once
+    if month is None:
+        months = range(1, 13)
     else:
-        url_base = 'ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/01_GAUGE_ADJUSTED/' + str(year) + '/' + year_month
-        filename_base = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_'
-
-    # list of files we'll return
-    files = []
-    
-    for day in range(days_in_month[month - 1]):
-        
-        # build the file name, URL, and local file name
-        filename_unzipped = filename_base + year_month + str(day + 1).zfill(2)
-        zip_extension = '.gz'
-        if not raw or year >= 2004:   # after 2003 the RAW data uses bz2, all gauge adjusted files use bz2
-            zip_extension = '.bz2'
-        filename_zipped = filename_unzipped + zip_extension
-        
-        file_url  = url_base + '/' + filename_zipped
-        local_filename_zipped = destination_dir + '/' + filename_zipped
-        local_filename_unzipped = destination_dir + '/' + filename_unzipped
-        
-        _logger.info('Downloading %s', file_url)
+        months = [month]
+
+    # the downloader used for the listings and the files, a serial one if not given
+    if downloader is None:
+        downloader = cmorph_download.Downloader()
+
+    # build the list of (URL, local zipped file, local unzipped file) for all days, along with whether each
+    # file was found in its month's directory listing, files missing from the server aren't requested
+    downloads = []
+    available = []
+    for month in months:
+
+        # the base URL we'll append to in order to get the individual file URLs
+        year_month = str(year) + str(month).zfill(2)
+        if raw:
+            url_base = _URL_BASE + '02_RAW/' + str(year) + '/' + year_month
+            filename_base = 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_'
+        else:
+            url_base = _URL_BASE + '01_GAUGE_ADJUSTED/' + str(year) + '/' + year_month
+            filename_base = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_'
+
+        # the files of the month on the server, if it can be listed
+        listing = downloader.list_files(url_base)
+
+        for day in range(days_in_month[month - 1]):
         
-        try:
-            # download the zipped file
-            urllib.request.urlretrieve(file_url, local_filename_zipped)
-    
-            # decompress the zipped file
-            if not raw or year >= 2004:
-                # use BZ2 decompression for all gauge adjusted files and RAW files after 2003
-                with bz2.open(local_filename_zipped, 'r') as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
+            # build the file name, URL, and local file name
+            if name_template is not None:
+                filename_unzipped = cmorph_ctl.file_name(name_template, datetime(year, month, day + 1))
             else:
-                # use BZ2 decompression for files before 2004
-                with gzip.open(local_filename_zipped, 'r') as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-      
-            # append to our list of data files
-            files.append(local_filename_unzipped)
-            
-            # clean up the downloaded zip file
-            os.remove(local_filename_zipped)
-        
-        except urllib.error.URLError:
+                filename_unzipped = filename_base + year_month + str(day + 1).zfill(2)
+            zip_extension = '.gz'
+            if not raw or year >= 2004:   # after 2003 the RAW data uses bz2, all gauge adjusted files use bz2
+                zip_extension = '.bz2'
+            filename_zipped = filename_unzipped + zip_extension
         
-            # download failed, move to next
-            continue
+            file_url  = url_base + '/' + filename_zipped
+            local_filename_zipped = destination_dir + '/' + filename_zipped
+            local_filename_unzipped = destination_dir + '/' + filename_unzipped
 
-    return files
-
-#-----------------------------------------------------------------------------------------------------------------------
-def _compute_days(initial_year,
-                  total_months,
-                  initial_month=1,
-                  units_start_year=1800):
-    '''
-    Computes the "number of days" equivalent for regular, incremental monthly time steps given an initial year/month.
-    Useful when using "days since <start_date>" as time units within a NetCDF dataset.
-    
-    :param initial_year: the initial year from which the day values should start, i.e. the first value in the output
-                        array will correspond to the number of days between January of this initial year since January 
-                        of the units start year
-    :param total_months: the total number of monthly increments (time steps measured in days) to be computed
-    :param initial_month: the month within the initial year from which the day values should start, with 1: January, 2: February, etc.
-    :param units_start_year: the start year from which the monthly increments are computed, with time steps measured
-                             in days since January of this starting year 
-    :return: an array of time step increments, measured in days since midnight of January 1st of the units start year
-    :rtype: ndarray of ints 
-    '''
-
-    # compute an offset from which the day values should begin 
-    start_date = datetime(units_start_year, 1, 1)
-
-    # initialize the list of day values we'll build
-    days = np.empty(total_months, dtype=int)
-    
-    # loop over all time steps (months)
-    for i in range(total_months):
-        
-        years = int((i + initial_month - 1) / 12)   # the number of years since the initial year 
-        months = int((i + initial_month - 1) % 12)  # the number of months since January
-        
-        # cook up a datetime object for the current time step (month)
-        current_date = datetime(initial_year + years, 1 + months, 1)
-        
-        # get the number of days since the initial date
-        days[i] = (current_date - start_date).days
-    
-    return days
-
-#-----------------------------------------------------------------------------------------------------------------------
-def _init_netcdf(netcdf_file,
-                 work_dir):
-    """
-    Initializes the NetCDF that will be written by the ASCII to NetCDF ingest process.
-    
-    :param netcdf_file: output NetCDF we're initializing
-    :param work_dir: directory where files file name of the data descriptor file in CMORPH directory
-    """
-    
-    # read data description info
-    data_desc = _read_description(work_dir)
-    
-    # get the years covered
-    years = _get_years()
-        
-    # create a corresponding NetCDF
-    with netCDF4.Dataset(netcdf_file, 'w') as output_dataset:
-        
-        # create the time, x, and y dimensions
-        output_dataset.createDimension('time', None)
-        output_dataset.createDimension('lon', data_desc['xdef_count'])
-        output_dataset.createDimension('lat', data_desc['ydef_count'])
-    
-        #TODO provide additional attributes for CF compliance, data discoverability, etc.
-        output_dataset.title = data_desc['title']
-        
-        # create the coordinate variables
-        time_variable = output_dataset.createVariable('time', 'i4', ('time',))
-        x_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
-        y_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
-        
-        # set the coordinate variables' attributes
-        data_desc['units_since_year'] = 1800
-        time_variable.units = 'days since %s-01-01 00:00:00' % data_desc['units_since_year']
-        x_variable.units = 'degrees_east'
-        y_variable.units = 'degrees_north'
-        
-        # generate longitude and latitude values, assign these to the NetCDF coordinate variables
-        lon_values = list(_frange(data_desc['xdef_start'], data_desc['xdef_start'] + (data_desc['xdef_count'] * data_desc['xdef_increment']), data_desc['xdef_increment']))
-        lat_values = list(_frange(data_desc['ydef_start'], data_desc['ydef_start'] + (data_desc['ydef_count'] * data_desc['ydef_increment']), data_desc['ydef_increment']))
-        x_variable[:] = np.array(lon_values, 'f4')
-        y_variable[:] = np.array(lat_values, 'f4')
-    
-        # read the variable data from the CMORPH file, mask and reshape accordingly, and then assign into the variable
-        data_variable = output_dataset.createVariable('prcp', 
-                                                      'f8', 
-                                                      ('time', 'lat', 'lon',), 
-                                                      fill_value=np.NaN)
-
-        # variable attributes
-        data_variable.units = 'mm'
-        data_variable.standard_name = 'precipitation'
-        data_variable.long_name = 'precipitation, monthly cumulative'
-        data_variable.description = data_desc['title']
-
-    return data_desc
+            # the files are cached by product and file name (which carries the date)
+            if raw:
+                cache_key = 'raw/' + filename_zipped
+            else:
+                cache_key = 'adjusted/' + filename_zipped
+
+            downloads.append((file_url, local_filename_zipped, local_filename_unzipped, cache_key))
+            available.append(listing is None or filename_zipped in listing)
+
+    # download the zipped files, concurrently if called for, failed (or missing) downloads come back as None
+    requested = [download for download, found in zip(downloads, available) if found]
+    if len(requested) < len(downloads):
+        _logger.warning('Missing %d daily files on the server, these days are skipped', len(downloads) - len(requested))
+
+    # the files are decompressed according to their leading bytes, by the decompression stage's workers if several
+    if decompressor is None:
+        decompressor = cmorph_decompress.Decompressor()
+
+    # stream the files straight into memory, no temporary files, decompressing along the way unless they're
+    # decompressed by several workers once downloaded
+    if in_memory:
+        if decompressor.workers > 1:
+            contents = downloader.fetch_bytes([(file_url, None, cache_key) for file_url, _, _, cache_key in requested], 
+                                              skip_failed=True)
+            contents = decompressor.decompress_contents(contents)
+        else:
+            contents = downloader.fetch_bytes([(file_url, 'auto', cache_key) for file_url, _, _, cache_key in requested], 
+                                              skip_failed=True)
+        return _with_missing(contents, available)
+
+    downloaded_files = downloader.fetch([(file_url, local_filename_zipped, cache_key) 
+                                         for file_url, local_filename_zipped, _, cache_key in requested],
+                                        skip_failed=True)
+
+    # decompress the zipped files, removing each once decompressed, failed downloads are skipped
+    downloaded_files = decompressor.decompress_files([None if downloaded_file is None else (local_filename_zipped, 
+                                                                                            local_filename_unzipped)
+                                                      for (_, local_filename_zipped, local_filename_unzipped, _), 
+                                                          downloaded_file in zip(requested, downloaded_files)])
+
+    return _with_missing(downloaded_files, available)
 
 #-----------------------------------------------------------------------------------------------------------------------
 def ingest_cmorph_to_netcdf_full(work_dir,
                                  netcdf_file,
-                                 raw=True):
+                                 raw=True,
+                                 download_workers=1,
+                                 in_memory=False,
+                                 cache_dir=None,
+                                 cache_max_bytes=cmorph_cache.DEFAULT_MAX_BYTES,
+                                 chunking=None,
+                                 complevel=0,
+                                 shuffle=False,
+                                 cadences=None,
+                                 min_valid_fraction=0.0,
+                                 encoding=None,
+                                 years=None,
+                                 metrics_file=None,
+                                 download_retries=cmorph_download.DEFAULT_RETRIES,
+                                 decompress_workers=1):
     """
-    Ingests CMORPH daily precipitation files into a full period of record file containing monthly cumulative precipitation.
+    Ingests CMORPH daily precipitation files into a full period of record file containing monthly cumulative precipitation,
+    or into a file per cadence (pentads, dekads, months, seasons or years) with all cadences aggregated from a single 
+    pass over the daily files.
     
     :param work_dir: work directory where downloaded CMORPH files will temporarily reside while being used for ingest
-    :param netcdf_file: output NetCDF
+    :param netcdf_file: output NetCDF of monthly totals, None if cadences are given
     :param raw: if True then ingest from raw files, otherwise ingest from adjusted/corrected files 
+    :param download_workers: number of daily files to download concurrently
+    :param in_memory: if True then downloaded files are decompressed and decoded in memory, without temporary files
+    :param cache_dir: directory of a persistent download cache consulted before going to the network, None for no cache
+    :param cache_max_bytes: size budget of the download cache, least recently used files are evicted beyond this
+    :param chunking: chunk layout of the precipitation variable, "map" (one chunk per month), "series" (long runs of 
+                     months over small tiles, for time series reads), an explicit (time, lat, lon) tuple, or None to 
+                     leave it up to the NetCDF library
+    :param complevel: zlib compression level of the precipitation variable, 0 for no compression
+    :param shuffle: whether to apply the shuffle filter to the precipitation variable before compression
+    :param cadences: list of (cadence, NetCDF file) tuples, with cadences from cmorph_aggregate.CADENCES, for writing 
+                     several cadences from a single pass over the daily files
+    :param min_valid_fraction: fraction of a period's days which must have valid values for a grid cell's total, 
+                               otherwise the total is missing, 0 to require a single valid day
+    :param encoding: storage encoding of the precipitation variable, ("int16", scale factor) to pack values into 
+                     16-bit integers, ("digits", N) or ("bitround", N) to quantize 32-bit floats before compression, 
+                     or None for full precision 32-bit floats, see cmorph_netcdf.parse_encoding()
+    :param years: consecutive years to ingest, the descriptor's start year through 2017 if None
+    :param metrics_file: file to which the timings and byte counts of the ingest's stages are written at the end of 
+                         the run, in the Prometheus text format if its extension is ".prom", otherwise as JSON, 
+                         None to only log them (each month's as it's read, and the totals)
+    :param download_retries: number of times a failed download is retried, with exponential backoff, before its day 
+                             is skipped, the files which failed for good are reported at the end of the run
+    :param decompress_workers: number of processes decompressing the downloaded files, 1 to decompress them in the 
+                               ingest's own process
     """
     
-    # create/initialize the NetCDF dataset, get back a data descriptor dictionary
-    data_desc = _init_netcdf(netcdf_file, work_dir)
-
-    with netCDF4.Dataset(netcdf_file, 'a') as output_dataset:
+    # the timings of the ingest's stages, logged for each month and for the whole run
+    metrics = cmorph_metrics.IngestMetrics('ingest_cmorph', netcdf_file)
+
+    # read data description info into a dictionary
+    data_desc = _read_description()
+
+    # the outputs to write, a single monthly NetCDF unless cadences are given
+    if cadences is None:
+        cadences = [('month', netcdf_file)]
+    elif netcdf_file is not None:
+        raise ValueError('Cadences are specified with their own output files')
+
+    # the downloader used for all daily files, with the persistent cache if called for
+    cache = None
+    if cache_dir is not None:
+        cache = cmorph_cache.DownloadCache(cache_dir, cache_max_bytes)
+    downloader = cmorph_download.Downloader(workers=download_workers, cache=cache, retries=download_retries)
+    decompressor = cmorph_decompress.Decompressor(workers=decompress_workers)
+
+    # the full grid's coordinates, and the period of record from the start date through the final year on the server
+    lat_values = data_desc['ydef_start'] + np.arange(data_desc['ydef_count']) * data_desc['ydef_increment']
+    lon_values = data_desc['xdef_start'] + np.arange(data_desc['xdef_count']) * data_desc['xdef_increment']
+    if years is None:
+        years = [year for year in _get_years(downloader) if year >= data_desc['start_date'].year]
+    first_date = max(data_desc['start_date'], datetime(years[0], 1, 1))
+
+    # each day is added into the running totals of every cadence, and each 
+    # period is written to its cadence's NetCDF as soon as it's complete
+    with cmorph_aggregate.CadenceWriter(cadences,
+                                        first_date,
+                                        datetime(years[-1], 12, 31),
+                                        data_desc['title'],
+                                        lat_values,
+                                        lon_values,
+                                        _UNITS_SINCE_YEAR,
+                                        chunking,
+                                        complevel,
+                                        shuffle,
+                                        encoding) as writer, \
+            cmorph_aggregate.Aggregator(writer.cadences, writer, min_valid_fraction) as aggregator:
     
-        # compute the time values 
-        total_years = 2017 - int(data_desc['start_date'].year) + 1   #FIXME replace this hard-coded value with an additional end_year entry in the data_desc
-        output_dataset.variables['time'][:] = _compute_days(data_desc['start_date'].year,
-                                                            total_years * 12,  
-                                                            initial_month=data_desc['start_date'].month,
-                                                            units_start_year=data_desc['units_since_year'])
-        
-        # get a handle to the precipitation variable, for convenience
-        data_variable = output_dataset.variables['prcp']
-        
-        # loop over each year/month, reading binary data from CMORPH files and adding into the NetCDF variable
-        for year in range(data_desc['start_date'].year, 2018):  # from start year through 2017, replace the value 2018 here with some other method of determining this value from the dataset itself
+        # loop over each year/month, reading binary data from CMORPH files and adding into the totals
+        for year in years:
             for month in range(1, 13):
 
-                # get the files for the month
-                downloaded_files = _download_daily_files(work_dir, year, month, raw)
-                       
-                if len(downloaded_files) > 0:
-
-                    # read all the data for the month as a sum from the daily values, assign into the appropriate slice of the variable
-                    data = _read_daily_cmorph_to_monthly_sum(downloaded_files, data_desc, year, month)
+                period = cmorph_metrics.month_period(year, month)
+                with metrics.period(period):
+
+                    # get the files for the month, with None for the days which failed to download
+                    downloaded_files = _download_daily_files(work_dir, 
+                                                             year, 
+                                                             month, 
+                                                             raw, 
+                                                             downloader, 
+                                                             in_memory,
+                                                             data_desc['dset'] if raw else None,
+                                                             decompressor)
+
+                    for day, downloaded_file in enumerate(downloaded_files, 1):
+                        if downloaded_file is None:
+                            continue
+
+                        # add the day into the totals of the periods it falls into
+                        aggregator.add([datetime(year, month, day)],
+                                       _read_daily_cmorph(downloaded_file, data_desc)[np.newaxis])
+                        metrics.add_days(period, 1)
+                
+                        # clean up
+                        if not in_memory:
+                            os.remove(downloaded_file)
+
+                metrics.log_period(period)
+
+    # report on the effectiveness of the download cache
+    if cache is not None:
+        cache.log_stats()
+    downloader.log_stats()
+    downloader.close()
+    decompressor.close()
+
+    # report on the stages' timings over the whole run
+    metrics.log_totals()
+    if metrics_file is not None:
+        metrics.write(metrics_file)
                     
-                    # assume values are in lat/lon orientation
-                    data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
-    
-                    # get the time index, which is actually the month's count from the start of the period of record                
-                    time_index = ((year - data_desc['start_date'].year) * 12) + month - 1
-                    
-                    # assign into the appropriate slice for the monthly time step
-                    data_variable[time_index, :, :] = data
-            
-                    # clean up
-                    for file in downloaded_files:
-                        os.remove(file)
-                    
-#-----------------------------------------------------------------------------------------------------------------------
-def _frange(start, stop, step):
-    i = start
-    while i < stop:
-        yield i
-        i += step
-
 #-----------------------------------------------------------------------------------------------------------------------
-def _read_description(work_dir):
+def _read_description():
     """
     Reads a data descriptor file, example below:
     
@@ -342,42 +375,13 @@ def _read_description(work_dir):
         cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)  
         ENDVARS
         
-    :param descriptor_file: ASCII file with data description information
-    :return: dictionary of data description keys/values
+    The descriptor is cached locally and only downloaded again once the cached copy is stale, 
+    see cmorph_ctl.load_descriptor().
+        
+    :return: dictionary of data description keys/values, see cmorph_ctl.parse_descriptor()
     """
     
-    descriptor_file = _download_data_descriptor(work_dir)
-    
-    data_dict = {}    
-    with open(descriptor_file, 'r') as fp:
-        for line in fp:
-            words = line.split()
-            if words[0] == 'UNDEF':
-                data_dict['undef'] = float(words[1])
-            elif words[0] == 'XDEF':
-                data_dict['xdef_count'] = int(words[1])
-                data_dict['xdef_start'] = float(words[3])
-                data_dict['xdef_increment'] = float(words[4])
-            elif words[0] == 'YDEF':
-                data_dict['ydef_count'] = int(words[1])
-                data_dict['ydef_start'] = float(words[3])
-                data_dict['ydef_increment'] = float(words[4])
-            elif words[0] == 'TDEF':
-                data_dict['start_date'] = datetime.strptime(words[3], '%d%b%Y')  # example: "01jan1998"
-            elif words[0] == 'OPTIONS':
-                if words[2] == 'big_endian':
-                    data_dict['little_endian'] = False
-                else:   # assume words[2] == 'little_endian'
-                    data_dict['little_endian'] = True
-            elif words[0] == 'cmorph':  # looking for a line like this: "cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)"
-                data_dict['variable_description'] = ' '.join(words[4:])
-            elif words[0] == 'TITLE':
-                data_dict['title'] = ' '.join(words[1:])
-
-    # clean up
-    os.remove(descriptor_file)
-
-    return data_dict
+    return cmorph_ctl.load_descriptor(_URL_BASE + '03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl')
 
 #-----------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -388,7 +392,7 @@ if __name__ == '__main__':
     monthly precipitation for the full period of record (all months), with all files downloaded from FTP and removed 
     once processing completes, for gauge adjusted data:
     
-    $ python -u ingest_cmorph.py --cmorph_dir C:/home/data/cmorph/raw \
+    $ python -u ingest_cmorph.py --work_dir C:/home/data/cmorph/raw \
                                  --out_file C:/home/data/cmorph_file.nc \
                                  --adjusted
                                  
@@ -406,8 +410,8 @@ if __name__ == '__main__':
                             help="Directory where CMORPH daily files will be downloaded before being ingested to NetCDF", 
                             required=True)
         parser.add_argument("--out_file", 
-                            help="NetCDF output file containing variables read from the input data", 
-                            required=True)
+                            help="NetCDF output file containing monthly totals, required unless using --cadence", 
+                            required=False)
         feature_parser = parser.add_mutually_exclusive_group(required=False)
         feature_parser.add_argument('--raw', 
                                     dest='feature', 
@@ -416,19 +420,102 @@ if __name__ == '__main__':
                                     dest='feature', 
                                     action='store_false')
         feature_parser.set_defaults(feature=True)
+        parser.add_argument("--download_workers", 
+                            help="Number of daily files to download concurrently",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--download_retries", 
+                            help="Number of times a failed download is retried, with exponential backoff",
+                            type=int,
+                            default=cmorph_download.DEFAULT_RETRIES,
+                            required=False)
+        parser.add_argument("--decompress_workers", 
+                            help="Number of processes decompressing the downloaded files",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--in_memory", 
+                            help="Decompress and decode downloaded files in memory, without writing temporary files",
+                            action='store_true', 
+                            required=False)
+        parser.add_argument("--cache_dir", 
+                            help="Directory of a persistent cache of downloaded files, consulted before downloading",
+                            required=False)
+        parser.add_argument("--cache_max_bytes", 
+                            help="Maximum total size of the download cache, least recently used files are evicted",
+                            type=int,
+                            default=cmorph_cache.DEFAULT_MAX_BYTES,
+                            required=False)
+        parser.add_argument("--chunking", 
+                            help="Chunk layout of the precipitation variable: map (one chunk per month), series (optimized "
+                                 "for reading time series), or an explicit chunk shape as time,lat,lon",
+                            type=cmorph_netcdf.parse_chunking,
+                            required=False)
+        parser.add_argument("--complevel", 
+                            help="Compression level (1 through 9) of the precipitation variable, 0 for no compression",
+                            type=int,
+                            choices=range(0, 10),
+                            default=0,
+                            required=False)
+        parser.add_argument("--shuffle", 
+                            help="Apply the shuffle filter to the precipitation variable before compression",
+                            action='store_true', 
+                            required=False)
+        parser.add_argument("--encoding", 
+                            help="Storage encoding of the precipitation variable: float32 (full precision), int16:scale "
+                                 "(packed 16-bit integers with a precision of scale mm, e.g. int16:0.1 for monthly "
+                                 "totals up to 6553.4 mm), digits:N (quantized to N decimal digits) or bitround:N "
+                                 "(quantized to N bits)",
+                            type=cmorph_netcdf.parse_encoding,
+                            required=False)
+        parser.add_argument("--cadence", 
+                            help="Cadence to write to its own NetCDF output file, as cadence:path with the cadence one of "
+                                 "{0}, may be repeated to aggregate several cadences from a single pass over the daily "
+                                 "files (instead of --out_file)".format(', '.join(cmorph_aggregate.CADENCES)),
+                            type=cmorph_aggregate.parse_cadence,
+                            action='append',
+                            dest='cadences',
+                            required=False)
+        parser.add_argument("--min_valid_fraction", 
+                            help="Fraction of a period's days which must have valid values for a total, otherwise "
+                                 "the total is missing",
+                            type=float,
+                            default=0.0,
+                            required=False)
+        parser.add_argument("--metrics_file", 
+                            help="File to which the timings and byte counts of the ingest's stages are written at the "
+                                 "end of the run, in the Prometheus text format (for the node exporter's textfile "
+                                 "collector) if its extension is .prom, otherwise as JSON",
+                            required=False)
         args = parser.parse_args()
+        if (args.cadences is None) == (args.out_file is None):
+            parser.error('either --out_file or --cadence is required')
 
         print('\nIngesting CMORPH precipitation dataset')
         print('Result NetCDF:   %s' % args.out_file)
-        print('Work directory:  %s' % args.cmorph_dir)
-        print('\n\tDownloading files:   %s' % args.download_files)
-        print('\tRemoving files:      %s' % args.remove_files)
-        print('\tObservation type:    %s\n' % args.obs_type)
+        for cadence, path in (args.cadences or []):
+            print('Cadence %s:  %s' % (cadence, path))
+        print('Work directory:  %s' % args.work_dir)
+        print('\n\tObservation type:    %s\n' % ('raw' if args.feature else 'adjusted'))
         
         # perform the ingest to NetCDF
         ingest_cmorph_to_netcdf_full(args.work_dir,
                                      args.out_file,
-                                     raw=args.feature)
+                                     raw=args.feature,
+                                     download_workers=args.download_workers,
+                                     in_memory=args.in_memory,
+                                     cache_dir=args.cache_dir,
+                                     cache_max_bytes=args.cache_max_bytes,
+                                     chunking=args.chunking,
+                                     complevel=args.complevel,
+                                     shuffle=args.shuffle,
+                                     cadences=args.cadences,
+                                     min_valid_fraction=args.min_valid_fraction,
+                                     encoding=args.encoding,
+                                     metrics_file=args.metrics_file,
+                                     download_retries=args.download_retries,
+                                     decompress_workers=args.decompress_workers)
 
         # report on the elapsed time
         end_datetime = datetime.now()
@@ -1,18 +1,28 @@
 import argparse
-import bisect
-import bz2
 import calendar
-from datetime import datetime
-from glob import glob
-import gzip
+import contextlib
+from datetime import datetime, timedelta
 import logging
 import netCDF4
 import numpy as np
 import os
-import shutil
-import urllib.request
+import re
+import urllib.error
 import warnings
 
+import cmorph_cache
+import cmorph_catalog
+import cmorph_ctl
+import cmorph_decompress
+import cmorph_download
+import cmorph_io
+import cmorph_metrics
+import cmorph_netcdf
+import cmorph_pipeline
+import cmorph_regions
+import cmorph_shards
+import cmorph_zarr
+
 #-----------------------------------------------------------------------------------------------------------------------
 # set up a basic, global _logger which will write to the console as standard error
 logging.basicConfig(level=logging.INFO,
@@ -30,62 +40,116 @@ __MONTH_DAYS_NONLEAP = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 __MONTH_DAYS_LEAP = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 #-----------------------------------------------------------------------------------------------------------------------
-def _find_closest(sorted_values, 
-                  value,
-                  before=False):
+# base URL of the CMORPH archive, the daily files live below this in per-year/per-month directories
+_URL_BASE = 'ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/'
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _get_years(downloader=None):
     """
-    Convenience function for finding the list index of the first (leftmost) value greater than x in list sorted_values.
-    
-    :param sorted_values: 
-    :param value:
-    :param before: if True then return the first (leftmost) value less than x in the sorted_values list, otherwise
-                   return the last (rightmost) value greater than x in the sorted_values list
-    :return: index of the first (leftmost) value greater than x in the sorted_values list
-    :rtype: int
+    :param downloader: cmorph_download.Downloader through which the server's directory of raw data years is listed, 
+                       or None for the years known to be available, 1998 through 2017
+    :return: the years for which raw data is available, in ascending order
     """
     
-    if before:
-        index = bisect.bisect_left(sorted_values, value)
+    known_years = list(range(1998, 2018))
+    if downloader is None:
+        return known_years
+
+    # the raw data has a directory per year, named for the 4-digit year
+    url = _URL_BASE + '02_RAW/'
+    if not downloader.can_list(url):
+        return known_years
+    try:
+        listing = downloader.list_directory(url)
+    except (urllib.error.URLError, OSError, EOFError) as ex:
+        _logger.warning('Failed to list the years at %s, assuming 1998 through 2017: %s', url, ex)
+        return known_years
+
+    return sorted(int(name) for name, (kind, _) in listing.items() 
+                  if kind == 'dir' and name.isdigit() and len(name) == 4 and int(name) > 1900)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _month_url(year,
+               month,
+               obs_type='raw'):
+    """
+    :param year:
+    :param month: 1 == January, ..., 12 == December
+    :param obs_type: "raw" or "adjusted"
+    :return: URL of the server's directory of the month's daily files
+    """
+
+    year_month = str(year) + str(month).zfill(2)
+    if obs_type == 'raw':
+        return _URL_BASE + '02_RAW/' + str(year) + '/' + year_month
     else:
-        index = bisect.bisect_right(sorted_values, value)
-        
-    if index != len(sorted_values):
-        return index
-    raise ValueError
+        return _URL_BASE + '01_GAUGE_ADJUSTED/' + str(year) + '/' + year_month
 
 #-----------------------------------------------------------------------------------------------------------------------
-def _get_years():
-    
-    return list(range(1998, 2018))  # we know this, but not portable/reusable
-
-#FIXME use the below once we work out the proxy issue on Windows
-#
-#     # read the listing of directories from the list of raw data years, these should all be 4-digit years
-#     f = ftplib.FTP()
-#     f.connect('ftp://filsrv.cicsnc.org')
-#     f.login('anonymous')
-#     f.cwd('olivier/data_CMORPH_NIDIS/02_RAW')
-#     ls = f.mlsd()
-#     f.close()
-# 
-#     years = []
-#     for items in ls:
-#         if item['type'] == 'dir':
-#             year = item['name']
-#             if year.isdigit() and len(year) == 4 and int(year) > 1900:
-#                 years.append(year)
-#             
-#     return years
+def _file_prefix(obs_type='raw',
+                 name_template=None):
+    """
+    :param obs_type: "raw" or "adjusted"
+    :param name_template: DSET template of the data descriptor from which the files' names are generated, or None
+    :return: the part of the daily files' names preceding their date stamps
+    """
+
+    if name_template is not None:
+        return cmorph_ctl.file_prefix(name_template)
+    elif obs_type == 'raw':
+        return 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_'
+    else:   # gauge adjusted
+        return 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_'
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _available_days(year,
+                    month,
+                    obs_type='raw',
+                    downloader=None,
+                    name_template=None):
+    """
+    Lists the server's directory of a month's daily files, so that only the files which exist are requested.
+
+    :param year:
+    :param month: 1 == January, ..., 12 == December
+    :param obs_type: "raw" or "adjusted"
+    :param downloader: cmorph_download.Downloader through which the directory is listed
+    :param name_template: DSET template of the data descriptor from which the files' names are generated, or None
+    :return: the days of the month (1 == first day of the month) with a daily file on the server, or None if the 
+             server can't be listed
+    """
+
+    listing = downloader.list_files(_month_url(year, month, obs_type))
+    if listing is None:
+        return None
+
+    pattern = re.compile(re.escape(_file_prefix(obs_type, name_template)) + r'\d{8}\.(gz|bz2)$')
+    names = [name for name in listing if pattern.match(name)]
+    return [date.day for date in cmorph_catalog.parse_dates(names).astype(object)]
 
 #-----------------------------------------------------------------------------------------------------------------------
 def _download_daily_files(destination_dir,
                           year, 
                           month,
-                          obs_type='raw'):
+                          obs_type='raw',
+                          downloader=None,
+                          in_memory=False,
+                          days=None,
+                          name_template=None,
+                          decompressor=None):
     """
     :param destination_dir:
     :param year:
-    :param month: 1 == January, ..., 12 == December   
+    :param month: 1 == January, ..., 12 == December, or None to download all months of the year as a single batch
+    :param obs_type: "raw" or "adjusted"
+    :param downloader: cmorph_download.Downloader to use (concurrency, caching), a serial one if None
+    :param in_memory: if True then stream and decompress the files in memory rather than writing them to disk
+    :param days: the days of the month to download (1 == first day of the month), or None for all days of the month
+    :param name_template: DSET template of the data descriptor from which the files' names are generated, 
+                          the product's usual names are used if None
+    :param decompressor: cmorph_decompress.Decompressor through which the files are decompressed, a serial one if None
+    :return: list of the downloaded and decompressed files (full paths), or of the decompressed file contents 
+             (bytearrays) if in_memory is True, in date order, with None for each file which failed to download
     """
 
     # determine which set of days per month we'll use based on if leap year or not    
@@ -94,56 +158,76 @@ def _download_daily_files(destination_dir,
     else:
         days_in_month = __MONTH_DAYS_NONLEAP
         
-    # the base URL we'll append to in order to get the individual file URLs
-    year_month = str(year) + str(month).zfill(2)
-    url_base = 'ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/'
-    if obs_type == 'raw':
-        url_base += '02_RAW/' + str(year) + '/' + year_month
+    # download either the single month or all the months of the year at once
+    if month is None:
+        months = range(1, 13)
     else:
-        url_base += '01_GAUGE_ADJUSTED/' + str(year) + '/' + year_month
-        
-    # list of files we'll return
-    files = []
-    
-    for day in range(days_in_month[month - 1]):
-        
-        # build the file name, URL, and local file name
-        year_month_day = year_month + str(day + 1).zfill(2)
-        if obs_type == 'raw':
-            filename_unzipped = 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_' + year_month_day
-        else:   # guage adjusted
-            filename_unzipped = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + year_month_day
-        zip_extension = '.bz2'
-        if obs_type == 'raw' and year < 2004:   # the raw files use GZIP through 2003
-            zip_extension = '.gz'
-        filename_zipped = filename_unzipped + zip_extension
-        
-        file_url  = url_base + '/' + filename_zipped
-        local_filename_zipped = destination_dir + '/' + filename_zipped
-        local_filename_unzipped = destination_dir + '/' + filename_unzipped
-        
-        _logger.info('Downloading %s', file_url)
+        months = [month]
+
+    # build the list of (URL, local zipped file, local unzipped file) for all days
+    downloads = []
+    for month in months:
+
+        # the base URL we'll append to in order to get the individual file URLs
+        year_month = str(year) + str(month).zfill(2)
+        url_base = _month_url(year, month, obs_type)
         
-        # download the zipped file
-        urllib.request.urlretrieve(file_url, local_filename_zipped)
-
-        # decompress the zipped file
-        if (year >= 2004) or (obs_type == 'adjusted'):
-            # use BZ2 decompression for files after 2003
-            with bz2.open(local_filename_zipped, 'r') as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        else:
-            # use GZIP decompression for raw files before 2004
-            with gzip.open(local_filename_zipped, 'r') as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-  
-        # append to our list of data files
-        files.append(local_filename_unzipped)
+        for day in range(days_in_month[month - 1]):
+
+            # skip days we've not been asked for
+            if (days is not None) and (day + 1 not in days):
+                continue
         
-        # clean up the downloaded zip file
-        os.remove(local_filename_zipped)
+            # build the file name, URL, and local file name
+            year_month_day = year_month + str(day + 1).zfill(2)
+            if name_template is not None:
+                filename_unzipped = cmorph_ctl.file_name(name_template, datetime(year, month, day + 1))
+            elif obs_type == 'raw':
+                filename_unzipped = 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_' + year_month_day
+            else:   # guage adjusted
+                filename_unzipped = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + year_month_day
+            zip_extension = '.bz2'
+            if obs_type == 'raw' and year < 2004:   # the raw files use GZIP through 2003
+                zip_extension = '.gz'
+            filename_zipped = filename_unzipped + zip_extension
         
-    return files
+            file_url  = url_base + '/' + filename_zipped
+            local_filename_zipped = destination_dir + '/' + filename_zipped
+            local_filename_unzipped = destination_dir + '/' + filename_unzipped
+
+            # the files are cached by product and file name (which carries the date)
+            cache_key = obs_type + '/' + filename_zipped
+
+            downloads.append((file_url, local_filename_zipped, local_filename_unzipped, cache_key))
+
+    # download the zipped files, concurrently if called for, results come back in date order,
+    # with failed downloads (even after retries) as None
+    if downloader is None:
+        downloader = cmorph_download.Downloader()
+
+    # the files are decompressed according to their leading bytes, by the decompression stage's workers if several
+    if decompressor is None:
+        decompressor = cmorph_decompress.Decompressor()
+
+    # stream the files straight into memory, no temporary files, decompressing along the way unless they're
+    # decompressed by several workers once downloaded
+    if in_memory:
+        if decompressor.workers > 1:
+            contents = downloader.fetch_bytes([(file_url, None, cache_key) for file_url, _, _, cache_key in downloads],
+                                              skip_failed=True)
+            return decompressor.decompress_contents(contents)
+        return downloader.fetch_bytes([(file_url, 'auto', cache_key) for file_url, _, _, cache_key in downloads],
+                                      skip_failed=True)
+
+    downloaded_files = downloader.fetch([(file_url, local_filename_zipped, cache_key) 
+                                         for file_url, local_filename_zipped, _, cache_key in downloads],
+                                        skip_failed=True)
+
+    # decompress the zipped files, removing each once decompressed, failed downloads are skipped
+    return decompressor.decompress_files([None if downloaded_file is None else (local_filename_zipped, 
+                                                                                local_filename_unzipped)
+                                          for (_, local_filename_zipped, local_filename_unzipped, _), downloaded_file 
+                                          in zip(downloads, downloaded_files)])
 
 #-----------------------------------------------------------------------------------------------------------------------
 def _compute_days_full_years(year_initial,
@@ -171,21 +255,176 @@ def _compute_days_full_years(year_initial,
     elif year_final < year_initial:
         raise ValueError('Invalid year arguments, final data year is before the initial data year')
 
-    # datetime objects from the years
-    date_initial = datetime(year_initial, 1, 1)
-    date_final = datetime(year_final, 12, 31)
-    date_since = datetime(year_since, 1, 1)
-        
-    # starting day value, i.e. first number of days since the time units' "since year"
-    days_initial = (date_initial - date_since).days
+    # day values from January 1st of the initial year through December 31st of the final year
+    return cmorph_catalog.days_since(datetime(year_initial, 1, 1), datetime(year_final, 12, 31), year_since)
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _create_netcdf(netcdf_file,
+                   data_desc,
+                   lat_values,
+                   lon_values,
+                   time_values,
+                   units_since_year,
+                   chunking=None,
+                   complevel=0,
+                   shuffle=False,
+                   encoding=None):
+    """
+    Creates the output NetCDF with its dimensions, coordinate variables and the (empty) precipitation variable.
+    
+    :param netcdf_file: output NetCDF
+    :param data_desc: data description dictionary from _read_description()
+    :param lat_values: latitude coordinate values
+    :param lon_values: longitude coordinate values
+    :param time_values: time coordinate values, in days since January 1st of the units since year, which are written 
+                        along with the data by the slab writer, and size the chunks here
+    :param units_since_year: year of the time units' reference date
+    :param chunking: chunk layout of the precipitation variable, "map", "series", an explicit (time, lat, lon) tuple, 
+                     or None to leave it up to the NetCDF library
+    :param complevel: zlib compression level of the precipitation variable, 0 for no compression
+    :param shuffle: whether to apply the shuffle filter to the precipitation variable before compression
+    :param encoding: storage encoding of the precipitation variable, from cmorph_netcdf.parse_encoding(), 
+                     None for full precision float32
+    :return: the open dataset, which the caller should close
+    :rtype: netCDF4.Dataset
+    """
+    
+    output_dataset = netCDF4.Dataset(netcdf_file, 'w')
         
-    # total number of days between Jan 1st of the initial year and Dec 31st of the final year 
-    total_days = (date_final - date_initial).days + 1
+    # create the time, x, and y dimensions
+    output_dataset.createDimension('time', None)
+    output_dataset.createDimension('lat', len(lat_values))
+    output_dataset.createDimension('lon', len(lon_values))
+
+    # global attributes
+    output_dataset.title = data_desc['title']
     
-    # list of day values starting at the initial number of days since the time units' "since year"
-    days_since = range(days_initial, days_initial + total_days)
-                
-    return np.array(days_since)
+    # create the coordinate variables
+    time_variable = output_dataset.createVariable('time', 'i4', ('time',))
+    lat_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
+    lon_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
+    
+    # set the coordinate variables' attributes
+    time_variable.units = 'days since {0}-01-01'.format(units_since_year)
+    lat_variable.units = 'degrees_north'
+    lon_variable.units = 'degrees_east'
+    time_variable.long_name = 'Time'
+    lat_variable.long_name = 'Latitude'
+    lon_variable.long_name = 'Longitude'
+    time_variable.calendar = 'gregorian'
+    
+    # set the coordinate variable values, the time values are written along with the data 
+    lat_variable[:] = np.array(lat_values, 'f4')
+    lon_variable[:] = np.array(lon_values, 'f4')
+
+    # create the precipitation variable, which the ingest fills in day by day
+    data_variable = cmorph_netcdf.create_prcp_variable(output_dataset,
+                                                       ('time', 'lat', 'lon',),
+                                                       chunking,
+                                                       len(time_values),
+                                                       len(lat_values),
+                                                       len(lon_values),
+                                                       complevel,
+                                                       shuffle,
+                                                       encoding)
+    data_variable.units = 'mm'
+    data_variable.standard_name = 'precipitation'
+    data_variable.long_name = 'Precipitation'
+    data_variable.description = data_desc['title']
+
+    return output_dataset
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _open_output(netcdf_file,
+                 window,
+                 data_desc,
+                 years,
+                 units_since_year,
+                 append,
+                 chunking,
+                 complevel,
+                 shuffle,
+                 slab_size,
+                 encoding=None):
+    """
+    Opens an output NetCDF for the ingest, either opening the existing NetCDF to extend it in place or creating a new 
+    one, along with the slab writer of its precipitation variable.
+    
+    :param netcdf_file: output NetCDF
+    :param window: the output's lat/lon window of the full grid, from cmorph_regions.compute_window()
+    :param data_desc: data description dictionary from _read_description()
+    :param years: years being ingested
+    :param units_since_year: year of the time units' reference date
+    :param append: if True then the existing NetCDF is extended in place with only the days following its last 
+                   day holding data, through the end of the final year
+    :param chunking: chunk layout of the precipitation variable of a new NetCDF
+    :param complevel: zlib compression level of the precipitation variable of a new NetCDF
+    :param shuffle: whether to apply the shuffle filter to the precipitation variable of a new NetCDF
+    :param slab_size: number of days collected in memory and written to the NetCDF at once
+    :param encoding: storage encoding of the precipitation variable of a new NetCDF
+    :return: dictionary with the output's "netcdf_file", "window", "dataset" (the open dataset, which the caller 
+             should close), "slab_writer", and the "first_date" to be written along with its time index 
+             "first_index", or None if there's nothing to append
+    """
+
+    days_final = (datetime(years[-1], 12, 31) - datetime(units_since_year, 1, 1)).days
+    if append:
+
+        output_dataset = netCDF4.Dataset(netcdf_file, 'a')
+
+        # we'll only ingest the days following the last day holding data, the days after it (if any) 
+        # having been left unwritten or as NaNs by an interrupted run or failed downloads
+        time_variable = output_dataset.variables['time']
+        last_index = cmorph_netcdf.last_ingested_step(output_dataset.variables['prcp'], time_variable)
+        if last_index is None:
+            _logger.warning('No ingested days found in %s, ingesting all days from %s-01-01', netcdf_file, years[0])
+            first_index = 0
+            first_date = datetime(years[0], 1, 1)
+        else:
+            first_index = last_index + 1
+            first_date = datetime(units_since_year, 1, 1) + timedelta(days=int(time_variable[last_index]) + 1)
+            if first_date > datetime(years[-1], 12, 31):
+                _logger.info('Nothing to append, %s already ends on %s', netcdf_file, 
+                             (first_date - timedelta(days=1)).date())
+                output_dataset.close()
+                return None
+
+            _logger.info('Appending days %s through %s-12-31 to %s', first_date.date(), years[-1], netcdf_file)
+
+    else:
+
+        output_dataset = _create_netcdf(netcdf_file,
+                                        data_desc,
+                                        window['lat_values'],
+                                        window['lon_values'],
+                                        _compute_days_full_years(years[0],
+                                                                 years[-1], 
+                                                                 year_since=units_since_year),
+                                        units_since_year,
+                                        chunking,
+                                        complevel,
+                                        shuffle,
+                                        encoding)
+        first_index = 0
+        first_date = datetime(years[0], 1, 1)
+
+    # the slab writer writes every day through the final one (as NaNs if missing), along with their time 
+    # values, so the time variable only covers the days written and prefilling would be wasted
+    days_initial = (first_date - datetime(units_since_year, 1, 1)).days
+    output_dataset.set_fill_off()
+    slab_writer = cmorph_netcdf.SlabWriter(output_dataset.variables['prcp'],
+                                           slab_size,
+                                           first_index,
+                                           first_index + days_final - days_initial + 1,
+                                           output_dataset.variables['time'],
+                                           np.arange(days_initial, days_final + 1))
+
+    return {'netcdf_file': netcdf_file,
+            'window': window,
+            'dataset': output_dataset,
+            'slab_writer': slab_writer,
+            'first_index': first_index,
+            'first_date': first_date}
 
 #-----------------------------------------------------------------------------------------------------------------------
 def ingest_cmorph_to_netcdf(cmorph_dir,
@@ -193,144 +432,314 @@ def ingest_cmorph_to_netcdf(cmorph_dir,
                             obs_type='raw',
                             download_files=True,
                             remove_files=True,
-                            conus_only=False):
+                            conus_only=False,
+                            bbox=None,
+                            regions=None,
+                            download_workers=1,
+                            in_memory=False,
+                            cache_dir=None,
+                            cache_max_bytes=cmorph_cache.DEFAULT_MAX_BYTES,
+                            append=False,
+                            chunking=None,
+                            complevel=0,
+                            shuffle=False,
+                            slab_size=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                            pipeline_workers=1,
+                            queue_depth=cmorph_pipeline.DEFAULT_QUEUE_DEPTH,
+                            years=None,
+                            output_format='netcdf',
+                            encoding=None,
+                            metrics_file=None,
+                            download_retries=cmorph_download.DEFAULT_RETRIES,
+                            decompress_workers=1):
     """
     Ingests CMORPH daily precipitation files into a full period of record file containing daily precipitation values.
     
     :param cmorph_dir: work directory where CMORPH files are expected to be located, downloaded files will reside here
-    :param netcdf_file: output NetCDF
+    :param netcdf_file: output NetCDF, None if regions are given
     :param data_descriptor_file_name: file name of the data descriptor file in CMORPH directory
     :param download_files: if true then download the data descriptor and data files from FTP, overwrites files in CMORPH work directory
     :param remove_files: if files were downloaded then remove them once operations have completed 
+    :param conus_only: ingest only data for CONUS, a preset for the cmorph_regions.CONUS bounding box
+    :param bbox: (west, south, east, north) bounding box of the data to ingest, with longitudes in either -180..180 
+                 or 0..360, the output longitudes follow the convention of the west bound, None for the full grid
+    :param regions: list of (name, bbox, NetCDF file) tuples, for writing several regions from a single pass over the 
+                    archive, with each day read once and each region's window written to its own NetCDF, in which case 
+                    netcdf_file, conus_only and bbox aren't used
+    :param download_workers: number of daily files to download concurrently
+    :param in_memory: if True then downloaded files are decompressed and decoded in memory, without temporary files
+    :param cache_dir: directory of a persistent download cache consulted before going to the network, None for no cache
+    :param cache_max_bytes: size budget of the download cache, least recently used files are evicted beyond this
+    :param append: if True then the existing NetCDF is extended in place with only the days following its last time 
+                   step, through the end of the final year
+    :param chunking: chunk layout of the precipitation variable, "map" (one chunk per day), "series" (long runs of 
+                     days over small tiles, for time series reads), an explicit (time, lat, lon) tuple, or None to 
+                     leave it up to the NetCDF library
+    :param complevel: zlib compression level of the precipitation variable, 0 for no compression
+    :param shuffle: whether to apply the shuffle filter to the precipitation variable before compression
+    :param slab_size: number of days collected in memory and written to the NetCDF at once
+    :param pipeline_workers: number of months downloaded and read concurrently while earlier months are being 
+                             written, 0 to download, read and write one month after another
+    :param queue_depth: maximum number of months being downloaded/read or waiting to be written, which bounds the 
+                        memory used for holding data ahead of the writes
+    :param years: years to ingest, all years of the archive if None
+    :param output_format: "netcdf", or "zarr" to write Zarr stores rather than NetCDFs (at the output file paths), 
+                          chunked by day with each day written by the pipeline's workers as soon as it's read, 
+                          the chunking, compression, encoding and slab options don't apply
+    :param encoding: storage encoding of the precipitation variable, ("int16", scale factor) to pack values into 
+                     16-bit integers, ("digits", N) or ("bitround", N) to quantize 32-bit floats before compression, 
+                     or None for full precision 32-bit floats, see cmorph_netcdf.parse_encoding()
+    :param metrics_file: file to which the timings and byte counts of the ingest's stages are written at the end of 
+                         the run, in the Prometheus text format if its extension is ".prom", otherwise as JSON, 
+                         None to only log them (each month's as it's written, and the totals)
+    :param download_retries: number of times a failed download is retried, with exponential backoff, before its day 
+                             is left as NaNs, the files which failed for good are reported at the end of the run
+    :param decompress_workers: number of processes decompressing the downloaded files, 1 to decompress them in the 
+                               ingest's own process
     """
     
+    # the timings of the ingest's stages, logged for each month and for the whole run
+    metrics = cmorph_metrics.IngestMetrics('ingest_cmorph_daily', netcdf_file)
+
     # read data description info into a dictionary
     data_desc = _read_description(cmorph_dir, download_files, remove_files)
+
+    # the downloader used for all daily files, with the persistent cache if called for
+    cache = None
+    if cache_dir is not None:
+        cache = cmorph_cache.DownloadCache(cache_dir, cache_max_bytes)
+    downloader = cmorph_download.Downloader(workers=download_workers, cache=cache, retries=download_retries)
+    decompressor = cmorph_decompress.Decompressor(workers=decompress_workers)
     
-    # get the range of years covered
-    years = _get_years()
+    # get the range of years covered, as found on the server when downloading
+    if years is None:
+        years = _get_years(downloader if download_files else None)
     units_since_year = 1900
     
-    # get the lat/lon range limits for the full grid
-    lat_start = data_desc['ydef_start']
-    lat_end = data_desc['ydef_start'] + (data_desc['ydef_count'] * data_desc['ydef_increment'])
-    lon_start = data_desc['xdef_start']
-    lon_end = data_desc['xdef_start'] + (data_desc['xdef_count'] * data_desc['xdef_increment'])
-    
-    # generate the full range of lat/lon values
-    lat_values = list(_frange(lat_start, lat_end, data_desc['ydef_increment']))
-    lon_values = list(_frange(lon_start, lon_end, data_desc['xdef_increment']))
+    # the outputs to write, each region's lat/lon window computed once from the full grid's coordinates
+    if regions is None:
+        if conus_only:
+            if bbox is not None:
+                raise ValueError('Only one of conus_only and bbox may be specified')
+            bbox = cmorph_regions.CONUS
+        regions = [(None, bbox, netcdf_file)]
+    elif conus_only or (bbox is not None) or (netcdf_file is not None):
+        raise ValueError('Regions are specified with their own bounding boxes and output files')
+    if output_format == 'zarr' and append:
+        raise ValueError('Appending to a Zarr store isn\'t supported')
+    lat_values = data_desc['ydef_start'] + np.arange(data_desc['ydef_count']) * data_desc['ydef_increment']
+    lon_values = data_desc['xdef_start'] + np.arange(data_desc['xdef_count']) * data_desc['xdef_increment']
 
-    # slice out the CONUS lat/lon values, if called for
-    if conus_only:
-        
-        # find lat/lon indices corresponding to CONUS bounds
-        lat_start = _find_closest(lat_values, 23.0)
-        lat_end = _find_closest(lat_values, 50.0) + 1
-        lon_start = _find_closest(lon_values, 232.0)
-        lon_end = _find_closest(lon_values, 295.0) + 1
-
-        # get the subset of lat/lon values specific to CONUS only            
-        lat_values = lat_values[lat_start : lat_end]
-        lon_values = lon_values[lon_start : lon_end]
-
-    # create a corresponding NetCDF
-    with netCDF4.Dataset(netcdf_file, 'w') as output_dataset:
-        
-        # create the time, x, and y dimensions
-        output_dataset.createDimension('time', None)
-        output_dataset.createDimension('lat', len(lat_values))
-        output_dataset.createDimension('lon', len(lon_values))
-    
-        # global attributes
-        output_dataset.title = data_desc['title']
-        
-        # create the coordinate variables
-        time_variable = output_dataset.createVariable('time', 'i4', ('time',))
-        lat_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
-        lon_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
-        
-        # set the coordinate variables' attributes
-        time_variable.units = 'days since {0}-01-01'.format(units_since_year)
-        lat_variable.units = 'degrees_north'
-        lon_variable.units = 'degrees_east'
-        time_variable.long_name = 'Time'
-        lat_variable.long_name = 'Latitude'
-        lon_variable.long_name = 'Longitude'
-        time_variable.calendar = 'gregorian'
-        
-        # set the coordinate variable values 
-        time_variable[:] = _compute_days_full_years(data_desc['start_date'].year,
-                                                    years[-1], 
-                                                    year_since=units_since_year)
-        lat_variable[:] = np.array(lat_values, 'f4')
-        lon_variable[:] = np.array(lon_values, 'f4')
-    
-        # read the variable data from the CMORPH file, mask and reshape accordingly, and then assign into the variable
-        data_variable = output_dataset.createVariable('prcp', 
-                                                      'f4', 
-                                                      ('time', 'lat', 'lon',), 
-                                                      fill_value=np.NaN)
-        data_variable.units = 'mm'
-        data_variable.standard_name = 'precipitation'
-        data_variable.long_name = 'Precipitation'
-        data_variable.description = data_desc['title']
-
-        # loop over each year/month, reading binary data from CMORPH files and adding into the NetCDF variable
-        days_index = 0
+    with contextlib.ExitStack() as output_stack:
+
+        # open the outputs, dropping any with nothing to append
+        outputs = []
+        for name, region_bbox, region_netcdf_file in regions:
+            window = cmorph_regions.compute_window(lat_values, lon_values, region_bbox)
+            if output_format == 'zarr':
+                output = {'netcdf_file': region_netcdf_file,
+                          'window': window,
+                          'zarr_group': cmorph_zarr.create_store(region_netcdf_file,
+                                                                 data_desc,
+                                                                 window['lat_values'],
+                                                                 window['lon_values'],
+                                                                 _compute_days_full_years(years[0],
+                                                                                          years[-1], 
+                                                                                          year_since=units_since_year),
+                                                                 units_since_year),
+                          'first_index': 0,
+                          'first_date': datetime(years[0], 1, 1)}
+            else:
+                output = _open_output(region_netcdf_file,
+                                      window,
+                                      data_desc,
+                                      years,
+                                      units_since_year,
+                                      append,
+                                      chunking,
+                                      complevel,
+                                      shuffle,
+                                      slab_size,
+                                      encoding)
+                if output is not None:
+                    output_stack.enter_context(output['dataset'])
+            if output is not None:
+                outputs.append(output)
+        if len(outputs) == 0:
+            return
+
+        # the window read from each daily file, for several regions the rows covering all of them at full width,
+        # which is decoded once with each region's window sliced out of it
+        if len(outputs) == 1:
+            read_window = outputs[0]['window']
+        else:
+            read_window = {'rows': (min(output['window']['rows'][0] for output in outputs),
+                                    max(output['window']['rows'][1] for output in outputs)),
+                           'columns': [(0, data_desc['xdef_count'])]}
+
+        # the descriptor describes the raw files, whose names are generated from its DSET template
+        name_template = data_desc['dset'] if obs_type == 'raw' else None
+
+        # the daily files already in the work directory, scanned once up front, when not downloading
+        catalog = None
+        if not download_files:
+            catalog = cmorph_catalog.FileCatalog.scan(cmorph_dir, _file_prefix(obs_type, name_template))
+            gaps = catalog.missing(datetime(years[0], 1, 1), datetime(years[-1] + 1, 1, 1))
+            if len(gaps) > 0:
+                _logger.warning('Missing %d daily files, e.g. for %s, these days are left as NaNs', len(gaps), gaps[0])
+
+        # the days of each month to ingest, skipping the days already present in every output 
+        # (when appending only the days following the earliest last existing time step are wanted)
+        start_date = np.datetime64(min(output['first_date'] for output in outputs), 'D')
+        months = []
         for year in years:
-            
-            #FIXME debug only -- remove
-            pass
-        
             for month in range(1, 13):
+                if catalog is None:
+                    month_start = np.datetime64('{0:04d}-{1:02d}'.format(year, month), 'M')
+                    dates = np.arange(month_start.astype('datetime64[D]'), (month_start + 1).astype('datetime64[D]'))
+                    files = None
+                else:
+                    dates, files = catalog.month(year, month)
+                wanted = dates >= start_date
+                if not np.any(wanted):
+                    continue
+                if files is not None:
+                    files = [file for file, want in zip(files, wanted) if want]
+                months.append((year, month, dates[wanted], files))
 
-                #FIXME debug only -- remove
-                pass
-                    
-                # get the files for the month
-                if download_files:
-                    daily_files = _download_daily_files(cmorph_dir, year, month, obs_type)
+        # gets the files for a month and reads their data, run by the pipeline's workers
+        def read_month(month_item):
+
+            year, month, daily_dates, daily_files = month_item
+
+            # download the files for the month, unless they're already in the catalog, 
+            # skipping the days without a file on the server (left as NaNs)
+            if daily_files is None:
+                available_days = _available_days(year, month, obs_type, downloader, name_template)
+                if available_days is not None:
+                    found = np.isin([date.day for date in daily_dates.astype(object)], available_days)
+                    if not np.all(found):
+                        _logger.warning('Missing %d daily files on the server for %s, e.g. for %s, these days are '
+                                        'left as NaNs', np.count_nonzero(~found), 
+                                        cmorph_metrics.month_period(year, month), daily_dates[~found][0])
+                    daily_dates = daily_dates[found]
+                days = [date.day for date in daily_dates.astype(object)]
+                daily_files = _download_daily_files(cmorph_dir, 
+                                                    year, 
+                                                    month, 
+                                                    obs_type, 
+                                                    downloader, 
+                                                    in_memory, 
+                                                    days,
+                                                    name_template,
+                                                    decompressor)
+
+                # the days whose file failed to download, even after retries, are left as NaNs
+                failed = np.array([daily_file is None for daily_file in daily_files], dtype=bool)
+                if np.any(failed):
+                    _logger.warning('Failed to download %d daily files for %s, e.g. for %s, these days are left as '
+                                    'NaNs', np.count_nonzero(failed), cmorph_metrics.month_period(year, month), 
+                                    daily_dates[failed][0])
+                    daily_dates = daily_dates[~failed]
+                    daily_files = [daily_file for daily_file in daily_files if daily_file is not None]
+
+            # read each daily file's data
+            month_data = []
+            for daily_cmorph_file, daily_date in zip(daily_files, daily_dates):
+                
+                # read only the lat/lon window of the daily binary data from file (or memory), 
+                # byte swapped if not little endian and with missing values as NaNs, 
+                # assuming values are in lat/lon orientation
+                data = cmorph_io.load_daily_window(daily_cmorph_file,
+                                                   (data_desc['ydef_count'], data_desc['xdef_count']),
+                                                   read_window['rows'],
+                                                   read_window['columns'],
+                                                   data_desc['little_endian'],
+                                                   float(data_desc['undef']))
+
+                # Zarr outputs are written right here, each day being a chunk of its own which
+                # is written independently of any other, otherwise the data goes to the writer
+                if output_format == 'zarr':
+                    for output in outputs:
+                        time_indices, wanted = _time_indices(output, [daily_date])
+                        if wanted[0]:
+                            with cmorph_metrics.timed('write') as sample:
+                                values = _region_values(output, data)
+                                output['zarr_group']['prcp'][time_indices[0]] = values
+                                sample.bytes = values.nbytes
                 else:
-                    suffix = str(year) + str(month).zfill(2) + '*'
-                    if obs_type == 'raw':
-                        filename_pattern = cmorph_dir + '/CMORPH_V1.0_RAW_0.25deg-DLY_00Z_' + suffix
-                    else:   # gauge adjusted
-                        filename_pattern = cmorph_dir + '/CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + suffix
-                        
-                    daily_files = glob(filename_pattern)    # can we assume sorted in date ascending order?
-
-                # loop over each daily file to read the data and assign it into the variable
-                for daily_cmorph_file in daily_files:
-                    
-                    # read the daily binary data from file, and byte swap if not little endian
-                    data = np.fromfile(daily_cmorph_file, 'f')
-                    if not data_desc['little_endian']:
-                        data = data.byteswap()
-            
-                    # convert missing values to NaNs
-                    data[data == float(data_desc['undef'])] = np.NaN
-                    
-                    # assume values are in lat/lon orientation
-                    data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
+                    month_data.append(data[np.newaxis])
+    
+            # clean up, if necessary
+            if remove_files and not (download_files and in_memory):
+                for file in daily_files:
+                    os.remove(file)
 
-                    # assign into the appropriate slice for the daily time step
-                    data_variable[days_index, :, :] = data[:, lat_start : lat_end, lon_start : lon_end]
-                    
-                    days_index += 1
-        
-                # clean up, if necessary
-                if remove_files:
-                    for file in daily_files:
-                        os.remove(file)
-                    
-#-----------------------------------------------------------------------------------------------------------------------
-def _frange(start, stop, step):
-    i = start
-    while i < stop:
-        yield i
-        i += step
+            return daily_dates, month_data
+
+        # the time indices of days within an output, computed from their dates so that a missing 
+        # day leaves a gap rather than shifting the following days, and which of the days the output 
+        # takes, i.e. those which aren't already present in it
+        def _time_indices(output, dates):
+
+            offsets = cmorph_catalog.day_offsets(dates, output['first_date'])
+            return output['first_index'] + offsets, offsets >= 0
+
+        # the values of an output's region, from the data read from a daily file
+        def _region_values(output, data):
+
+            if len(outputs) == 1:
+                return data
+            return cmorph_regions.slice_window(data, output['window'], read_window['rows'][0])
+
+        # the label of a month's stage timings, e.g. "2017-01"
+        def month_period(month_item):
+
+            return cmorph_metrics.month_period(*month_item[:2])
+
+        # assigns a month's data into the variable of each output, run in time order by the pipeline's single writer
+        def write_month(month_item, month_result):
+
+            daily_dates, month_data = month_result
+            for output in outputs:
+                time_indices, wanted = _time_indices(output, daily_dates)
+                for data, time_index, want in zip(month_data, time_indices, wanted):
+                    if want:
+                        output['slab_writer'].write(time_index, _region_values(output, data))
 
+            # the month's stages are all done once it's written
+            period = month_period(month_item)
+            metrics.add_days(period, len(daily_dates))
+            metrics.log_period(period)
+
+        # loop over each year/month, reading binary data from CMORPH files and adding into the NetCDF variable,
+        # with the downloading and reading of the following months overlapping the writes, and with the stages 
+        # timed for each month
+        cmorph_pipeline.run_pipeline(months,
+                                     metrics.wrap(read_month, month_period),
+                                     metrics.wrap(write_month, month_period),
+                                     pipeline_workers,
+                                     queue_depth)
+
+        # write out the final slabs, or publish the Zarr stores' metadata
+        for output in outputs:
+            if output_format == 'zarr':
+                cmorph_zarr.consolidate_store(output['netcdf_file'])
+            else:
+                output['slab_writer'].close()
+
+    # report on the effectiveness of the download cache
+    if cache is not None:
+        cache.log_stats()
+    downloader.log_stats()
+    downloader.close()
+    decompressor.close()
+
+    # report on the stages' timings over the whole run
+    metrics.log_totals()
+    if metrics_file is not None:
+        metrics.write(metrics_file)
+                    
 #-----------------------------------------------------------------------------------------------------------------------
 def _read_description(work_dir,
                       download_file,
@@ -350,45 +759,21 @@ def _read_description(work_dir,
         cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)  
         ENDVARS
         
-    :param work_dir: directory in which the ASCII file with data description information will live temporarily 
-        while this function executes, the file should be cleaned up upon successful completion
-    :return: dictionary of data description keys/values
+    When downloading, the descriptor is cached locally and only downloaded again once the cached copy is stale, 
+    see cmorph_ctl.load_descriptor(), otherwise it's read from the file cmorph_data_descriptor.txt in the work 
+    directory.
+        
+    :param work_dir: directory containing the data descriptor file, when it's not downloaded
+    :param download_file: whether the data descriptor is downloaded (through the local cache)
+    :param remove_file: whether the data descriptor file in the work directory is removed once it's been read 
+    :return: dictionary of data description keys/values, see cmorph_ctl.parse_descriptor()
     """
 
-    descriptor_file = os.sep.join((work_dir, 'cmorph_data_descriptor.txt'))
-    
-    # download the descriptor file, if necessary
     if download_file:
-        
-        file_url = "ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl"
-        urllib.request.urlretrieve(file_url, descriptor_file)
-
-    # build the data description dictionary by extracting the relevant values from the descriptor file, line by line
-    data_dict = {}    
-    with open(descriptor_file, 'r') as fp:
-        for line in fp:
-            words = line.split()
-            if words[0] == 'UNDEF':
-                data_dict['undef'] = float(words[1])
-            elif words[0] == 'XDEF':
-                data_dict['xdef_count'] = int(words[1])
-                data_dict['xdef_start'] = float(words[3])
-                data_dict['xdef_increment'] = float(words[4])
-            elif words[0] == 'YDEF':
-                data_dict['ydef_count'] = int(words[1])
-                data_dict['ydef_start'] = float(words[3])
-                data_dict['ydef_increment'] = float(words[4])
-            elif words[0] == 'TDEF':
-                data_dict['start_date'] = datetime.strptime(words[3], '%d%b%Y')  # example: "01jan1998"
-            elif words[0] == 'OPTIONS':
-                if words[2] == 'big_endian':
-                    data_dict['little_endian'] = False
-                else:   # assume words[2] == 'little_endian'
-                    data_dict['little_endian'] = True
-            elif words[0] == 'cmorph':  # looking for a line like this: "cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)"
-                data_dict['variable_description'] = ' '.join(words[4:])
-            elif words[0] == 'TITLE':
-                data_dict['title'] = ' '.join(words[1:])
+        return cmorph_ctl.load_descriptor(_URL_BASE + '03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl')
+
+    descriptor_file = os.sep.join((work_dir, 'cmorph_data_descriptor.txt'))
+    data_dict = cmorph_ctl.read_descriptor(descriptor_file)
 
     # clean up
     if remove_file:
@@ -423,8 +808,9 @@ if __name__ == '__main__':
                             help="Directory containing daily binary CMORPH data files for a single month", 
                             required=True)
         parser.add_argument("--out_file", 
-                            help="NetCDF output file containing variables read from the input data", 
-                            required=True)
+                            help="NetCDF output file containing variables read from the input data, "
+                                 "required unless using --region", 
+                            required=False)
         parser.add_argument("--download", 
                             help="Download data from FTP, saving files in the CMORPH data directory specified by --cmorph_dir",
                             action="store_true", 
@@ -438,29 +824,209 @@ if __name__ == '__main__':
                             choices=['raw', 'adjusted'], 
                             default='raw',
                             required=False)
-        parser.add_argument("--conus", 
-                            help="Use only continental US data (-65 through -128 degrees east, 23 through 60 degrees north)",
+        region_parser = parser.add_mutually_exclusive_group(required=False)
+        region_parser.add_argument("--conus", 
+                                   help="Use only continental US data (232 through 295 degrees east, 23 through 50 degrees north)",
+                                   action='store_true')
+        region_parser.add_argument("--bbox", 
+                                   help="Use only the data within a bounding box, as west,south,east,north with "
+                                        "longitudes in either -180..180 or 0..360, boxes may cross the 0/360 meridian",
+                                   type=cmorph_regions.parse_bbox)
+        parser.add_argument("--region", 
+                            help="Region to write to its own NetCDF output file, as name:bbox:path with the bounding "
+                                 "box as west,south,east,north, conus, or global, may be repeated to write several "
+                                 "regions from a single pass over the archive (instead of --out_file)",
+                            type=cmorph_regions.parse_region,
+                            action='append',
+                            dest='regions',
+                            required=False)
+        parser.add_argument("--download_workers", 
+                            help="Number of daily files to download concurrently",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--download_retries", 
+                            help="Number of times a failed download is retried, with exponential backoff",
+                            type=int,
+                            default=cmorph_download.DEFAULT_RETRIES,
+                            required=False)
+        parser.add_argument("--decompress_workers", 
+                            help="Number of processes decompressing the downloaded files",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--in_memory", 
+                            help="Decompress and decode downloaded files in memory, without writing temporary files",
                             action='store_true', 
                             required=False)
+        parser.add_argument("--cache_dir", 
+                            help="Directory of a persistent cache of downloaded files, consulted before downloading",
+                            required=False)
+        parser.add_argument("--cache_max_bytes", 
+                            help="Maximum total size of the download cache, least recently used files are evicted",
+                            type=int,
+                            default=cmorph_cache.DEFAULT_MAX_BYTES,
+                            required=False)
+        parser.add_argument("--append", 
+                            help="Extend the existing NetCDF output file in place with only the days following its last time step",
+                            action='store_true', 
+                            required=False)
+        parser.add_argument("--chunking", 
+                            help="Chunk layout of the precipitation variable: map (one chunk per day), series (optimized "
+                                 "for reading time series), or an explicit chunk shape as time,lat,lon",
+                            type=cmorph_netcdf.parse_chunking,
+                            required=False)
+        parser.add_argument("--complevel", 
+                            help="Compression level (1 through 9) of the precipitation variable, 0 for no compression",
+                            type=int,
+                            choices=range(0, 10),
+                            default=0,
+                            required=False)
+        parser.add_argument("--shuffle", 
+                            help="Apply the shuffle filter to the precipitation variable before compression",
+                            action='store_true', 
+                            required=False)
+        parser.add_argument("--encoding", 
+                            help="Storage encoding of the precipitation variable: float32 (full precision), int16 or "
+                                 "int16:scale (packed 16-bit integers with a precision of scale mm, 0.01 by default), "
+                                 "digits:N (quantized to N decimal digits) or bitround:N (quantized to N bits)",
+                            type=cmorph_netcdf.parse_encoding,
+                            required=False)
+        parser.add_argument("--slab_size", 
+                            help="Number of days collected in memory and written to the NetCDF at once, for example "
+                                 "a month (31) or the time chunk depth",
+                            type=int,
+                            default=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                            required=False)
+        parser.add_argument("--pipeline_workers", 
+                            help="Number of months downloaded and read concurrently while earlier months are being "
+                                 "written, 0 for no overlap",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--queue_depth", 
+                            help="Maximum number of months downloaded/read ahead of the NetCDF writes",
+                            type=int,
+                            default=cmorph_pipeline.DEFAULT_QUEUE_DEPTH,
+                            required=False)
+        parser.add_argument("--shard_dir", 
+                            help="Ingest each year into a NetCDF shard of its own in this directory, with the years "
+                                 "ingested in parallel processes, and publish the shards as a single dataset at the "
+                                 "output file location",
+                            required=False)
+        parser.add_argument("--shard_processes", 
+                            help="Number of processes ingesting shards, the number of cores by default",
+                            type=int,
+                            required=False)
+        parser.add_argument("--merge", 
+                            help="How the shards are published as a single dataset: an NcML aggregation, or an HDF5 "
+                                 "virtual dataset readable as NetCDF4 (requires h5py)",
+                            choices=['ncml', 'vds'], 
+                            default='ncml',
+                            required=False)
+        parser.add_argument("--metrics_file", 
+                            help="File to which the timings and byte counts of the ingest's stages are written at the "
+                                 "end of the run, in the Prometheus text format (for the node exporter's textfile "
+                                 "collector) if its extension is .prom, otherwise as JSON, with shards each writing "
+                                 "their own file with the year appended to the name",
+                            required=False)
+        parser.add_argument("--output_format", 
+                            help="Write NetCDF output files, or Zarr stores (requires zarr) chunked by day and "
+                                 "written by the pipeline workers in parallel",
+                            choices=['netcdf', 'zarr'], 
+                            default='netcdf',
+                            required=False)
         args = parser.parse_args()
+        if args.regions is None and args.out_file is None:
+            parser.error('either --out_file or --region is required')
+        if args.regions is not None and (args.out_file is not None or args.conus or args.bbox is not None):
+            parser.error('--region can\'t be used with --out_file, --conus or --bbox')
+        if args.shard_dir is not None and (args.regions is not None or args.append or args.output_format == 'zarr'):
+            parser.error('--shard_dir can\'t be used with --region, --append or --output_format zarr')
+        if args.output_format == 'zarr' and args.append:
+            parser.error('--append can\'t be used with --output_format zarr')
 
         # display run info
         print('\nIngesting CMORPH precipitation dataset')
         print('Result NetCDF:   %s' % args.out_file)
+        for name, bbox, path in (args.regions or []):
+            print('Region %s:  %s  %s' % (name, bbox, path))
         print('Work directory:  %s' % args.cmorph_dir)
         print('\n\tDownloading files:     %s' % args.download)
         print('\tRemoving files:        %s' % args.clean_up)
         print('\tObservation type:      %s' % args.obs_type)
         print('\tContinental US only:   %s' % args.conus)
+        print('\tBounding box:          %s' % (args.bbox,))
+        print('\tDownload workers:      %s' % args.download_workers)
+        print('\tDownload retries:      %s' % args.download_retries)
+        print('\tDecompress workers:    %s' % args.decompress_workers)
+        print('\tIn-memory decode:      %s' % args.in_memory)
+        print('\tDownload cache:        %s' % args.cache_dir)
+        print('\tAppending:             %s' % args.append)
+        print('\tChunking:              %s' % (args.chunking,))
+        print('\tCompression level:     %s' % args.complevel)
+        print('\tEncoding:              %s' % (args.encoding,))
+        print('\tSlab size:             %s' % args.slab_size)
+        print('\tPipeline workers:      %s' % args.pipeline_workers)
+        print('\tQueue depth:           %s' % args.queue_depth)
+        print('\tShard directory:       %s' % args.shard_dir)
+        print('\tOutput format:         %s' % args.output_format)
+        print('\tMetrics file:          %s' % args.metrics_file)
         print('\nRunning...\n')
         
-        # perform the ingest to NetCDF
-        ingest_cmorph_to_netcdf(args.cmorph_dir,
-                                args.out_file,
-                                obs_type=args.obs_type,
-                                download_files=args.download,
-                                remove_files=args.clean_up,
-                                conus_only=args.conus)
+        # the ingest options, the same for a single NetCDF or for each shard
+        ingest_kwargs = dict(obs_type=args.obs_type,
+                             remove_files=args.clean_up,
+                             conus_only=args.conus,
+                             bbox=args.bbox,
+                             download_workers=args.download_workers,
+                             in_memory=args.in_memory,
+                             cache_dir=args.cache_dir,
+                             cache_max_bytes=args.cache_max_bytes,
+                             chunking=args.chunking,
+                             complevel=args.complevel,
+                             shuffle=args.shuffle,
+                             encoding=args.encoding,
+                             slab_size=args.slab_size,
+                             pipeline_workers=args.pipeline_workers,
+                             queue_depth=args.queue_depth,
+                             metrics_file=args.metrics_file,
+                             download_retries=args.download_retries,
+                             decompress_workers=args.decompress_workers)
+
+        if args.shard_dir is None:
+        
+            # perform the ingest to NetCDF
+            ingest_cmorph_to_netcdf(args.cmorph_dir,
+                                    args.out_file,
+                                    download_files=args.download,
+                                    regions=args.regions,
+                                    append=args.append,
+                                    output_format=args.output_format,
+                                    **ingest_kwargs)
+        else:
+
+            # the years to ingest, as found on the server when downloading
+            if args.download:
+                downloader = cmorph_download.Downloader()
+                years = _get_years(downloader)
+                downloader.close()
+            else:
+                years = _get_years()
+
+            # ingest the years into shards in parallel, then publish the shards as a single dataset
+            shard_files = cmorph_shards.ingest_shards(ingest_cmorph_to_netcdf,
+                                                      args.cmorph_dir,
+                                                      args.shard_dir,
+                                                      years,
+                                                      processes=args.shard_processes,
+                                                      prefix=os.path.splitext(os.path.basename(args.out_file))[0],
+                                                      download_files=args.download,
+                                                      **ingest_kwargs)
+            if args.merge == 'ncml':
+                cmorph_shards.write_ncml(shard_files, args.out_file)
+            else:
+                cmorph_shards.write_virtual_dataset(shard_files, args.out_file)
 
         # display the info in case the above info has scrolled past due to output from the ingest process itself
         print('\nSuccessfully completed')
@@ -1,20 +1,26 @@
 import argparse
-import bisect
-import bz2
 import calendar
 from datetime import datetime, date, timedelta
-from glob import glob
-import gzip
 import logging
 import os
-import shutil
-import urllib.request
 import warnings
 
 import netCDF4
 import numpy as np
 from pandas import date_range
 
+import cmorph_aggregate
+import cmorph_cache
+import cmorph_catalog
+import cmorph_ctl
+import cmorph_decompress
+import cmorph_download
+import cmorph_io
+import cmorph_metrics
+import cmorph_netcdf
+import cmorph_pipeline
+import cmorph_regions
+
 # ------------------------------------------------------------------------------
 # set up a basic, global _logger which will write to the console as standard error
 logging.basicConfig(level=logging.INFO,
@@ -31,30 +37,13 @@ warnings.simplefilter('ignore', Warning)
 __MONTH_DAYS_NONLEAP = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 __MONTH_DAYS_LEAP = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
-
 # ------------------------------------------------------------------------------
-def _find_closest(sorted_values,
-                  value,
-                  before=False):
-    """
-    Convenience function for finding the list index of the first (leftmost) value greater than x in list sorted_values.
-
-    :param sorted_values:
-    :param value:
-    :param before: if True then return the first (leftmost) value less than x in the sorted_values list, otherwise
-                   return the last (rightmost) value greater than x in the sorted_values list
-    :return: index of the first (leftmost) value greater than x in the sorted_values list
-    :rtype: int
-    """
-
-    if before:
-        index = bisect.bisect_left(sorted_values, value)
-    else:
-        index = bisect.bisect_right(sorted_values, value)
+# base URL of the CPC precipitation archive, the CMORPH products live below this
+_URL_BASE = 'https://ftp.cpc.ncep.noaa.gov/precip/'
 
-    if index != len(sorted_values):
-        return index
-    raise ValueError
+# ------------------------------------------------------------------------------
+# number of the 3-hourly steps of a day which must be valid for a daily total, by default all 8 of them
+_DEFAULT_MIN_VALID_STEPS = 8
 
 
 # ------------------------------------------------------------------------------
@@ -100,14 +89,16 @@ def _get_spec_years(start_date,
 def _get_months(start_date: str,
                 end_date: str):
     """
+    Gets the months spanning a range of dates, including the month of a start
+    date falling after the 1st.
 
     :param str start_date: expected in "YYYY-mm-dd" format
     :param str end_date: expected in "YYYY-mm-dd" format
-    :return:
+    :return: the first day of each month
     """
 
-    # convert strings to datetimes
-    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
+    # convert strings to datetimes, from the first day of the start date's month
+    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').replace(day=1)
     end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
 
     return date_range(start_date_obj, end_date_obj, freq='MS').tolist()
@@ -117,12 +108,34 @@ def _get_months(start_date: str,
 def _download_daily_files(destination_dir: str,
                           year: int,
                           month: int,
-                          obs_type='raw'):
+                          obs_type='raw',
+                          downloader=None,
+                          in_memory=False,
+                          days=None,
+                          three_hourly=False,
+                          name_template=None,
+                          decompressor=None):
     """
     :param str destination_dir: directory where we should download files
     :param int year: year for which we'll download all daily files
-    :param int month: 1 == January, ..., 12 == December
-    :param obs_type: "raw" or "adjusted"
+    :param int month: 1 == January, ..., 12 == December, or None to download
+        all months of the year as a single batch
+    :param obs_type: "raw", "adjusted" or "icdr"
+    :param downloader: cmorph_download.Downloader to use (concurrency,
+        caching), a serial one if None
+    :param bool in_memory: if True then stream and decompress the files in
+        memory rather than writing them to disk
+    :param days: the days of the month to download (1 == first day of the
+        month), or None for all days of the month
+    :param bool three_hourly: if True then download the CRT 3-hourly files,
+        one per day holding the day's 8 3-hourly grids, rather than the daily files
+    :param str name_template: DSET template of the data descriptor from which
+        the files' names are generated, the product's usual names are used if None
+    :param decompressor: cmorph_decompress.Decompressor through which the
+        files are decompressed, a serial one if None
+    :return: list of the downloaded (and decompressed) files, or of the
+        decompressed file contents (bytearrays) if in_memory is True, in date
+        order, with None for each file which failed to download
     """
 
     # determine which set of days per month we'll use based on if leap year or not
@@ -131,90 +144,102 @@ def _download_daily_files(destination_dir: str,
     else:
         days_in_month = __MONTH_DAYS_NONLEAP
 
-    # the base URL we'll append to in order to get the individual file URLs
-    year_month = str(year) + str(month).zfill(2)
-    url_base = 'https://ftp.cpc.ncep.noaa.gov/precip/'  # Changed for updates
-    if obs_type == 'raw':
-        url_base += 'CMORPH_V0.x/RAW/0.25deg-DLY_00Z/' + str(year) + '/' + \
-                    year_month  # changed for CPC FTP
-    elif obs_type == 'adjusted':
-        url_base += 'CMORPH_V1.0/CRT/0.25deg-DLY_00Z/' + str(year) + '/' + \
-                    year_month  # Changed for Corrected (CRT)
+    # download either the single month or all the months of the year at once
+    if month is None:
+        months = range(1, 13)
     else:
-        url_base += 'CMORPH_RT/ICDR/0.25deg-DLY_00Z'  # changed for ICDR
-        # START HERE  ##########################################################
-    # list of files we'll return
-    files = []
-
-    # list of dates for ICDR data
-    # year_month_day_icdr = ['20181101', '20181102','20181103', '20181104',
-    #                        '20181105', '20181106','20181107', '20181108',
-    #                        '20181109', '20181110','20181111', '20181112',
-    #                        '20181113', '20181114','20181115', '20181116',
-    #                        '20181117', '20181118','20181119', '20181120',
-    #                        '20181121', '20181122','20181123', '20181124',
-    #                        '20181125', '20181126','20181127', '20181128',
-    #                        '20181129', '20181130','20181201', '20181202',
-    #                        '20181203', '20181204','20181205', '20181206',
-    #                        '20181207', '20181208','20181209', '20181210',
-    #                        '20181211', '20181212','20181213', '20181214',
-    #                        '20181215', '20181216','20181217', '20181218',
-    #                        '20181219', '20181220','20181221', '20181222',
-    #                        '20181223', '20181224','20181225', '20181226',
-    #                        '20181227', '20181228','20181229', '20181230',
-    #                        '20181231' ]
-
-    for day in range(days_in_month[month - 1]):
-        # build the file name, URL, and local file name
-        year_month_day = year_month + str(day + 1).zfill(2)
+        months = [month]
+
+    # build the list of (URL, local zipped file, local unzipped file) for all days
+    downloads = []
+    for month in months:
+
+        # the base URL we'll append to in order to get the individual file URLs
+        year_month = str(year) + str(month).zfill(2)
+        url_base = _URL_BASE  # Changed for updates
         if obs_type == 'raw':
-            filename_unzipped = 'CMORPH_V0.x_RAW_0.25deg-DLY_00Z_' + year_month_day
-        elif obs_type == 'adjusted':  # CRT
-            filename_unzipped = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + year_month_day  # Changed for CRT
-        else:
-            filename_unzipped = 'CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_' + year_month_day  # Changed for ICDR
-        if obs_type == 'raw':  # V0.x also uses .gz and year < 2020:
-            # the raw files use GZIP through 2003
-            zip_extension = '.gz'  # for RAW
+            url_base += 'CMORPH_V0.x/RAW/0.25deg-DLY_00Z/' + str(year) + '/' + \
+                        year_month  # changed for CPC FTP
+        elif obs_type == 'adjusted' and three_hourly:
+            url_base += 'CMORPH_V1.0/CRT/0.25deg-3HLY/' + str(year) + '/' + year_month
         elif obs_type == 'adjusted':
-            zip_extension = '.bz2'  # for CRT
+            url_base += 'CMORPH_V1.0/CRT/0.25deg-DLY_00Z/' + str(year) + '/' + \
+                        year_month  # Changed for Corrected (CRT)
         else:
-            zip_extension = '.nc'  # for ICDR
-        filename_zipped = filename_unzipped + zip_extension
-        # filename = filename + zip_extension
-
-        file_url = url_base + '/' + filename_zipped
-        local_filename_zipped = destination_dir + '/' + filename_zipped
-        local_filename_unzipped = destination_dir + '/' + filename_unzipped
-        # local_filename = destination_dir + '/' + filename
-
-        _logger.info('Downloading %s', file_url)
-
-        # download the zipped file
-        urllib.request.urlretrieve(file_url, local_filename_zipped)
-
-        # decompress the zipped file
-        #    if (year >= 2004) or (obs_type == 'adjusted'):
-        if obs_type == 'adjusted':  # use for V0.x RAW, which uses gzip compression
-            # use BZ2 decompression for files after 2003
-            with bz2.open(local_filename_zipped, 'r') \
-                    as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        elif obs_type == 'raw':
-            # use GZIP decompression for raw files before 2004
-            with gzip.open(local_filename_zipped, 'r') \
-                    as f_in, open(local_filename_unzipped, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        else:
-            local_filename_unzipped = local_filename_zipped
-
-        # append to our list of data files
-        files.append(local_filename_unzipped)
-
-        # clean up the downloaded zip file
-        # os.remove(local_filename_zipped)
-
-    return files
+            url_base += 'CMORPH_RT/ICDR/0.25deg-DLY_00Z'  # changed for ICDR
+
+        for day in range(days_in_month[month - 1]):
+
+            # skip days we've not been asked for
+            if (days is not None) and (day + 1 not in days):
+                continue
+
+            # build the file name, URL, and local file name
+            year_month_day = year_month + str(day + 1).zfill(2)
+            if name_template is not None:
+                filename_unzipped = cmorph_ctl.file_name(name_template, datetime(year, month, day + 1))
+            elif obs_type == 'raw':
+                filename_unzipped = 'CMORPH_V0.x_RAW_0.25deg-DLY_00Z_' + year_month_day
+            elif obs_type == 'adjusted' and three_hourly:  # CRT, 3-hourly
+                filename_unzipped = 'CMORPH_V1.0_ADJ_0.25deg-3HLY_' + year_month_day
+            elif obs_type == 'adjusted':  # CRT
+                filename_unzipped = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + year_month_day  # Changed for CRT
+            else:
+                filename_unzipped = 'CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_' + year_month_day  # Changed for ICDR
+            if obs_type == 'raw':  # V0.x also uses .gz and year < 2020:
+                # the raw files use GZIP through 2003
+                zip_extension = '.gz'  # for RAW
+            elif obs_type == 'adjusted':
+                zip_extension = '.bz2'  # for CRT
+            else:
+                zip_extension = '.nc'  # for ICDR
+            filename_zipped = filename_unzipped + zip_extension
+
+            file_url = url_base + '/' + filename_zipped
+            local_filename_zipped = destination_dir + '/' + filename_zipped
+            local_filename_unzipped = destination_dir + '/' + filename_unzipped
+
+            # the files are cached by product and file name (which carries the date)
+            cache_key = obs_type + '/' + filename_zipped
+
+            downloads.append((file_url, local_filename_zipped,
+                              local_filename_unzipped, cache_key))
+
+    # download the zipped files, concurrently if called for, the results come
+    # back in date order regardless of completion order, with failed downloads
+    # (even after retries) as None
+    if downloader is None:
+        downloader = cmorph_download.Downloader()
+
+    # the files are decompressed according to their leading bytes (the ICDR
+    # files are NetCDFs, which are left as they are), by the decompression
+    # stage's workers if several
+    if decompressor is None:
+        decompressor = cmorph_decompress.Decompressor()
+
+    # stream the files straight into memory, without writing any temporary
+    # files, decompressing along the way unless they're decompressed by
+    # several workers once downloaded
+    if in_memory:
+        if decompressor.workers > 1:
+            contents = downloader.fetch_bytes([(file_url, None, cache_key)
+                                               for file_url, _, _, cache_key in downloads],
+                                              skip_failed=True)
+            return decompressor.decompress_contents(contents)
+        return downloader.fetch_bytes([(file_url, 'auto', cache_key)
+                                       for file_url, _, _, cache_key in downloads],
+                                      skip_failed=True)
+
+    downloaded_files = downloader.fetch([(file_url, local_filename_zipped, cache_key)
+                                         for file_url, local_filename_zipped, _, cache_key in downloads],
+                                        skip_failed=True)
+
+    # decompress the zipped files, removing each once decompressed, failed
+    # downloads are skipped
+    return decompressor.decompress_files([None if downloaded_file is None
+                                          else (local_filename_zipped, local_filename_unzipped)
+                                          for (_, local_filename_zipped, local_filename_unzipped, _), downloaded_file
+                                          in zip(downloads, downloaded_files)])
 
 
 # ------------------------------------------------------------------------------
@@ -250,25 +275,161 @@ def _compute_days_full_years(year_initial: int,
     elif year_final < year_initial:
         raise ValueError('Invalid year arguments, final data year is before the initial data year')
 
-    # datetime objects from the years
-    date_initial = datetime(year_initial, month_initial, day_initial)  # assumes start at beginning of year (issue with partial records like Real-time ICDR)
-    date_final = datetime(year_final, month_final,
-                          day_final)  # assumes end of year, issue with partial records like real-time ICDR
-    date_since = datetime(year_since, 1, 1)
+    # day values from the initial date through the final date, by default
+    # January 1st of the initial year through December 31st of the final year
+    return cmorph_catalog.days_since(datetime(year_initial, month_initial, day_initial),
+                                     datetime(year_final, month_final, day_final),
+                                     year_since)
+
+
+# ------------------------------------------------------------------------------
+def _create_netcdf(netcdf_file: str,
+                   data_desc: dict,
+                   lat_values,
+                   lon_values,
+                   time_values,
+                   units_since_year: int,
+                   chunking=None,
+                   complevel=0,
+                   shuffle=False,
+                   encoding=None):
+    """
+    Creates the output NetCDF with its dimensions, coordinate variables and the
+    (empty) precipitation variable.
+
+    :param str netcdf_file: output NetCDF file path
+    :param dict data_desc: data description dictionary from _read_description()
+    :param lat_values: latitude coordinate values
+    :param lon_values: longitude coordinate values
+    :param time_values: time coordinate values, in days since January 1st of
+        the units since year, which are written along with the data by the
+        slab writer, and size the chunks here
+    :param int units_since_year: year of the time units' reference date
+    :param chunking: chunk layout of the precipitation variable, "map",
+        "series", an explicit (time, lat, lon) tuple, or None to leave it up to
+        the NetCDF library
+    :param int complevel: zlib compression level of the precipitation
+        variable, 0 for no compression
+    :param bool shuffle: whether to apply the shuffle filter to the
+        precipitation variable before compression
+    :param tuple encoding: storage encoding of the precipitation variable,
+        from cmorph_netcdf.parse_encoding(), None for full precision float32
+    :return: the open dataset, which the caller should close
+    :rtype: netCDF4.Dataset
+    """
 
-    # starting day value, i.e. first number of days
-    # since the time units' "since year"
-    days_initial = (date_initial - date_since).days
+    output_dataset = netCDF4.Dataset(netcdf_file, 'w')
+
+    # create the time, x, and y dimensions
+    output_dataset.createDimension('time', None)
+    output_dataset.createDimension('lat', len(lat_values))
+    output_dataset.createDimension('lon', len(lon_values))
+
+    # global attributes
+    output_dataset.title = data_desc['title']
+
+    # create the coordinate variables
+    time_variable = output_dataset.createVariable('time', 'i4', ('time',))
+    lat_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
+    lon_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
+
+    # set the coordinate variables' attributes
+    time_variable.units = 'days since {0}-01-01'.format(units_since_year)
+    lat_variable.units = 'degrees_north'
+    lon_variable.units = 'degrees_east'
+    time_variable.long_name = 'Time'
+    lat_variable.long_name = 'Latitude'
+    lon_variable.long_name = 'Longitude'
+    time_variable.calendar = 'gregorian'
+
+    # set the coordinate variable values, the time values are written along
+    # with the data
+    lat_variable[:] = np.array(lat_values, 'f4')
+    lon_variable[:] = np.array(lon_values, 'f4')
+
+    # create the precipitation variable, which the ingest fills in day by day
+    data_variable = cmorph_netcdf.create_prcp_variable(output_dataset,
+                                                       ('time', 'lat', 'lon',),
+                                                       chunking,
+                                                       len(time_values),
+                                                       len(lat_values),
+                                                       len(lon_values),
+                                                       complevel,
+                                                       shuffle,
+                                                       encoding)
+    data_variable.units = 'mm'
+    data_variable.standard_name = 'precipitation'
+    data_variable.long_name = 'Precipitation'
+    data_variable.description = data_desc['title']
+
+    return output_dataset
 
-    # total number of days between Jan 1st of the initial
-    # year and Dec 31st of the final year
-    total_days = (date_final - date_initial).days + 1
 
-    # list of day values starting at the initial number
-    # of days since the time units' "since year"
-    days_since = range(days_initial, days_initial + total_days)
+# ------------------------------------------------------------------------------
+def _read_daily_data(daily_cmorph_file,
+                     data_desc: dict,
+                     obs_type: str,
+                     rows: tuple,
+                     columns: list,
+                     min_valid_steps=None):
+    """
+    Reads the precipitation values within a lat/lon window of a daily file,
+    with missing values as NaNs. Only the window is read from the file.
+
+    For a file of 3-hourly values the day's steps are read as a single
+    (steps, lat, lon) block and summed into the daily total, with grid cells
+    missing if fewer than the minimum number of steps are valid.
+
+    :param daily_cmorph_file: path of a daily file, or the decompressed file contents
+    :param dict data_desc: data description dictionary from _read_description()
+    :param str obs_type: "raw", "adjusted" or "icdr"
+    :param tuple rows: (start, end) range of the window's lat indices
+    :param list columns: (start, end) ranges of the window's lon indices,
+        stitched together in order
+    :param int min_valid_steps: number of the valid steps needed for a daily
+        total if the file holds 3-hourly values, None for a file of daily values
+    :return: array of values with shape (1, lat, lon)
+    :rtype: ndarray
+    """
+
+    if min_valid_steps is not None:
+
+        # read the window of all the day's steps at once, in mm/3hr, and sum them into mm/day
+        data = cmorph_aggregate.daily_total(cmorph_io.load_daily_window(daily_cmorph_file,
+                                                                        (data_desc['ydef_count'],
+                                                                         data_desc['xdef_count']),
+                                                                        rows,
+                                                                        columns,
+                                                                        data_desc['little_endian'],
+                                                                        float(data_desc['undef']),
+                                                                        data_desc['steps_per_day']),
+                                            min_valid_steps)
+
+    elif not obs_type == 'icdr':
+
+        # read the window of the daily binary data from file, byte swapped
+        # if not little endian, assuming values are in lat/lon orientation
+        data = cmorph_io.load_daily_window(daily_cmorph_file,
+                                           (data_desc['ydef_count'], data_desc['xdef_count']),
+                                           rows,
+                                           columns,
+                                           data_desc['little_endian'],
+                                           float(data_desc['undef']))
+    else:
+        # read the window of data from ICDR netcdf file
+        with cmorph_metrics.timed('decode') as sample, \
+                cmorph_io.open_icdr(daily_cmorph_file) as dataset:
+            variable = dataset.variables['cmorph']
+            data = np.concatenate([np.array(variable[..., rows[0]:rows[1], start:end])
+                                   for start, end in columns], axis=-1)
+            sample.bytes = data.nbytes
 
-    return np.array(days_since)
+        # convert missing values to NaNs
+        with cmorph_metrics.timed('mask') as sample:
+            data[data == float(data_desc['undef'])] = np.NaN
+            sample.bytes = data.nbytes
+
+    return np.reshape(data, (1, rows[1] - rows[0], sum(end - start for start, end in columns)))
 
 
 # ------------------------------------------------------------------------------
@@ -280,7 +441,26 @@ def ingest_cmorph_to_netcdf(cmorph_dir: str,
                             download_files=True,
                             remove_files=True,
                             conus_only=False,
-                            manual_dates=False):
+                            bbox=None,
+                            manual_dates=False,
+                            download_workers=1,
+                            in_memory=False,
+                            cache_dir=None,
+                            cache_max_bytes=cmorph_cache.DEFAULT_MAX_BYTES,
+                            append=False,
+                            chunking=None,
+                            complevel=0,
+                            shuffle=False,
+                            slab_size=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                            pipeline_workers=1,
+                            queue_depth=cmorph_pipeline.DEFAULT_QUEUE_DEPTH,
+                            three_hourly=False,
+                            min_valid_steps=_DEFAULT_MIN_VALID_STEPS,
+                            encoding=None,
+                            metrics_file=None,
+                            pool_size=None,
+                            download_retries=cmorph_download.DEFAULT_RETRIES,
+                            decompress_workers=1):
     """
     Ingests CMORPH daily precipitation files into a full period of record file containing daily precipitation values.
 
@@ -292,270 +472,308 @@ def ingest_cmorph_to_netcdf(cmorph_dir: str,
     :param obs_type: "raw" or "adjusted"
     :param download_files: if true then download the data descriptor and data files from FTP, overwrites files in CMORPH work directory
     :param remove_files: if files were downloaded then remove them once operations have completed
-    :param conus_only: ingest only data for CONUS
+    :param conus_only: ingest only data for CONUS, a preset for the
+        cmorph_regions.CONUS bounding box
+    :param tuple bbox: (west, south, east, north) bounding box of the data to
+        ingest, with longitudes in either -180..180 or 0..360, the output
+        longitudes follow the convention of the west bound, None for the full grid
     :param manual_dates:
+    :param int download_workers: number of daily files to download concurrently
+    :param bool in_memory: if True then downloaded files are decompressed and
+        decoded in memory, without temporary files
+    :param str cache_dir: directory of a persistent download cache consulted
+        before going to the network, None for no cache
+    :param int cache_max_bytes: size budget of the download cache, least
+        recently used files are evicted beyond this
+    :param bool append: if True then the existing NetCDF is extended in place
+        with only the days following its last time step, through the end date
+        (or the end of the final year if not using manual dates)
+    :param chunking: chunk layout of the precipitation variable, "map" (one
+        chunk per day), "series" (long runs of days over small tiles, for time
+        series reads), an explicit (time, lat, lon) tuple, or None to leave it
+        up to the NetCDF library
+    :param int complevel: zlib compression level of the precipitation
+        variable, 0 for no compression
+    :param bool shuffle: whether to apply the shuffle filter to the
+        precipitation variable before compression
+    :param int slab_size: number of days collected in memory and written to
+        the NetCDF at once
+    :param int pipeline_workers: number of months downloaded and read
+        concurrently while earlier months are being written, 0 to download,
+        read and write one month after another
+    :param int queue_depth: maximum number of months being downloaded/read or
+        waiting to be written, which bounds the memory used for holding data
+        ahead of the writes
+    :param bool three_hourly: if True then the daily values are computed from
+        the CRT 3-hourly files (adjusted only), with each day's 8 steps read and
+        summed as a single block, one day at a time
+    :param int min_valid_steps: number of a day's 3-hourly steps which must be
+        valid for a grid cell's daily total, otherwise the day is missing
+    :param tuple encoding: storage encoding of the precipitation variable of
+        a new NetCDF, ("int16", scale factor) to pack values into 16-bit
+        integers, ("digits", N) or ("bitround", N) to quantize 32-bit floats
+        before compression, or None for full precision 32-bit floats
+    :param str metrics_file: file to which the timings and byte counts of
+        the ingest's stages are written at the end of the run, in the
+        Prometheus text format if its extension is ".prom", otherwise as JSON,
+        None to only log them (each month's as it's written, and the totals)
+    :param int pool_size: maximum number of idle HTTPS connections to the
+        server kept alive for reuse by the downloads, the number of download
+        workers if None
+    :param int download_retries: number of times a failed download is retried,
+        with exponential backoff, before its day is left as NaNs, the files which
+        failed for good are reported at the end of the run
+    :param int decompress_workers: number of processes decompressing the
+        downloaded files, 1 to decompress them in the ingest's own process
     :return:
     """
 
-    # read data description info into a dictionary
-    data_desc = _read_description(cmorph_dir, download_files, remove_files, obs_type)
+    if three_hourly and obs_type != 'adjusted':
+        raise ValueError('3-hourly files are only available for the adjusted (CRT) data')
+    if not three_hourly:
+        min_valid_steps = None
 
-    lat_start = data_desc['ydef_start']
-    lat_end = data_desc['ydef_start'] + (data_desc['ydef_count'] * data_desc['ydef_increment'])
-    lon_start = data_desc['xdef_start']
-    lon_end = data_desc['xdef_start'] + (data_desc['xdef_count'] * data_desc['xdef_increment'])
+    # the timings of the ingest's stages, logged for each month and for the whole run
+    metrics = cmorph_metrics.IngestMetrics('ingest_cmorph_daily_icdr', netcdf_file)
 
-    # generate the full range of lat/lon values
-    lat_values = list(_frange(lat_start, lat_end, data_desc['ydef_increment']))
-    lon_values = list(_frange(lon_start, lon_end, data_desc['xdef_increment']))
+    # read data description info into a dictionary
+    data_desc = _read_description(cmorph_dir, download_files, remove_files, obs_type)
 
-    # get length of lat and lon values for inserting data slices
-    lat_len = len(lat_values)
-    lon_len = len(lon_values)
+    # the downloader used for all daily files, with the persistent cache if called for
+    cache = None
+    if cache_dir is not None:
+        cache = cmorph_cache.DownloadCache(cache_dir, cache_max_bytes)
+    downloader = cmorph_download.Downloader(workers=download_workers, cache=cache, pool_size=pool_size,
+                                            retries=download_retries)
+    decompressor = cmorph_decompress.Decompressor(workers=decompress_workers)
 
-    # slice out the CONUS lat/lon values, if called for
+    # the lat/lon window to ingest, computed once from the full grid's coordinates
     if conus_only:
+        if bbox is not None:
+            raise ValueError('Only one of conus_only and bbox may be specified')
+        bbox = cmorph_regions.CONUS
+    window = cmorph_regions.compute_window(
+        data_desc['ydef_start'] + np.arange(data_desc['ydef_count']) * data_desc['ydef_increment'],
+        data_desc['xdef_start'] + np.arange(data_desc['xdef_count']) * data_desc['xdef_increment'],
+        bbox)
+    lat_values = window['lat_values']
+    lon_values = window['lon_values']
 
-        # find lat/lon indices corresponding to CONUS bounds
-        lat_start = _find_closest(lat_values, 23.0)
-        lat_end = _find_closest(lat_values, 50.0) + 1
-        lon_start = _find_closest(lon_values, 232.0)
-        lon_end = _find_closest(lon_values, 295.0) + 1
+    units_since_year = 1900
 
-        # get the subset of lat/lon values specific to CONUS only
-        lat_values = lat_values[lat_start: lat_end]
-        lon_values = lon_values[lon_start: lon_end]
+    # get the months to ingest, and the final day of the period
+    if manual_dates:
 
-    units_since_year = 1900
+        # get range of dates to cover, and the months spanning them
+        first_date = datetime.strptime(start_date, '%Y-%m-%d')
+        final_date = datetime.strptime(end_date, '%Y-%m-%d')
+        dates = _get_months(start_date, end_date)
+        months = [(datee.year, datee.month) for datee in dates]
+    else:
+        # get the range of years covered, the time axis starting with the first of them
+        # rather than with the start of the data descriptor's (far longer) period
+        years = _get_years()
+        months = [(year, month) for year in years for month in range(1, 13)]
+        first_date = datetime(years[0], 1, 1)
+        final_date = datetime(years[-1], 12, 31)
+
+    # compute the time coordinate values of a new NetCDF
+    time_values = cmorph_catalog.days_since(first_date, final_date, units_since_year)
 
-    # get the lat/lon range limits for the full grid
-    # create a corresponding NetCDF
+    # either open the existing NetCDF to extend it in place, or create a new one
     # The opening and closing of this file could be causing I/O errors -
     # Move to __main__ function, keep open
-    with netCDF4.Dataset(netcdf_file, 'w') as output_dataset:
-
-        # create the time, x, and y dimensions
-        output_dataset.createDimension('time', None)
-        output_dataset.createDimension('lat', len(lat_values))
-        output_dataset.createDimension('lon', len(lon_values))
-
-        # global attributes
-        output_dataset.title = data_desc['title']
-
-        # create the coordinate variables
-        time_variable = output_dataset.createVariable('time', 'i4', ('time',))
-        lat_variable = output_dataset.createVariable('lat', 'f4', ('lat',))
-        lon_variable = output_dataset.createVariable('lon', 'f4', ('lon',))
-
-        # set the coordinate variables' attributes
-        time_variable.units = 'days since {0}-01-01'.format(units_since_year)
-        lat_variable.units = 'degrees_north'
-        lon_variable.units = 'degrees_east'
-        time_variable.long_name = 'Time'
-        lat_variable.long_name = 'Latitude'
-        lon_variable.long_name = 'Longitude'
-        time_variable.calendar = 'gregorian'
-
-        # set the coordinate variable values
-        if manual_dates:
-
-            # get range of dates to cover
-            dates = _get_months(start_date, end_date)
-
-            time_variable[:] = _compute_days_full_years(dates[0].year,
-                                                        dates[len(dates) - 1].year,
-                                                        units_since_year,
-                                                        dates[0].month,
-                                                        dates[0].day,
-                                                        dates[len(dates) - 1].month,
-                                                        dates[len(dates) - 1].day)
+    if append:
+
+        output_dataset = netCDF4.Dataset(netcdf_file, 'a')
+
+        # we'll only ingest the days following the last day holding data, the
+        # days after it (if any) having been left unwritten or as NaNs by an
+        # interrupted run or failed downloads
+        time_variable = output_dataset.variables['time']
+        last_index = cmorph_netcdf.last_ingested_step(output_dataset.variables['prcp'], time_variable)
+        if last_index is None:
+            first_index = 0
+            _logger.warning('No ingested days found in %s, ingesting all days from %s',
+                            netcdf_file, first_date.date())
         else:
-            # get the range of years covered
-            years = _get_years()
-
-            time_variable[:] = _compute_days_full_years(data_desc['start_date'].year,
-                                                        years[-1],
-                                                        year_since=units_since_year)
-
-        lat_variable[:] = np.array(lat_values, 'f4')
-        lon_variable[:] = np.array(lon_values, 'f4')
-
-        # read the variable data from the CMORPH file, mask and reshape
-        # accordingly, and then assign into the variable
-        data_variable = output_dataset.createVariable('prcp',
-                                                      'f4',
-                                                      ('time', 'lat', 'lon',),
-                                                      fill_value=np.NaN)
-        data_variable.units = 'mm'
-        data_variable.standard_name = 'precipitation'
-        data_variable.long_name = 'Precipitation'
-        data_variable.description = data_desc['title']
+            first_index = last_index + 1
+            first_date = datetime(units_since_year, 1, 1) + timedelta(days=int(time_variable[last_index]) + 1)
+            if first_date > final_date:
+                _logger.info('Nothing to append, %s already ends on %s',
+                             netcdf_file, (first_date - timedelta(days=1)).date())
+                output_dataset.close()
+                return
 
-        # loop over each year/month, reading binary data from CMORPH files
-        # and adding into the NetCDF variable
-        # TODO NEED TO MAKE THIS IF AND ONLY UPDATE WITH MANUAL_DATES OPTION
-        days_index = 0
-
-        # Added for manual dates
-        if manual_dates:
-            for datee in dates:
-                if download_files:
-                    daily_files = _download_daily_files(cmorph_dir,
-                                                        datee.year,
-                                                        datee.month, obs_type)
-                else:
-                    suffix = str(datee.year) + str(datee.month).zfill(2) + '*'
-                    if obs_type == 'raw':
-                        filename_pattern = cmorph_dir + '/CMORPH_V0.x_RAW_0.25deg-DLY_00Z_' + suffix  # for RAW
-                    elif obs_type == 'adjusted':  # gauge adjusted
-                        filename_pattern = cmorph_dir + '/CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + suffix  # for CRT ('adjusted' argument)
-                    else:
-                        filename_pattern = cmorph_dir + '/CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_' + suffix  # for ICDR
-                    daily_files = glob(filename_pattern)  # can we assume sorted in date ascending order?
-                    _logger.info(daily_files[0])
-                    print(len(daily_files))
-
-                for daily_cmorph_file in daily_files:
-                    if not obs_type == 'icdr':
-
-                        # read the daily binary data from file,
-                        # and byte swap if not little endian
-                        data = np.fromfile(daily_cmorph_file, 'f')
-                        if not data_desc['little_endian']:
-                            data = data.byteswap()
-
-                        # convert missing values to NaNs
-                        data[data == float(data_desc['undef'])] = np.NaN
-
-                        # assume values are in lat/lon orientation
-                        data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
-
-                        # assign into the appropriate slice for the daily time step
-                        #    _logger.info('days_index: %s', days_index)
-                        #    _logger.info('lat_start/lat_end: %s', lat_start)
-                        #    _logger.info('lat_end: %s', lat_end)
-                        #    _logger.info('lon_start: %s', lon_start)
-                        #    _logger.info('lon_end: %s', lon_end)
-                        #   data_variable[days_index, :, :] = data[:, lat_start : lat_end, lon_start : lon_end]
-                        data_variable[days_index, :, :] = data[:, : lat_len, : lon_len]  # tweaked to use index values
-
-                        days_index += 1
-                    else:
-                        # read data from ICDR netcdf file
-                        dataset = netCDF4.Dataset(daily_cmorph_file, mode='r')
-                        data = np.array(dataset.variables['cmorph'])
-
-                        # convert missing values to NaNs
-                        data[data == float(data_desc['undef'])] = np.NaN
-
-                        # assume values are in lat/lon orientation
-                        data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
-
-                        # assign into the appropriate slice for the daily time step
-                        #    _logger.info('days_index: %s', days_index)
-                        #    _logger.info('lat_start/lat_end: %s', lat_start)
-                        #    _logger.info('lat_end: %s', lat_end)
-                        #    _logger.info('lon_start: %s', lon_start)
-                        #    _logger.info('lon_end: %s', lon_end)
-                        #   data_variable[days_index, :, :] = data[:, lat_start : lat_end, lon_start : lon_end]
-                        data_variable[days_index, :, :] = data[:, : lat_len, : lon_len]  # tweaked to use index values
-
-                        days_index += 1
-                # clean up, if necessary
-                if remove_files:
-                    for file in daily_files:
-                        os.remove(file)
-        else:
-            # Original
-            for year in years:
-
-                # FIXME debug only -- remove
-                pass
-
-                for month in range(1, 13):
-
-                    # FIXME debug only -- remove
-                    pass
-
-                    # get the files for the month
-                    if download_files:
-                        daily_files = _download_daily_files(cmorph_dir, year, month, obs_type)
-                    else:
-                        suffix = str(year) + str(month).zfill(2) + '*'
-                        if obs_type == 'raw':
-                            filename_pattern = cmorph_dir + '/CMORPH_V0.x_RAW_0.25deg-DLY_00Z_' + suffix  # for RAW
-                        elif obs_type == 'adjusted':  # gauge adjusted
-                            filename_pattern = cmorph_dir + '/CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_' + suffix  # for CRT ('adjusted' argument)
-                        else:
-                            filename_pattern = cmorph_dir + '/CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_' + suffix  # for ICDR
-                        daily_files = glob(filename_pattern)  # can we assume sorted in date ascending order?
-                        _logger.info(daily_files[0])
-                        print(len(daily_files))
-
-                    # loop over each daily file to read the data and assign it into the variable
-                    for daily_cmorph_file in daily_files:
-                        if not obs_type == 'icdr':
-
-                            # read the daily binary data from file, and byte swap if not little endian
-                            data = np.fromfile(daily_cmorph_file, 'f')
-                            if not data_desc['little_endian']:
-                                data = data.byteswap()
-
-                            # convert missing values to NaNs
-                            data[data == float(data_desc['undef'])] = np.NaN
-
-                            # assume values are in lat/lon orientation
-                            data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
-
-                            # assign into the appropriate slice for the daily time step
-                            #    _logger.info('days_index: %s', days_index)
-                            #    _logger.info('lat_start/lat_end: %s', lat_start)
-                            #    _logger.info('lat_end: %s', lat_end)
-                            #    _logger.info('lon_start: %s', lon_start)
-                            #    _logger.info('lon_end: %s', lon_end)
-                            #   data_variable[days_index, :, :] = data[:, lat_start : lat_end, lon_start : lon_end]
-                            data_variable[days_index, :, :] = \
-                                data[:, : lat_len, : lon_len]  # tweaked to use index values
-                            days_index += 1
-                        else:
-                            # read data from ICDR netcdf file
-                            dataset = netCDF4.Dataset(daily_cmorph_file, mode='r')
-                            data = np.array(dataset.variables['cmorph'])
-
-                            _logger.info("Initial data shape for the day: %s", data.shape)
-
-                            # convert missing values to NaNs
-                            data[data == float(data_desc['undef'])] = np.NaN
-
-                            # assume values are in lat/lon orientation
-                            data = np.reshape(data, (1, data_desc['ydef_count'], data_desc['xdef_count']))
-
-                            _logger.info("Data shape post reshape: %s", data.shape)
-
-                            # assign into the appropriate slice for the daily time step
-                            #    _logger.info('days_index: %s', days_index)
-                            #    _logger.info('lat_start/lat_end: %s', lat_start)
-                            #    _logger.info('lat_end: %s', lat_end)
-                            #    _logger.info('lon_start: %s', lon_start)
-                            #    _logger.info('lon_end: %s', lon_end)
-                            #   data_variable[days_index, :, :] = data[:, lat_start : lat_end, lon_start : lon_end]
-                            data_variable[days_index, :, :] = \
-                                data[:, : lat_len, : lon_len]  # tweaked to use index values
-
-                            days_index += 1
-
-                    # clean up, if necessary
-                    if remove_files:
-                        for file in daily_files:
-                            os.remove(file)
+            _logger.info('Appending days %s through %s', first_date.date(), final_date.date())
 
+    else:
 
-# ------------------------------------------------------------------------------
-def _frange(start, stop, step):
-    i = start
-    while i < stop:
-        yield i
-        i += step
+        output_dataset = _create_netcdf(netcdf_file,
+                                        data_desc,
+                                        lat_values,
+                                        lon_values,
+                                        time_values,
+                                        units_since_year,
+                                        chunking,
+                                        complevel,
+                                        shuffle,
+                                        encoding)
+        first_index = 0
+
+    with output_dataset:
+
+        # the slab writer writes every day through the final one (as NaNs if
+        # missing), along with their time values, so the time variable only
+        # covers the days written and prefilling would be wasted
+        days_initial = (first_date - datetime(units_since_year, 1, 1)).days
+        days_final = (final_date - datetime(units_since_year, 1, 1)).days
+        output_dataset.set_fill_off()
+        slab_writer = cmorph_netcdf.SlabWriter(output_dataset.variables['prcp'],
+                                               slab_size,
+                                               first_index,
+                                               first_index + days_final - days_initial + 1,
+                                               output_dataset.variables['time'],
+                                               np.arange(days_initial, days_final + 1))
+
+        # the daily files already in the work directory, scanned once up front, when not downloading
+        catalog = None
+        if not download_files:
+            if obs_type == 'raw':
+                catalog = cmorph_catalog.FileCatalog.scan(cmorph_dir, 'CMORPH_V0.x_RAW_0.25deg-DLY_00Z_')
+            elif obs_type == 'adjusted' and three_hourly:  # CRT, 3-hourly
+                catalog = cmorph_catalog.FileCatalog.scan(cmorph_dir, cmorph_ctl.file_prefix(data_desc['dset']))
+            elif obs_type == 'adjusted':  # CRT
+                catalog = cmorph_catalog.FileCatalog.scan(cmorph_dir, 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_')
+            else:  # ICDR
+                catalog = cmorph_catalog.FileCatalog.scan(cmorph_dir, 'CMORPH_V0.x_ADJ_0.25deg-DLY_00Z_', '.nc')
+            gaps = catalog.missing(first_date, final_date + timedelta(days=1))
+            if len(gaps) > 0:
+                _logger.warning('Missing %d daily files, e.g. for %s, these days are left as NaNs',
+                                len(gaps), gaps[0])
+
+        # the days of each month to ingest, only the days between the first
+        # day not yet present and the final day are wanted
+        month_items = []
+        for year, month in months:
+            if catalog is None:
+                month_start = np.datetime64('{0:04d}-{1:02d}'.format(year, month), 'M')
+                dates = np.arange(month_start.astype('datetime64[D]'), (month_start + 1).astype('datetime64[D]'))
+                files = None
+            else:
+                dates, files = catalog.month(year, month)
+            wanted = (dates >= np.datetime64(first_date, 'D')) & (dates <= np.datetime64(final_date, 'D'))
+            if not np.any(wanted):
+                continue
+            if files is not None:
+                files = [file for file, want in zip(files, wanted) if want]
+            month_items.append((year, month, dates[wanted], files))
+
+        # the 3-hourly files are the ones the descriptor describes, their names
+        # are generated from its DSET template
+        name_template = data_desc['dset'] if three_hourly else None
+
+        # gets the files for a month and reads their data, run by the
+        # pipeline's workers
+        def read_month(month_item):
+
+            year, month, daily_dates, daily_files = month_item
+
+            # download the files for the month, unless they're already in the catalog
+            if daily_files is None:
+                daily_files = _download_daily_files(cmorph_dir, year, month, obs_type,
+                                                    downloader,
+                                                    in_memory,
+                                                    [date.day for date in daily_dates.astype(object)],
+                                                    three_hourly,
+                                                    name_template,
+                                                    decompressor)
+
+                # the days whose file failed to download, even after
+                # retries, are left as NaNs
+                failed = np.array([daily_file is None for daily_file in daily_files], dtype=bool)
+                if np.any(failed):
+                    _logger.warning('Failed to download %d daily files for %s, e.g. for %s, '
+                                    'these days are left as NaNs', np.count_nonzero(failed),
+                                    cmorph_metrics.month_period(year, month), daily_dates[failed][0])
+                    daily_dates = daily_dates[~failed]
+                    daily_files = [daily_file for daily_file in daily_files if daily_file is not None]
+
+            # ICDR files are NetCDFs, these are left for the writer to read
+            # since the NetCDF library can't be used from several threads at once
+            if obs_type == 'icdr':
+                return daily_dates, daily_files
+
+            # read each daily file's data
+            month_data = [_read_daily_data(daily_cmorph_file, data_desc, obs_type,
+                                           window['rows'],
+                                           window['columns'],
+                                           min_valid_steps)
+                          for daily_cmorph_file in daily_files]
+
+            # clean up, if necessary
+            if remove_files and not (download_files and in_memory):
+                for file in daily_files:
+                    os.remove(file)
+
+            return daily_dates, month_data
+
+        # assigns a month's data into the variable, run in time order by the
+        # pipeline's single writer
+        def write_month(month_item, month_result):
+
+            daily_dates, month_data = month_result
+
+            # each day goes to the time index of its date, so a missing
+            # day leaves a gap rather than shifting the following days
+            time_indices = first_index + cmorph_catalog.day_offsets(daily_dates, first_date)
+            for data, time_index in zip(month_data, time_indices):
+
+                if obs_type == 'icdr':
+                    daily_cmorph_file = data
+                    data = _read_daily_data(daily_cmorph_file, data_desc, obs_type,
+                                            window['rows'],
+                                            window['columns'])
+                    if remove_files and not (download_files and in_memory):
+                        os.remove(daily_cmorph_file)
+
+                # assign into the appropriate slice for the daily time step
+                slab_writer.write(time_index, data)
+
+            # the month's stages are all done once it's written
+            period = month_period(month_item)
+            metrics.add_days(period, len(daily_dates))
+            metrics.log_period(period)
+
+        # the label of a month's stage timings, e.g. "2017-01"
+        def month_period(month_item):
+
+            return cmorph_metrics.month_period(*month_item[:2])
+
+        # loop over each year/month, reading binary data from CMORPH files
+        # and adding into the NetCDF variable, with the downloading and reading
+        # of the following months overlapping the writes, and with the stages
+        # timed for each month
+        cmorph_pipeline.run_pipeline(month_items,
+                                     metrics.wrap(read_month, month_period),
+                                     metrics.wrap(write_month, month_period),
+                                     pipeline_workers,
+                                     queue_depth)
+
+        # write out the final slab
+        slab_writer.close()
+
+    # report on the effectiveness of the download cache
+    if cache is not None:
+        cache.log_stats()
+    downloader.log_stats()
+    downloader.close()
+    decompressor.close()
+
+    # report on the stages' timings over the whole run
+    metrics.log_totals()
+    if metrics_file is not None:
+        metrics.write(metrics_file)
 
 
 # ------------------------------------------------------------------------------
@@ -577,59 +795,30 @@ def _read_description(work_dir,
         cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)
         ENDVARS
 
-    :param work_dir: directory in which the ASCII file with data description information will live temporarily
-        while this function executes, the file should be cleaned up upon successful completion
-    :return: dictionary of data description keys/values
+    When downloading, the descriptor is cached locally and only downloaded
+    again once the cached copy is stale, see cmorph_ctl.load_descriptor(),
+    otherwise it's read from the file cmorph_data_descriptor.txt in the work
+    directory.
+
+    :param work_dir: directory containing the data descriptor file, when it's not downloaded
+    :param bool download_file: whether the data descriptor is downloaded (through the local cache)
+    :param bool remove_file: whether the data descriptor file in the work
+        directory is removed once it's been read
+    :param str obs_type: "raw", "adjusted" or "icdr", the raw data has a
+        descriptor of its own, the others share the CRT 3-hourly descriptor
+    :return: dictionary of data description keys/values, see cmorph_ctl.parse_descriptor()
     """
 
-    descriptor_file = os.sep.join((work_dir, 'cmorph_data_descriptor.txt'))
-
-    # download the descriptor file, if necessary
-    #    if download_file:
-
-    #        file_url = "ftp://filsrv.cicsnc.org/olivier/data_CMORPH_NIDIS/03_PGMS/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl"
-    #        urllib.request.urlretrieve(file_url, descriptor_file)
-
     if download_file:
         if obs_type == 'raw':
-            file_url = "https://ftp.cpc.ncep.noaa.gov/precip/CMORPH_V1.0/CTL/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl"  # Changed from Olivier FTP James used to have
-            urllib.request.urlretrieve(file_url, descriptor_file)
+            file_url = _URL_BASE + "CMORPH_V1.0/CTL/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl"  # Changed from Olivier FTP James used to have
         else:
-            file_url = "https://ftp.cpc.ncep.noaa.gov/precip/CMORPH_V1.0/CTL/CMORPH_V1.0_CRT_0.25deg-3HLY.ctl"  # switch to daily?
-            urllib.request.urlretrieve(file_url, descriptor_file)
-
-    # build the data description dictionary by extracting the relevant values from the descriptor file, line by line
-    data_dict = {}
-    with open(descriptor_file, 'r') as fp:
-        for line in fp:
-            words = line.split()
-            if words[0] == 'UNDEF':
-                data_dict['undef'] = float(words[1])
-            elif words[0] == 'XDEF':
-                data_dict['xdef_count'] = int(words[1])
-                data_dict['xdef_start'] = float(words[3])
-                data_dict['xdef_increment'] = float(words[4])
-            elif words[0] == 'YDEF':
-                data_dict['ydef_count'] = int(words[1])
-                data_dict['ydef_start'] = float(words[3])
-                data_dict['ydef_increment'] = float(words[4])
-            elif words[0] == 'TDEF':
-                if obs_type == 'adjusted' or obs_type == 'icdr':
-                    data_dict['start_date'] = datetime.strptime(words[3][3:],
-                                                                '%d%b%Y')  # for CRT adjusted example: "00zjan1998"
-                else:
-                    data_dict['start_date'] = datetime.strptime(words[3], '%d%b%Y')  # example: "01jan1998"
-            elif words[0] == 'OPTIONS':
-                if words[2] == 'big_endian':
-                    data_dict['little_endian'] = False
-                else:  # assume words[2] == 'little_endian'
-                    data_dict['little_endian'] = True
-            elif words[
-                0] == 'cmorph':  # looking for a line like this: "cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)"
-                data_dict['variable_description'] = ' '.join(words[4:])
-            elif words[0] == 'TITLE':
-                data_dict['title'] = ' '.join(words[1:])
-    # Add a nested "if, else" under line 401 to change 3-hly to daily & mm/3hr to mm for CRT data?
+            file_url = _URL_BASE + "CMORPH_V1.0/CTL/CMORPH_V1.0_CRT_0.25deg-3HLY.ctl"  # same grid as the daily files
+        return cmorph_ctl.load_descriptor(file_url)
+
+    descriptor_file = os.sep.join((work_dir, 'cmorph_data_descriptor.txt'))
+    data_dict = cmorph_ctl.read_descriptor(descriptor_file)
+
     # clean up
     if remove_file:
         os.remove(descriptor_file)
@@ -682,11 +871,19 @@ if __name__ == '__main__':
                             choices=['raw', 'adjusted', 'icdr'],
                             default='adjusted',
                             required=False)
-        parser.add_argument("--conus",
-                            help="Use only continental US data (-65 through "
-                                 "-128 degrees east, 23 through 60 degrees north)",
-                            action='store_true',
-                            required=False)
+        region_parser = parser.add_mutually_exclusive_group(required=False)
+        region_parser.add_argument("--conus",
+                                   help="Use only continental US data (232 "
+                                        "through 295 degrees east, 23 through "
+                                        "50 degrees north)",
+                                   action='store_true')
+        region_parser.add_argument("--bbox",
+                                   help="Use only the data within a bounding "
+                                        "box, as west,south,east,north with "
+                                        "longitudes in either -180..180 or "
+                                        "0..360, boxes may cross the 0/360 "
+                                        "meridian",
+                                   type=cmorph_regions.parse_bbox)
         # Added to allow user specified start-/end-dates for ICDR real-time data and specific data periods
         parser.add_argument("--manual_dates",
                             help="Uses user specified start and end date "
@@ -703,7 +900,120 @@ if __name__ == '__main__':
                                  "downloaded if not downloading a period of "
                                  "record ending on Dec. 31, 2017",
                             required=False)
+        parser.add_argument("--append",
+                            help="Extend the existing NetCDF output file in "
+                                 "place with only the days following its last "
+                                 "time step",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--chunking",
+                            help="Chunk layout of the precipitation variable: "
+                                 "map (one chunk per day), series (optimized "
+                                 "for reading time series), or an explicit "
+                                 "chunk shape as time,lat,lon",
+                            type=cmorph_netcdf.parse_chunking,
+                            required=False)
+        parser.add_argument("--complevel",
+                            help="Compression level (1 through 9) of the "
+                                 "precipitation variable, 0 for no compression",
+                            type=int,
+                            choices=range(0, 10),
+                            default=0,
+                            required=False)
+        parser.add_argument("--shuffle",
+                            help="Apply the shuffle filter to the precipitation "
+                                 "variable before compression",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--encoding",
+                            help="Storage encoding of the precipitation "
+                                 "variable: float32, int16 or int16:scale "
+                                 "(packed 16-bit integers), digits:N or "
+                                 "bitround:N (quantized 32-bit floats)",
+                            type=cmorph_netcdf.parse_encoding,
+                            required=False)
+        parser.add_argument("--slab_size",
+                            help="Number of days collected in memory and "
+                                 "written to the NetCDF at once, for example a "
+                                 "month (31) or the time chunk depth",
+                            type=int,
+                            default=cmorph_netcdf.DEFAULT_SLAB_SIZE,
+                            required=False)
+        parser.add_argument("--pipeline_workers",
+                            help="Number of months downloaded and read "
+                                 "concurrently while earlier months are being "
+                                 "written, 0 for no overlap",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--queue_depth",
+                            help="Maximum number of months downloaded/read "
+                                 "ahead of the NetCDF writes",
+                            type=int,
+                            default=cmorph_pipeline.DEFAULT_QUEUE_DEPTH,
+                            required=False)
+        parser.add_argument("--download_workers",
+                            help="Number of daily files to download concurrently",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--download_retries",
+                            help="Number of times a failed download is "
+                                 "retried, with exponential backoff",
+                            type=int,
+                            default=cmorph_download.DEFAULT_RETRIES,
+                            required=False)
+        parser.add_argument("--decompress_workers",
+                            help="Number of processes decompressing the "
+                                 "downloaded files",
+                            type=int,
+                            default=1,
+                            required=False)
+        parser.add_argument("--pool_size",
+                            help="Maximum number of idle HTTPS connections "
+                                 "kept alive for reuse by the downloads, the "
+                                 "number of download workers by default",
+                            type=int,
+                            required=False)
+        parser.add_argument("--in_memory",
+                            help="Decompress and decode downloaded files in "
+                                 "memory, without writing temporary files",
+                            action='store_true',
+                            required=False)
+        parser.add_argument("--cache_dir",
+                            help="Directory of a persistent cache of downloaded "
+                                 "files, consulted before downloading",
+                            required=False)
+        parser.add_argument("--cache_max_bytes",
+                            help="Maximum total size of the download cache, "
+                                 "least recently used files are evicted",
+                            type=int,
+                            default=cmorph_cache.DEFAULT_MAX_BYTES,
+                            required=False)
+        parser.add_argument("--three_hourly",
+                            help="Compute the daily values from the CRT "
+                                 "3-hourly files (adjusted only), summing "
+                                 "each day's 8 steps",
+                            action='store_true',
+                            required=False)
+        parser.add_argument("--min_valid_steps",
+                            help="Number of a day's 3-hourly steps which must "
+                                 "be valid for a daily total",
+                            type=int,
+                            choices=range(1, 9),
+                            default=_DEFAULT_MIN_VALID_STEPS,
+                            required=False)
+        parser.add_argument("--metrics_file",
+                            help="File to which the timings and byte counts "
+                                 "of the ingest's stages are written at the "
+                                 "end of the run, in the Prometheus text "
+                                 "format (for the node exporter's textfile "
+                                 "collector) if its extension is .prom, "
+                                 "otherwise as JSON",
+                            required=False)
         args = parser.parse_args()
+        if args.three_hourly and args.obs_type != 'adjusted':
+            parser.error('--three_hourly requires --obs_type adjusted')
 
         # display run info
         print('\nIngesting CMORPH precipitation dataset')
@@ -713,6 +1023,22 @@ if __name__ == '__main__':
         print('\tRemoving files:        %s' % args.clean_up)
         print('\tObservation type:      %s' % args.obs_type)
         print('\tContinental US only:   %s' % args.conus)
+        print('\tBounding box:          %s' % (args.bbox,))
+        print('\tDownload workers:      %s' % args.download_workers)
+        print('\tConnection pool size:  %s' % (args.pool_size or args.download_workers))
+        print('\tDownload retries:      %s' % args.download_retries)
+        print('\tDecompress workers:    %s' % args.decompress_workers)
+        print('\tIn-memory decode:      %s' % args.in_memory)
+        print('\tDownload cache:        %s' % args.cache_dir)
+        print('\tAppending:             %s' % args.append)
+        print('\tChunking:              %s' % (args.chunking,))
+        print('\tCompression level:     %s' % args.complevel)
+        print('\tEncoding:              %s' % (args.encoding,))
+        print('\tSlab size:             %s' % args.slab_size)
+        print('\tPipeline workers:      %s' % args.pipeline_workers)
+        print('\tQueue depth:           %s' % args.queue_depth)
+        print('\t3-hourly input:        %s' % args.three_hourly)
+        print('\tMetrics file:          %s' % args.metrics_file)
         print('\nRunning...\n')
 
         # perform the ingest to NetCDF
@@ -724,7 +1050,26 @@ if __name__ == '__main__':
                                 download_files=args.download,
                                 remove_files=args.clean_up,
                                 conus_only=args.conus,
-                                manual_dates=args.manual_dates)
+                                bbox=args.bbox,
+                                manual_dates=args.manual_dates,
+                                download_workers=args.download_workers,
+                                in_memory=args.in_memory,
+                                cache_dir=args.cache_dir,
+                                cache_max_bytes=args.cache_max_bytes,
+                                append=args.append,
+                                chunking=args.chunking,
+                                complevel=args.complevel,
+                                shuffle=args.shuffle,
+                                slab_size=args.slab_size,
+                                pipeline_workers=args.pipeline_workers,
+                                queue_depth=args.queue_depth,
+                                three_hourly=args.three_hourly,
+                                min_valid_steps=args.min_valid_steps,
+                                encoding=args.encoding,
+                                metrics_file=args.metrics_file,
+                                pool_size=args.pool_size,
+                                download_retries=args.download_retries,
+                                decompress_workers=args.decompress_workers)
 
         # display the info in case the above info has scrolled
         # past due to output from the ingest process itself
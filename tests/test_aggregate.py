@@ -0,0 +1,95 @@
+import netCDF4
+import numpy as np
+
+import cmorph_aggregate
+
+
+# ------------------------------------------------------------------------------
+def _daily_netcdf(netcdf_file, days, written_days):
+
+    # a daily NetCDF pre-sized to a number of days, of which only the first are written
+    with netCDF4.Dataset(netcdf_file, 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('lat', 2)
+        dataset.createDimension('lon', 3)
+        time_variable = dataset.createVariable('time', 'i4', ('time',))
+        time_variable.units = 'days since 1900-01-01'
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = [10.0, 10.25]
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = [20.0, 20.25, 20.5]
+        variable = dataset.createVariable('prcp', 'f4', ('time', 'lat', 'lon',))
+        variable[days - 1] = np.full((2, 3), np.NaN, dtype='f4')
+
+        first_day = (np.datetime64('2017-01-01') - np.datetime64('1900-01-01')).astype(int)
+        time_variable[:written_days] = first_day + np.arange(written_days)
+        variable[:written_days] = np.ones((written_days, 2, 3), dtype='f4')
+
+
+# ------------------------------------------------------------------------------
+def test_aggregate_daily_netcdf_stops_at_the_last_written_day(tmp_path):
+
+    daily_file = str(tmp_path / 'daily.nc')
+    month_file = str(tmp_path / 'month.nc')
+    _daily_netcdf(daily_file, 90, 40)
+
+    cmorph_aggregate.aggregate_daily_netcdf(daily_file, [('month', month_file)])
+
+    with netCDF4.Dataset(month_file) as dataset:
+        assert list(netCDF4.num2date(dataset.variables['time'][:], dataset.variables['time'].units)
+                    .astype('datetime64[D]')) == [np.datetime64('2017-01-01'), np.datetime64('2017-02-01')]
+        assert np.all(dataset.variables['prcp'][:] == [[[31.0] * 3] * 2, [[9.0] * 3] * 2])
+
+
+# ------------------------------------------------------------------------------
+def _dates(*dates):
+
+    return np.array(dates, dtype='datetime64[D]')
+
+
+# ------------------------------------------------------------------------------
+def test_pentads():
+
+    # 73 pentads a year, with February 29th in the 12th pentad of a leap year
+    starts = cmorph_aggregate.period_starts(_dates('2016-02-24', '2016-02-25', '2016-02-29', '2016-03-01',
+                                                   '2016-03-02', '2017-03-01', '2016-12-31'), 'pentad')
+
+    assert list(starts) == list(_dates('2016-02-20', '2016-02-25', '2016-02-25', '2016-02-25',
+                                       '2016-03-02', '2017-02-25', '2016-12-27'))
+    assert cmorph_aggregate.period_length(np.datetime64('2016-02-25'), 'pentad') == 6
+    assert cmorph_aggregate.period_length(np.datetime64('2017-02-25'), 'pentad') == 5
+    assert len(cmorph_aggregate.periods_between(np.datetime64('2016-01-01'), np.datetime64('2016-12-31'),
+                                                'pentad')) == 73
+
+
+# ------------------------------------------------------------------------------
+def test_dekads():
+
+    # the third dekad of a month runs through its end
+    starts = cmorph_aggregate.period_starts(_dates('2017-01-10', '2017-01-11', '2017-01-21', '2017-01-31'), 'dekad')
+
+    assert list(starts) == list(_dates('2017-01-01', '2017-01-11', '2017-01-21', '2017-01-21'))
+    assert cmorph_aggregate.period_length(np.datetime64('2017-01-21'), 'dekad') == 11
+    assert cmorph_aggregate.period_length(np.datetime64('2016-02-21'), 'dekad') == 9
+
+
+# ------------------------------------------------------------------------------
+def test_seasons():
+
+    # meteorological seasons, December going with the following January and February
+    starts = cmorph_aggregate.period_starts(_dates('2015-12-01', '2016-02-29', '2016-03-01', '2016-11-30'), 'season')
+
+    assert list(starts) == list(_dates('2015-12-01', '2015-12-01', '2016-03-01', '2016-09-01'))
+    assert cmorph_aggregate.period_length(np.datetime64('2015-12-01'), 'season') == 91
+    assert list(cmorph_aggregate.periods_between(np.datetime64('2016-01-15'), np.datetime64('2016-03-15'),
+                                                 'season')) == list(_dates('2015-12-01', '2016-03-01'))
+
+
+# ------------------------------------------------------------------------------
+def test_daily_total():
+
+    subdaily = np.full((8, 1, 3), 0.5, dtype='f4')
+    subdaily[:6, 0, 1] = np.NaN
+    subdaily[:, 0, 2] = np.NaN
+
+    assert np.array_equal(cmorph_aggregate.daily_total(subdaily), [[4.0, 1.0, np.NaN]], equal_nan=True)
+    assert np.array_equal(cmorph_aggregate.daily_total(subdaily, min_valid_steps=4), [[4.0, np.NaN, np.NaN]],
+                          equal_nan=True)
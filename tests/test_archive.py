@@ -0,0 +1,59 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import cmorph_archive
+import cmorph_ctl
+
+# ------------------------------------------------------------------------------
+_DESCRIPTOR = '''DSET ../%y4/%y4%m2/CMORPH_TEST_0.25deg-DLY_00Z_%y4%m2%d2
+OPTIONS template {0}
+UNDEF  -999.0
+XDEF 4 LINEAR    0.125  0.25
+YDEF 3 LINEAR  -59.875  0.25
+ZDEF   01 LEVELS 1
+TDEF 99999 LINEAR  01jan1998 1dy
+VARS 1
+cmorph   1   99 yyyyy Test precipitation (mm)
+ENDVARS
+'''
+
+
+# ------------------------------------------------------------------------------
+def _values(day):
+
+    # a day's grid, each cell's value telling the day, row and column apart
+    values = (day * 100 + np.arange(12).reshape(3, 4)).astype('f4')
+    values[0, 0] = -999.0
+    return values
+
+
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('byte_order', ['little_endian', 'big_endian'])
+def test_missing_days_read_as_nan(tmp_path, byte_order):
+
+    data_desc = cmorph_ctl.parse_descriptor(_DESCRIPTOR.format(byte_order))
+    dtype = '<f4' if byte_order == 'little_endian' else '>f4'
+
+    # January 1st through 5th, without the 2nd and the 4th
+    for day in (1, 3, 5):
+        path = tmp_path / cmorph_ctl.file_name(data_desc['dset'], date(2017, 1, day))
+        path.write_bytes(_values(day).astype(dtype).tobytes())
+    archive = cmorph_archive.CmorphArchive(data_desc, str(tmp_path), open_files=2)
+
+    assert archive.shape == (5, 3, 4)
+    assert archive.times[0] == np.datetime64('2017-01-01T00:00')
+
+    values = archive[:]
+    for day in (1, 3, 5):
+        expected = _values(day)
+        expected[0, 0] = np.NaN
+        assert np.array_equal(values[day - 1], expected, equal_nan=True)
+    assert np.all(np.isnan(values[[1, 3]]))
+
+    # NumPy style indexing, an integer dropping its dimension
+    assert np.array_equal(archive[2, 1:, [0, 3]], _values(3)[1:, [0, 3]])
+    assert np.array_equal(archive[-1, 2, 3], np.float32(511.0))
+    assert np.all(np.isnan(archive[1:4:2, 2, :]))
+    archive.close()
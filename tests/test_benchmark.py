@@ -0,0 +1,19 @@
+from datetime import date
+
+import benchmark_ingest
+
+
+# ------------------------------------------------------------------------------
+def test_all_scenarios_run(tmp_path):
+
+    # a tiny grid, the daily and full ingests still cover the whole year
+    results = benchmark_ingest.run_benchmarks(str(tmp_path / 'archive'),
+                                              str(tmp_path / 'work'),
+                                              date(2017, 1, 1),
+                                              date(2017, 1, 3),
+                                              grid_shape=(8, 16))
+
+    assert sorted(results) == sorted(benchmark_ingest.SCENARIOS)
+    assert results['daily']['days'] == 365
+    assert results['full']['days'] == 365
+    assert results['icdr']['days'] == 3
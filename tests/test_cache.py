@@ -0,0 +1,24 @@
+import os
+import time
+
+import cmorph_cache
+
+
+# ------------------------------------------------------------------------------
+def test_only_stale_temp_files_are_removed(tmp_path):
+
+    product_dir = tmp_path / 'raw'
+    product_dir.mkdir()
+    stale = product_dir / 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_20170101.bz2.0123.tmp'
+    in_flight = product_dir / 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_20170102.bz2.4567.tmp'
+    stale.write_bytes(b'partial')
+    in_flight.write_bytes(b'partial')
+    old = time.time() - cmorph_cache.STALE_TEMP_SECONDS - 60
+    os.utime(str(stale), (old, old))
+
+    cache = cmorph_cache.DownloadCache(str(tmp_path))
+
+    # a temporary file still being written by another process sharing the cache is left alone
+    assert not stale.exists()
+    assert in_flight.exists()
+    assert cache.get('raw/' + in_flight.name) is None
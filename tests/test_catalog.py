@@ -0,0 +1,50 @@
+import numpy as np
+
+import cmorph_catalog
+
+# ------------------------------------------------------------------------------
+_PREFIX = 'CMORPH_V1.0_ADJ_0.25deg-DLY_00Z_'
+
+
+# ------------------------------------------------------------------------------
+def test_scan_with_gaps(tmp_path):
+
+    days = ['20161230', '20161231', '20170101', '20170104', '20170131', '20170201']
+    for day in days:
+        (tmp_path / (_PREFIX + day)).write_bytes(b'')
+    (tmp_path / (_PREFIX + '20170102.bz2')).write_bytes(b'')
+    (tmp_path / 'CMORPH_V0.x_RAW_0.25deg-DLY_00Z_20170103').write_bytes(b'')
+
+    catalog = cmorph_catalog.FileCatalog.scan(str(tmp_path), _PREFIX)
+
+    # only the product's uncompressed files, in date order
+    assert len(catalog) == len(days)
+    assert [str(date).replace('-', '') for date in catalog.dates] == days
+
+    january_dates, january_files = catalog.month(2017, 1)
+    assert list(january_dates) == list(np.array(['2017-01-01', '2017-01-04', '2017-01-31'], dtype='datetime64[D]'))
+    assert [path.rsplit('_', 1)[1] for path in january_files] == ['20170101', '20170104', '20170131']
+
+    missing = catalog.missing(np.datetime64('2016-12-30'), np.datetime64('2017-01-06'))
+    assert list(missing) == list(np.array(['2017-01-02', '2017-01-03', '2017-01-05'], dtype='datetime64[D]'))
+
+    # the days are written where their dates fall, leaving the gaps
+    assert list(cmorph_catalog.day_offsets(january_dates, np.datetime64('2016-12-30'))) == [2, 5, 32]
+
+
+# ------------------------------------------------------------------------------
+def test_duplicate_days_keep_the_last_listed():
+
+    catalog = cmorph_catalog.FileCatalog.from_names(['a/' + _PREFIX + '20170102',
+                                                     'a/' + _PREFIX + '20170101',
+                                                     'b/' + _PREFIX + '20170101.bz2'])
+
+    assert list(catalog.sources) == ['b/' + _PREFIX + '20170101.bz2', 'a/' + _PREFIX + '20170102']
+
+
+# ------------------------------------------------------------------------------
+def test_days_since():
+
+    time_values = cmorph_catalog.days_since(np.datetime64('2018-12-30'), np.datetime64('2019-01-02'), 2018)
+
+    assert list(time_values) == [363, 364, 365, 366]
@@ -0,0 +1,106 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+import cmorph_ctl
+
+# ------------------------------------------------------------------------------
+_DESCRIPTOR = '''DSET ../0.25deg-DLY_00Z/%y4/%y4%m2/CMORPH_V1.0_RAW_0.25deg-DLY_00Z_%y4%m2%d2
+TITLE  CMORPH Version 1.0BETA Version, daily precip from 00Z-24Z
+OPTIONS template little_endian
+UNDEF  -999.0
+XDEF 1440 LINEAR    0.125  0.25
+YDEF  480 LINEAR  -59.875  0.25
+ZDEF   01 LEVELS 1
+TDEF 99999 LINEAR  01jan1998 1dy
+VARS 1
+cmorph   1   99 yyyyy CMORPH Version 1.o daily precipitation (mm)
+ENDVARS
+'''
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def descriptor_server():
+    """
+    Serves a data descriptor without any Last-Modified or ETag header.
+
+    :return: the descriptor's URL and the list of the headers of each request
+    """
+
+    requests = []
+
+    class _Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            requests.append(dict(self.headers))
+            body = _DESCRIPTOR.encode('ascii')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/CMORPH_V1.0_RAW_0.25deg-DLY_00Z.ctl'.format(server.server_address[1]), requests
+    server.shutdown()
+
+
+# ------------------------------------------------------------------------------
+def test_no_validators_are_made_up(descriptor_server, tmp_path):
+
+    url, requests = descriptor_server
+
+    # the second load revalidates the cached copy straight away
+    for _ in range(2):
+        data_dict = cmorph_ctl.load_descriptor(url, str(tmp_path), max_age=0)
+        assert data_dict['xdef_count'] == 1440
+
+    assert len(requests) == 2
+    assert 'If-Modified-Since' not in requests[1]
+    assert 'If-None-Match' not in requests[1]
+
+
+# ------------------------------------------------------------------------------
+def test_parse_descriptor():
+
+    data_dict = cmorph_ctl.parse_descriptor(_DESCRIPTOR)
+
+    # the units code and data format aren't part of the variable's description
+    assert data_dict['variables'] == [{'name': 'cmorph',
+                                       'levels': 1,
+                                       'code': '99',
+                                       'format': 'yyyyy',
+                                       'description': 'CMORPH Version 1.o daily precipitation (mm)'}]
+    assert data_dict['variable_description'] == 'CMORPH Version 1.o daily precipitation (mm)'
+    assert data_dict['tdef_count'] == 99999
+    assert data_dict['start_date'] == datetime(1998, 1, 1)
+    assert data_dict['tdef_increment'] == (1, 'dy')
+    assert data_dict['steps_per_day'] == 1
+    assert (data_dict['xdef_count'], data_dict['ydef_count']) == (1440, 480)
+    assert data_dict['little_endian'] and data_dict['template']
+
+
+# ------------------------------------------------------------------------------
+def test_parse_three_hourly_descriptor():
+
+    text = _DESCRIPTOR.replace('TDEF 99999 LINEAR  01jan1998 1dy', 'tdef 99999 linear 00z01jan1998 3hr')
+    text = text.replace('VARS 1', '* the 3-hourly values\nVARS 1')
+
+    data_dict = cmorph_ctl.parse_descriptor(text)
+
+    assert data_dict['tdef_increment'] == (3, 'hr')
+    assert data_dict['steps_per_day'] == 8
+    assert len(data_dict['variables']) == 1
+
+
+# ------------------------------------------------------------------------------
+def test_descriptor_without_vars():
+
+    with pytest.raises(ValueError):
+        cmorph_ctl.parse_descriptor(_DESCRIPTOR.split('VARS')[0])
@@ -0,0 +1,68 @@
+import bz2
+import gzip
+import os
+
+import pytest
+
+import cmorph_decompress
+
+
+# ------------------------------------------------------------------------------
+def _files(directory):
+
+    # a good file, a corrupt bz2 and gzip file each, and a truncated one
+    contents = [bz2.compress(b'precipitation' * 1000),
+                b'BZh' + os.urandom(500),
+                b'\x1f\x8b' + os.urandom(500),
+                gzip.compress(os.urandom(5000))[:300]]
+    jobs = []
+    for index, data in enumerate(contents):
+        path = os.path.join(directory, 'day_{0}.compressed'.format(index))
+        with open(path, 'wb') as f_out:
+            f_out.write(data)
+        jobs.append((path, os.path.join(directory, 'day_{0}'.format(index))))
+    return contents, jobs
+
+
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('workers', [1, 2])
+def test_corrupt_files_are_skipped(tmp_path, workers):
+
+    _, jobs = _files(str(tmp_path))
+    decompressor = cmorph_decompress.Decompressor(workers=workers)
+
+    results = decompressor.decompress_files(jobs + [None])
+    decompressor.close()
+
+    assert results == [jobs[0][1], None, None, None, None]
+    with open(results[0], 'rb') as f_in:
+        assert f_in.read() == b'precipitation' * 1000
+
+    # no partial decompressed file is left behind for the corrupt files
+    assert not any(os.path.exists(destination) for _, destination in jobs[1:])
+
+
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('workers', [1, 2])
+def test_corrupt_contents_are_skipped(tmp_path, workers):
+
+    contents, _ = _files(str(tmp_path))
+    decompressor = cmorph_decompress.Decompressor(workers=workers)
+
+    results = decompressor.decompress_contents(contents + [None])
+    decompressor.close()
+
+    assert [None if result is None else bytes(result) for result in results] == \
+        [b'precipitation' * 1000, None, None, None, None]
+
+
+# ------------------------------------------------------------------------------
+def test_detect_compression():
+
+    assert cmorph_decompress.detect_compression(bz2.compress(b'precipitation')[:cmorph_decompress.MAGIC_SIZE]) == 'bz2'
+    assert cmorph_decompress.detect_compression(gzip.compress(b'precipitation')[:cmorph_decompress.MAGIC_SIZE]) == 'gz'
+
+    # an uncompressed binary file, a NetCDF and an empty file
+    assert cmorph_decompress.detect_compression(b'\x00\x00\x7a\xc4') is None
+    assert cmorph_decompress.detect_compression(b'\x89HDF\r\n') is None
+    assert cmorph_decompress.detect_compression(b'') is None
@@ -0,0 +1,192 @@
+import bz2
+import os
+import urllib.error
+
+import pytest
+
+import cmorph_cache
+import cmorph_download
+import cmorph_local_server
+
+# ------------------------------------------------------------------------------
+# number of daily files served
+_DAYS = 12
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def served_files(tmp_path):
+    """
+    Serves a month of small bz2 compressed daily files over HTTP.
+
+    :return: the month directory's base URL and the decompressed contents of each day's file, in date order
+    """
+
+    month_dir = tmp_path / 'archive' / '201701'
+    month_dir.mkdir(parents=True)
+    contents = []
+    for day in range(1, _DAYS + 1):
+        data = os.urandom(1000 * day)
+        (month_dir / 'day_{0:02d}.bz2'.format(day)).write_bytes(bz2.compress(data))
+        contents.append(data)
+
+    server, base_url = cmorph_local_server.serve_http(str(tmp_path / 'archive'), latency=0.01)
+    yield base_url + '201701/', contents
+    server.shutdown()
+
+
+# ------------------------------------------------------------------------------
+def _urls(base_url):
+
+    return [base_url + 'day_{0:02d}.bz2'.format(day) for day in range(1, _DAYS + 1)]
+
+
+# ------------------------------------------------------------------------------
+def _decompressed(path):
+
+    with open(path, 'rb') as f_in:
+        return bz2.decompress(f_in.read())
+
+
+# ------------------------------------------------------------------------------
+def test_fetch_returns_files_in_date_order(served_files, tmp_path):
+
+    base_url, contents = served_files
+    downloader = cmorph_download.Downloader(workers=4)
+    paths = [str(tmp_path / 'day_{0:02d}.bz2'.format(day)) for day in range(1, _DAYS + 1)]
+
+    results = downloader.fetch(list(zip(_urls(base_url), paths)))
+    downloader.close()
+
+    assert results == paths
+    assert [_decompressed(path) for path in results] == contents
+
+
+# ------------------------------------------------------------------------------
+def test_fetch_bytes_returns_contents_in_date_order(served_files):
+
+    base_url, contents = served_files
+    downloader = cmorph_download.Downloader(workers=4)
+
+    results = downloader.fetch_bytes([(url, 'auto') for url in _urls(base_url)])
+    downloader.close()
+
+    assert [bytes(result) for result in results] == contents
+
+
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_failed_download_is_skipped(served_files, tmp_path, in_memory):
+
+    base_url, contents = served_files
+    urls = _urls(base_url)
+    urls[3] = base_url + 'missing.bz2'
+    downloader = cmorph_download.Downloader(workers=4, backoff=0.0)
+
+    if in_memory:
+        results = downloader.fetch_bytes([(url, 'auto') for url in urls], skip_failed=True)
+        results = [None if result is None else bytes(result) for result in results]
+    else:
+        paths = [str(tmp_path / os.path.basename(url)) for url in urls]
+        results = downloader.fetch(list(zip(urls, paths)), skip_failed=True)
+        results = [None if result is None else _decompressed(result) for result in results]
+    downloader.close()
+
+    assert results == contents[:3] + [None] + contents[4:]
+    assert [url for url, _ in downloader.failed] == [urls[3]]
+
+    # a file which doesn't exist isn't worth retrying
+    assert downloader.retried == 0
+
+
+# ------------------------------------------------------------------------------
+def test_failed_download_is_raised(served_files, tmp_path):
+
+    base_url, _ = served_files
+    urls = _urls(base_url)
+    urls[3] = base_url + 'missing.bz2'
+    downloader = cmorph_download.Downloader(workers=4, backoff=0.0)
+
+    with pytest.raises(urllib.error.HTTPError):
+        downloader.fetch([(url, str(tmp_path / os.path.basename(url))) for url in urls])
+    downloader.close()
+
+
+# ------------------------------------------------------------------------------
+def test_corrupt_download_is_skipped(served_files, tmp_path):
+
+    base_url, contents = served_files
+    month_dir = tmp_path / 'archive' / '201701'
+    (month_dir / 'corrupt.gz').write_bytes(b'\x1f\x8b' + os.urandom(1000))
+    (month_dir / 'truncated.bz2').write_bytes(bz2.compress(os.urandom(10000))[:500])
+    urls = _urls(base_url)[:2] + [base_url + 'corrupt.gz', base_url + 'truncated.bz2']
+    downloader = cmorph_download.Downloader(workers=2, retries=1, backoff=0.0)
+
+    results = downloader.fetch_bytes([(url, 'auto') for url in urls], skip_failed=True)
+    downloader.close()
+
+    assert [None if result is None else bytes(result) for result in results] == contents[:2] + [None, None]
+    assert sorted(url for url, _ in downloader.failed) == sorted(urls[2:])
+
+
+# ------------------------------------------------------------------------------
+def test_cache_hits_are_counted_once_revalidated(served_files, tmp_path):
+
+    base_url, contents = served_files
+    cache = cmorph_cache.DownloadCache(str(tmp_path / 'cache'))
+    urls = _urls(base_url)
+    jobs = [(url, 'auto', '201701/' + os.path.basename(url)) for url in urls]
+
+    downloader = cmorph_download.Downloader(workers=4, cache=cache)
+    downloader.fetch_bytes(jobs)
+    assert (cache.hits, cache.misses) == (0, _DAYS)
+
+    # one of the files changes on the server, its cached copy isn't a hit
+    changed_path = tmp_path / 'archive' / '201701' / 'day_02.bz2'
+    changed_path.write_bytes(bz2.compress(os.urandom(3000)))
+    os.utime(str(changed_path), (os.path.getatime(str(changed_path)), os.path.getmtime(str(changed_path)) + 60))
+    downloader.fetch_bytes(jobs)
+    downloader.close()
+
+    assert (cache.hits, cache.misses) == (_DAYS - 1, _DAYS + 1)
+
+
+# ------------------------------------------------------------------------------
+def _touch(path):
+
+    # moves a served file's modification time on, as if it were uploaded again
+    os.utime(str(path), (os.path.getatime(str(path)), os.path.getmtime(str(path)) + 60))
+
+
+# ------------------------------------------------------------------------------
+def test_cached_files_are_revalidated_from_the_manifest(served_files, tmp_path):
+
+    base_url, contents = served_files
+    urls = _urls(base_url)
+    jobs = [(url, 'auto', '201701/' + os.path.basename(url)) for url in urls]
+
+    def fetch():
+        # a run of its own, the cached files' metadata coming from the manifest on disk
+        cache = cmorph_cache.DownloadCache(str(tmp_path / 'cache'))
+        downloader = cmorph_download.Downloader(workers=4, cache=cache)
+        results = [bytes(result) for result in downloader.fetch_bytes(jobs)]
+        downloader.close()
+        cache.flush()
+        return downloader, results
+
+    fetch()
+    downloader, results = fetch()
+    assert results == contents
+    assert downloader.unchanged == _DAYS and downloader.changed == []
+
+    # one file changes on the server, another is uploaded again as it was
+    month_dir = tmp_path / 'archive' / '201701'
+    contents[2] = os.urandom(3000)
+    (month_dir / 'day_03.bz2').write_bytes(bz2.compress(contents[2]))
+    _touch(month_dir / 'day_03.bz2')
+    _touch(month_dir / 'day_05.bz2')
+
+    downloader, results = fetch()
+    assert results == contents
+    assert downloader.unchanged == _DAYS - 2
+    assert downloader.changed == ['201701/day_03.bz2']
@@ -0,0 +1,95 @@
+import bz2
+import os
+
+import pytest
+
+import cmorph_download
+import cmorph_ftp
+import cmorph_local_server
+import ingest_cmorph_daily
+
+pytest.importorskip('pyftpdlib')
+
+# ------------------------------------------------------------------------------
+# the days of January 2017 with a daily file on the server, the others are missing
+_DAYS = [1, 2, 3, 5, 6, 8, 9, 10]
+
+# the server's directory of the month's daily files, below its root
+_MONTH_PATH = 'data/02_RAW/2017/201701'
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def ftp_server(tmp_path):
+    """
+    Serves a month of raw daily files, with some days missing, over FTP.
+
+    :return: the server's base URL and the decompressed contents of each day's file
+    """
+
+    month_dir = tmp_path.joinpath('archive', *_MONTH_PATH.split('/'))
+    month_dir.mkdir(parents=True)
+    (month_dir / 'notes').mkdir()
+    contents = {}
+    for day in _DAYS:
+        data = os.urandom(3000 + day)
+        (month_dir / 'CMORPH_V1.0_RAW_0.25deg-DLY_00Z_201701{0:02d}.bz2'.format(day)).write_bytes(bz2.compress(data))
+        contents[day] = data
+
+    server, base_url = cmorph_local_server.serve_ftp(str(tmp_path / 'archive'))
+    yield base_url, contents
+    server.close_all()
+
+
+# ------------------------------------------------------------------------------
+def test_listing_gives_names_and_sizes(ftp_server, tmp_path):
+
+    base_url, _ = ftp_server
+    month_dir = tmp_path.joinpath('archive', *_MONTH_PATH.split('/'))
+    sizes = {path.name: path.stat().st_size for path in month_dir.iterdir() if path.is_file()}
+    downloader = cmorph_download.Downloader()
+
+    entries = downloader.list_directory(base_url + _MONTH_PATH)
+    files = downloader.list_files(base_url + _MONTH_PATH)
+    downloader.close()
+
+    assert entries.pop('notes')[0] == 'dir'
+    assert entries == {name: ('file', size) for name, size in sizes.items()}
+    assert files == sizes
+
+
+# ------------------------------------------------------------------------------
+def test_missing_files_are_not_requested(ftp_server, tmp_path, monkeypatch):
+
+    base_url, contents = ftp_server
+    monkeypatch.setattr(ingest_cmorph_daily, '_URL_BASE', base_url + 'data/')
+    downloader = cmorph_download.Downloader()
+
+    days = ingest_cmorph_daily._available_days(2017, 1, 'raw', downloader)
+    files = ingest_cmorph_daily._download_daily_files(str(tmp_path), 2017, 1, 'raw', downloader,
+                                                      in_memory=True, days=days)
+    downloader.close()
+
+    assert sorted(days) == _DAYS
+    assert [bytes(data) for data in files] == [contents[day] for day in _DAYS]
+
+    # a request for a missing file would have failed
+    assert downloader.failed == []
+    assert downloader.retried == 0
+
+
+# ------------------------------------------------------------------------------
+def test_session_is_reused(ftp_server):
+
+    base_url, contents = ftp_server
+    pool = cmorph_ftp.FtpSessionPool.for_url(base_url)
+
+    names = sorted(name for name, (kind, _, _) in pool.list(_MONTH_PATH).items() if kind == 'file')
+    for name, day in zip(names, _DAYS):
+        with pool.open(_MONTH_PATH + '/' + name) as transfer:
+            assert bz2.decompress(transfer.read()) == contents[day]
+    pool.close()
+
+    assert pool.listings == 1
+    assert pool.transfers == len(_DAYS)
+    assert pool.sessions_opened == 1
@@ -0,0 +1,100 @@
+import os
+import shutil
+import ssl
+import subprocess
+
+import pytest
+
+import cmorph_download
+import cmorph_http
+import cmorph_local_server
+
+# ------------------------------------------------------------------------------
+# number of files served
+_FILES = 10
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def https_server(tmp_path):
+    """
+    Serves a directory of small files over HTTPS, with a self-signed certificate.
+
+    :return: the base URL, the certificate file and the contents of each file
+    """
+
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is needed to make a self-signed certificate')
+
+    certfile = str(tmp_path / 'server.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', certfile, '-out', certfile],
+                   check=True, capture_output=True)
+
+    root_dir = tmp_path / 'archive'
+    root_dir.mkdir()
+    contents = []
+    for index in range(_FILES):
+        data = os.urandom(2000 + index)
+        (root_dir / 'file_{0}'.format(index)).write_bytes(data)
+        contents.append(data)
+
+    server, base_url = cmorph_local_server.serve_http(str(root_dir), certfile=certfile)
+    yield base_url, certfile, contents
+    server.shutdown()
+
+
+# ------------------------------------------------------------------------------
+def _urls(base_url):
+
+    return [base_url + 'file_{0}'.format(index) for index in range(_FILES)]
+
+
+# ------------------------------------------------------------------------------
+def test_connection_is_reused(https_server):
+
+    base_url, certfile, contents = https_server
+    pool = cmorph_http.ConnectionPool(ssl_context=ssl.create_default_context(cafile=certfile))
+
+    for url, data in zip(_urls(base_url), contents):
+        with pool.open(url) as response:
+            assert response.read() == data
+    pool.close()
+
+    assert pool.requests == _FILES
+    assert pool.connections_opened == 1
+    assert pool.connections_reused == _FILES - 1
+
+
+# ------------------------------------------------------------------------------
+def test_pool_size_is_respected(https_server):
+
+    base_url, certfile, contents = https_server
+    pool = cmorph_http.ConnectionPool(max_connections=2, ssl_context=ssl.create_default_context(cafile=certfile))
+
+    # concurrent requests each get a connection of their own, only two are kept once done
+    for _ in range(2):
+        responses = [pool.open(url) for url in _urls(base_url)[:5]]
+        for response, data in zip(responses, contents):
+            assert response.read() == data
+            response.close()
+    pool.close()
+
+    assert pool.connections_opened == 5 + 3
+    assert pool.connections_reused == 2
+
+
+# ------------------------------------------------------------------------------
+def test_downloader_reuses_connections(https_server, tmp_path, monkeypatch):
+
+    base_url, certfile, contents = https_server
+    monkeypatch.setenv('SSL_CERT_FILE', certfile)
+    downloader = cmorph_download.Downloader(workers=3, pool_size=2)
+
+    results = downloader.fetch_bytes([(url, None) for url in _urls(base_url)])
+    downloader.close()
+
+    assert [bytes(result) for result in results] == contents
+    assert downloader.pool.connections_reused > 0
+    assert downloader.pool.connections_opened + downloader.pool.connections_reused == _FILES
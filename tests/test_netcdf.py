@@ -0,0 +1,105 @@
+import netCDF4
+import numpy as np
+
+import cmorph_netcdf
+
+
+# ------------------------------------------------------------------------------
+def _dataset(netcdf_file, encoding=None):
+
+    dataset = netCDF4.Dataset(netcdf_file, 'w')
+    dataset.createDimension('time', None)
+    dataset.createDimension('lat', 2)
+    dataset.createDimension('lon', 3)
+    dataset.createVariable('time', 'i4', ('time',))
+    cmorph_netcdf.create_prcp_variable(dataset, ('time', 'lat', 'lon'), None, 0, 2, 3, encoding=encoding)
+    return dataset
+
+
+# ------------------------------------------------------------------------------
+def _step(value):
+
+    return np.full((2, 3), value, dtype='f4')
+
+
+# ------------------------------------------------------------------------------
+def test_slab_writer_fills_the_gaps(tmp_path):
+
+    with _dataset(str(tmp_path / 'slabs.nc')) as dataset:
+        variable = dataset.variables['prcp']
+        with cmorph_netcdf.SlabWriter(variable, slab_size=4, stop=10) as writer:
+            for time_index in (0, 1, 2, 5, 6):
+                writer.write(time_index, _step(time_index))
+
+        values = np.ma.filled(variable[:], np.NaN)[:, 0, 0]
+
+    assert len(values) == 10
+    assert list(values[[0, 1, 2, 5, 6]]) == [0.0, 1.0, 2.0, 5.0, 6.0]
+    assert np.all(np.isnan(values[[3, 4, 7, 8, 9]]))
+
+
+# ------------------------------------------------------------------------------
+def test_resume_after_the_last_ingested_step(tmp_path):
+
+    netcdf_file = str(tmp_path / 'resumed.nc')
+
+    # an interrupted run, which wrote 5 days of which the last 2 were missing files
+    with _dataset(netcdf_file) as dataset:
+        variable, time_variable = dataset.variables['prcp'], dataset.variables['time']
+        with cmorph_netcdf.SlabWriter(variable, slab_size=4, time_variable=time_variable,
+                                      time_values=np.arange(100, 110)) as writer:
+            for time_index in range(3):
+                writer.write(time_index, _step(1.0))
+            writer.write(4, _step(np.NaN))
+
+        assert len(time_variable) == 5
+        assert cmorph_netcdf.last_ingested_step(variable, time_variable, block_size=2) == 2
+
+    # the resumed run appends from the day following the last one holding data
+    with netCDF4.Dataset(netcdf_file, 'a') as dataset:
+        variable, time_variable = dataset.variables['prcp'], dataset.variables['time']
+        start = cmorph_netcdf.last_ingested_step(variable, time_variable) + 1
+        with cmorph_netcdf.SlabWriter(variable, slab_size=4, start=start, stop=10, time_variable=time_variable,
+                                      time_values=np.arange(100 + start, 110)) as writer:
+            for time_index in range(start, 10):
+                writer.write(time_index, _step(2.0))
+
+        assert list(time_variable[:]) == list(range(100, 110))
+        assert list(np.ma.filled(variable[:], np.NaN)[:, 0, 0]) == [1.0] * 3 + [2.0] * 7
+        assert cmorph_netcdf.last_ingested_step(variable, time_variable) == 9
+
+
+# ------------------------------------------------------------------------------
+def test_nothing_ingested(tmp_path):
+
+    with _dataset(str(tmp_path / 'empty.nc')) as dataset:
+        variable, time_variable = dataset.variables['prcp'], dataset.variables['time']
+        assert cmorph_netcdf.last_ingested_step(variable, time_variable) is None
+
+        # sized, but without time values
+        variable[3] = _step(1.0)
+        assert cmorph_netcdf.last_ingested_step(variable, time_variable) is None
+
+
+# ------------------------------------------------------------------------------
+def test_packed_values_round_trip(tmp_path):
+
+    with _dataset(str(tmp_path / 'packed.nc'), ('int16', 0.01)) as dataset:
+        variable = dataset.variables['prcp']
+        values = np.array([[0.0, 1.23, np.NaN], [655.34, 700.0, 0.05]], dtype='f4')
+        variable[0] = cmorph_netcdf.pack_values(variable, values)
+
+        read = variable[0]
+
+    # missing values are masked, values beyond the packed range clipped to it
+    assert list(np.ma.getmaskarray(read).ravel()) == [False, False, True, False, False, False]
+    assert np.allclose(read.compressed(), [0.0, 1.23, 655.34, 655.34, 0.05])
+    assert read[0, 0] == 0.0
+
+
+# ------------------------------------------------------------------------------
+def test_unpacked_values_are_unchanged(tmp_path):
+
+    with _dataset(str(tmp_path / 'float.nc')) as dataset:
+        values = np.array([[0.0, 1.23, np.NaN], [700.0, -1.0, 0.05]], dtype='f4')
+        assert cmorph_netcdf.pack_values(dataset.variables['prcp'], values) is values
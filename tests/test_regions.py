@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import cmorph_regions
+
+# ------------------------------------------------------------------------------
+# a coarse global grid like the CMORPH one, cell centers from the 0 meridian eastwards
+_LATS = np.arange(-58.75, 60.0, 2.5)
+_LONS = np.arange(1.25, 360.0, 2.5)
+
+
+# ------------------------------------------------------------------------------
+def test_window_within_the_grid():
+
+    window = cmorph_regions.compute_window(_LATS, _LONS, (20.0, -10.0, 40.0, 10.0))
+
+    assert window['columns'] == [(8, 16)]
+    assert np.all(window['lat_values'] >= -10.0) and np.all(window['lat_values'] <= 10.0)
+    assert window['lon_values'][0] == 21.25 and window['lon_values'][-1] == 38.75
+
+
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('bbox', [(-20.0, -10.0, 20.0, 10.0), (340.0, -10.0, 20.0, 10.0)])
+def test_window_across_the_seam(bbox):
+
+    window = cmorph_regions.compute_window(_LATS, _LONS, bbox)
+
+    # from the west bound to the end of the grid, then from its start to the east bound
+    assert window['columns'] == [(136, 144), (0, 8)]
+    lon_values = window['lon_values']
+    assert np.all(np.diff(lon_values) > 0)
+    assert lon_values[0] == bbox[0] + 1.25 and lon_values[-1] == bbox[0] + 40.0 - 1.25
+
+    data = np.arange(_LATS.size * _LONS.size).reshape(1, _LATS.size, _LONS.size) % _LONS.size
+    columns = cmorph_regions.slice_window(data, window)[0, 0]
+    assert list(columns) == list(range(136, 144)) + list(range(0, 8))
+
+
+# ------------------------------------------------------------------------------
+def test_window_across_the_dateline():
+
+    # the dateline is within the 0..360 grid, so a Pacific box is a single range
+    window = cmorph_regions.compute_window(_LATS, _LONS, (170.0, -10.0, -170.0, 10.0))
+
+    assert window['columns'] == [(68, 76)]
+    assert window['lon_values'][0] == 171.25 and window['lon_values'][-1] == 188.75
+
+
+# ------------------------------------------------------------------------------
+def test_empty_window():
+
+    with pytest.raises(ValueError):
+        cmorph_regions.compute_window(_LATS, _LONS, (20.0, 70.0, 40.0, 80.0))
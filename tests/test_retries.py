@@ -0,0 +1,121 @@
+import os
+import random
+
+import pytest
+
+import cmorph_download
+import cmorph_local_server
+
+# ------------------------------------------------------------------------------
+# number of files served, and the fraction of the requests failing
+_FILES = 40
+_FAULT_RATE = 0.4
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def archive(tmp_path):
+    """
+    :return: directory of files to serve, and the contents of each file
+    """
+
+    root_dir = tmp_path / 'archive'
+    root_dir.mkdir()
+    contents = []
+    for index in range(_FILES):
+        data = os.urandom(20000 + index)
+        (root_dir / 'file_{0:02d}'.format(index)).write_bytes(data)
+        contents.append(data)
+
+    # the faults injected by the servers are drawn at random
+    random.seed(0)
+
+    return str(root_dir), contents
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(params=['http', 'ftp'])
+def serve(request):
+    """
+    :return: function starting a server for a directory, with a fault rate,
+        returning the server's base URL, the server being stopped after the test
+    """
+
+    servers = []
+
+    def start(root_dir, fault_rate):
+        if request.param == 'http':
+            server, base_url = cmorph_local_server.serve_http(root_dir, fault_rate=fault_rate)
+            servers.append(server.shutdown)
+        else:
+            pytest.importorskip('pyftpdlib')
+            server, base_url = cmorph_local_server.serve_ftp(root_dir, fault_rate=fault_rate)
+            servers.append(server.close_all)
+        return base_url
+
+    yield start
+    for stop in servers:
+        stop()
+
+
+# ------------------------------------------------------------------------------
+def _urls(downloader, base_url):
+
+    # the sizes of files on an FTP server are only known from a listing, which truncated transfers are checked against
+    if downloader.can_list(base_url):
+        assert len(downloader.list_files(base_url)) == _FILES
+
+    return [base_url + 'file_{0:02d}'.format(index) for index in range(_FILES)]
+
+
+# ------------------------------------------------------------------------------
+def test_faults_are_retried_and_resumed(archive, serve, tmp_path):
+
+    root_dir, contents = archive
+    base_url = serve(root_dir, _FAULT_RATE)
+    downloader = cmorph_download.Downloader(workers=4, retries=20, backoff=0.0)
+
+    urls = _urls(downloader, base_url)
+    paths = downloader.fetch([(url, str(tmp_path / os.path.basename(url))) for url in urls])
+    downloader.close()
+
+    for path, data in zip(paths, contents):
+        with open(path, 'rb') as f_in:
+            assert f_in.read() == data
+    assert downloader.retried > 0
+    assert downloader.resumed > 0
+    assert downloader.failed == []
+
+
+# ------------------------------------------------------------------------------
+def test_faults_are_retried_and_resumed_in_memory(archive, serve):
+
+    root_dir, contents = archive
+    base_url = serve(root_dir, _FAULT_RATE)
+    downloader = cmorph_download.Downloader(workers=4, retries=20, backoff=0.0)
+
+    urls = _urls(downloader, base_url)
+    results = downloader.fetch_bytes([(url, None) for url in urls])
+    downloader.close()
+
+    assert [bytes(result) for result in results] == contents
+    assert downloader.retried > 0
+    assert downloader.resumed > 0
+    assert downloader.failed == []
+
+
+# ------------------------------------------------------------------------------
+def test_persistent_failures_are_reported(archive, serve, tmp_path):
+
+    root_dir, _ = archive
+    downloader = cmorph_download.Downloader(workers=4, retries=2, backoff=0.0)
+
+    # every transfer fails, the FTP listings aren't faulted
+    urls = _urls(downloader, serve(root_dir, 1.0))[:5]
+    paths = downloader.fetch([(url, str(tmp_path / os.path.basename(url))) for url in urls], skip_failed=True)
+    downloader.close()
+
+    assert paths == [None] * len(urls)
+    assert sorted(url for url, _ in downloader.failed) == urls
+    assert downloader.retried == 2 * len(urls)
+    assert not any(os.path.exists(str(tmp_path / os.path.basename(url))) for url in urls)